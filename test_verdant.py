@@ -4,13 +4,36 @@ Test script for Verdant MVP functionality.
 Run this to verify the implementation works correctly.
 """
 
+import os
 import sys
+import json
+import time
+import signal
+import asyncio
+import hashlib
+import tempfile
+import re
+import socket
+import threading
+import requests
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from types import SimpleNamespace
 
 # Add current directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from verdant import HardwareDetector, ModelDownloader
+import verdant
+from verdant import (
+    ContextPacker, RollingSummarizer, ModelLifecycle, MODEL_POOL,
+    ModelPrefetcher, LoadTimeLog, choose_memory_policy, PREFETCHER, autotune, UserPreferences,
+    pin_to_numa_node, restore_affinity, numa_thread_affinity, benchmark_numa, TokenizerService, count_tokens,
+    CancellationToken, cancel_on_sigint, measure_stop_latency,
+    ResponseCache, SemanticCache, SpeculativeDraft, find_draft_model, MODELS,
+    AIInference, KV_STATE_STORE, _BatchDecodeError, _SegmentState, HardwareDetector, ModelDownloader, SegmentedDownloader, ChecksumMismatch, MirrorSelector, ModelIntegrity, ModelPool, KVStateStore, PrefixSnapshotCache, build_chat_prompt,
+    VerdantServer, FairScheduler, SchedulerRejected, _iter_batch_items, _load_batch_checkpoint,
+)
 
 def test_hardware_detection():
     """Test hardware detection functionality."""
@@ -28,6 +51,100 @@ def test_hardware_detection():
         print(f"❌ Hardware detection failed: {e}")
         return False
 
+def test_hardware_profile():
+    """Test that the hardware profile is probed once, persisted and expired by TTL."""
+    print("\n🧪 Testing Hardware Profile...")
+    
+    saved = HardwareDetector._profile
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "hardware.json"
+            probes = []
+            real_probe, real_disk_speed = HardwareDetector._probe, HardwareDetector._disk_speed
+            def probe(identity):
+                probes.append(identity)
+                return real_probe(identity)
+            HardwareDetector._probe = staticmethod(probe)
+            try:
+                first = HardwareDetector.profile(refresh=True, path=path)
+                assert HardwareDetector.profile() is first  # cached for the process
+                HardwareDetector._profile = None
+                assert HardwareDetector.profile(path=path)["probed_at"] == first["probed_at"] and len(probes) == 1
+                HardwareDetector._profile = None
+                HardwareDetector.profile(path=path, ttl_s=0)  # expired on disk
+                assert len(probes) == 2
+                # The disk probe is left out of profile() and measured once on request
+                assert "disk_mbps" not in first
+                HardwareDetector._disk_speed = staticmethod(lambda directory: probes.append("disk") or
+                                                            {"write": 100.0, "read": 200.0})
+                assert HardwareDetector.disk_speed(path=path) == {"write": 100.0, "read": 200.0}
+                assert HardwareDetector.disk_speed(path=path)["read"] == 200.0 and probes.count("disk") == 1
+                assert json.loads(path.read_text())["disk_mbps"]["write"] == 100.0
+            finally:
+                HardwareDetector._probe = staticmethod(real_probe)
+                HardwareDetector._disk_speed = staticmethod(real_disk_speed)
+            assert 1 <= first["physical_cores"] <= first["logical_cores"]
+            assert all(flag in HardwareDetector.SIMD_FLAGS for flag in first["simd"])
+            rec = HardwareDetector.recommended_settings()
+            assert rec["n_threads"] == first["physical_cores"] and rec["n_ctx"] in (1024, 2048, 4096)
+        print(f"✅ {first['physical_cores']}/{first['logical_cores']} cores, SIMD {first['simd']}, "
+              f"caches {first['cache_kb']}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Hardware profile test failed: {e}")
+        return False
+    finally:
+        HardwareDetector._profile = saved
+
+def test_numa_topology():
+    """Test NUMA topology parsing, node pinning and the pinned-vs-unpinned benchmark."""
+    print("\n🧪 Testing NUMA Topology...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for node, cpus, kb in ((0, "0-3,8-11", 16318588), (1, "4-7,12-15", 16510000), (2, "", 8000000)):
+                d = Path(tmp) / f"node{node}"
+                d.mkdir()
+                (d / "cpulist").write_text(cpus + "\n")
+                (d / "meminfo").write_text(f"Node {node} MemTotal:       {kb} kB\nNode {node} MemFree: 1 kB\n")
+            nodes = HardwareDetector.numa_nodes(Path(tmp))
+            assert [n["node"] for n in nodes] == [0, 1]  # memory-only node 2 skipped
+            assert nodes[1]["cpus"] == [4, 5, 6, 7, 12, 13, 14, 15] and nodes[0]["memory_gb"] == 15.56
+        local = HardwareDetector.numa_nodes()
+        if local and hasattr(os, "sched_setaffinity"):
+            previous = pin_to_numa_node(local[0]["node"])
+            assert os.sched_getaffinity(0) == set(local[0]["cpus"])
+            restore_affinity(previous)
+            assert os.sched_getaffinity(0) == previous
+            # An AIInference pins only the thread holding its lock, and only while it holds it
+            lock = verdant._NumaLock(threading.RLock(), local[0]["node"])
+            with lock:
+                with lock:
+                    assert os.sched_getaffinity(threading.get_native_id()) == set(local[0]["cpus"])
+                assert os.sched_getaffinity(threading.get_native_id()) == set(local[0]["cpus"])
+            assert os.sched_getaffinity(0) == previous
+            with numa_thread_affinity(-1) as pinned:
+                assert not pinned
+            class _Timed:
+                pool_key = None
+                def __init__(self, delay):
+                    self.delay, self.last_usage = delay, {}
+                def generate_response(self, prompt, max_tokens=128):
+                    time.sleep(self.delay)
+                    self.last_usage = {"completion_tokens": 10}
+                    return "x" * 40
+            result = benchmark_numa(Path("unused.gguf"), node=local[0]["node"], runs=1,
+                                    factory=lambda node: _Timed(0.02 if node is None else 0.01))
+            assert result["pinned_tps"] > result["unpinned_tps"] and result["speedup"] > 1
+            assert os.sched_getaffinity(0) == previous
+        print(f"✅ {len(local)} local NUMA node(s); fake topology parsed")
+        
+        return True
+    except Exception as e:
+        print(f"❌ NUMA topology test failed: {e}")
+        return False
+
 def test_model_downloader():
     """Test model downloader functionality."""
     print("\n🧪 Testing Model Downloader...")
@@ -45,6 +162,1095 @@ def test_model_downloader():
         print(f"❌ Model downloader test failed: {e}")
         return False
 
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serves server.payload with byte ranges, throttled per connection like a busy CDN."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.payload
+        first, last, status = 0, len(data) - 1, 200
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and self.server.ranges and (if_range is None or if_range == self.server.etag):
+            first = int(match.group(1))
+            last = min(int(match.group(2) or last), last)
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(last - first + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{len(data)}")
+        self.send_header("ETag", self.server.etag)
+        if self.server.linked:
+            self.send_header("X-Linked-Etag", f'"{self.server.linked}"')
+        self.end_headers()
+        step = 64 * 1024
+        for offset in range(first, last + 1, step):
+            if self.server.drop_after is not None and self.server.served >= self.server.drop_after:
+                self.close_connection = True  # Wi-Fi gone: hang up mid-body
+                return
+            chunk = data[offset:min(offset + step, last + 1)]
+            self.wfile.write(chunk)
+            self.server.served += len(chunk)
+            time.sleep(step / self.server.bytes_per_s)
+
+def _range_server(payload, bytes_per_s=4 * 1024 * 1024, ranges=True):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    server.daemon_threads = True
+    server.handle_error = lambda request, address: None  # clients hang up mid-body on purpose
+    server.payload, server.bytes_per_s, server.ranges = payload, bytes_per_s, ranges
+    server.etag, server.drop_after, server.served, server.linked = '"v1"', None, 0, ""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/model.gguf"
+
+def test_segmented_download():
+    """Test parallel Range downloads against a throttled local server, and the single-stream fallback."""
+    print("\n🧪 Testing Segmented Download...")
+    
+    try:
+        payload = os.urandom(4 * 1024 * 1024 + 12345)
+        server, url = _range_server(payload)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                dest = Path(tmp) / "model.gguf.part"
+                seen = []
+                single = SegmentedDownloader(connections=1, max_connections=1, segment_mb=0.5).download(url, dest)
+                assert dest.read_bytes() == payload
+                parallel = SegmentedDownloader(connections=4, max_connections=8, segment_mb=0.5,
+                                               sample_s=0.2).download(url, dest, on_progress=lambda d, t: seen.append(d))
+                assert dest.read_bytes() == payload
+                assert parallel["segments"] == 9 and parallel["connections"] >= 4
+                assert seen[-1] == len(payload) and seen == sorted(seen)
+                speedup = single["seconds"] / parallel["seconds"]
+                assert speedup > 1.5, f"only {speedup:.2f}x faster"
+                server.ranges = False
+                plain = SegmentedDownloader(segment_mb=0.5).download(url, dest)
+                assert plain["connections"] == 1 and dest.read_bytes() == payload
+                # A retired worker leaves the active count in the critical section that retired it
+                state, released = _SegmentState([(0, 9)]), []
+                class _Lock:
+                    def __enter__(self):
+                        return self
+                    def __exit__(self, *exc):
+                        released.append(state.active)
+                state.lock, state.active, state.target = _Lock(), 2, 1
+                SegmentedDownloader()._worker(state, dest)
+                assert released == [1] and list(state.queue) == [0]
+        finally:
+            server.shutdown()
+        print(f"✅ {single['mb_per_s']:.1f} MB/s on 1 connection vs {parallel['mb_per_s']:.1f} MB/s "
+              f"on {parallel['connections']} ({speedup:.1f}x)")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Segmented download test failed: {e}")
+        return False
+
+def test_resumable_download():
+    """Test that a dropped download resumes from its journal, and restarts when the file changed."""
+    print("\n🧪 Testing Resumable Download...")
+    
+    try:
+        payload = os.urandom(3 * 1024 * 1024 + 999)
+        server, url = _range_server(payload, bytes_per_s=64 * 1024 * 1024)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                dest = Path(tmp) / "model.gguf.part"
+                journal = Path(tmp) / "model.gguf.part.json"
+                downloader = SegmentedDownloader(connections=2, max_connections=2, segment_mb=0.25,
+                                                 segment_retries=0)
+                server.drop_after = 1536 * 1024
+                try:
+                    downloader.download(url, dest, journal_path=journal)
+                    raise AssertionError("download should have failed")
+                except (IOError, requests.RequestException):
+                    pass
+                kept = sum(end - start for start, end in json.loads(journal.read_text())["done"])
+                assert dest.exists() and kept > 0
+                server.drop_after, server.served = None, 0
+                seen = []
+                stats = downloader.download(url, dest, on_progress=lambda d, t: seen.append(d), journal_path=journal)
+                assert dest.read_bytes() == payload and not journal.exists()
+                assert stats["resumed"] == kept and seen[0] == kept
+                assert stats["sha256"] == hashlib.sha256(payload).hexdigest()
+                assert server.served <= len(payload) - kept + 1  # + the 1-byte probe
+                # A changed file on the same URL is not stitched onto the old bytes
+                server.drop_after = 512 * 1024
+                try:
+                    downloader.download(url, dest, journal_path=journal)
+                except (IOError, requests.RequestException):
+                    pass
+                server.payload, server.etag, server.drop_after = os.urandom(len(payload)), '"v2"', None
+                stats = downloader.download(url, dest, journal_path=journal)
+                assert stats["resumed"] == 0 and dest.read_bytes() == server.payload
+        finally:
+            server.shutdown()
+        print(f"✅ Resumed at {kept} of {len(payload)} bytes; changed file restarted from zero")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Resumable download test failed: {e}")
+        return False
+
+def test_download_checksum():
+    """Test inline SHA-256 over parallel segments, pinned and X-Linked-Etag checks, and rejection."""
+    print("\n🧪 Testing Download Checksum...")
+    
+    try:
+        payload = os.urandom(2 * 1024 * 1024 + 4321)
+        digest = hashlib.sha256(payload).hexdigest()
+        server, url = _range_server(payload, bytes_per_s=64 * 1024 * 1024)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                dest = Path(tmp) / "model.gguf.part"
+                journal = Path(tmp) / "model.gguf.part.json"
+                stats = SegmentedDownloader(connections=4, segment_mb=0.25).download(
+                    url, dest, journal_path=journal, expected_sha256=digest)
+                assert stats["sha256"] == digest and stats["verified"] and stats["reread"] == 0
+                # A hash buffer too small for out-of-order segments reads back only what it had to drop
+                stats = SegmentedDownloader(connections=4, segment_mb=0.25, hash_buffer_mb=0.25).download(url, dest)
+                assert stats["sha256"] == digest and not stats["verified"] and stats["reread"] < len(payload)
+                server.linked = "0" * 64
+                try:
+                    SegmentedDownloader(connections=4, segment_mb=0.25).download(url, dest, journal_path=journal)
+                    raise AssertionError("a mismatching X-Linked-Etag must be rejected")
+                except ChecksumMismatch:
+                    pass
+                assert not dest.exists() and not journal.exists()
+                server.linked = digest
+                stats = SegmentedDownloader(segment_mb=4).download(url, dest)  # single stream
+                assert stats["verified"] and stats["segments"] == 1 and dest.read_bytes() == payload
+        finally:
+            server.shutdown()
+        print(f"✅ SHA-256 verified inline ({digest[:12]}…); mismatching download discarded before rename")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Download checksum test failed: {e}")
+        return False
+
+def test_mirror_selector():
+    """Test concurrent mirror probing, ranking, mid-download mirror sharing and the circuit breaker."""
+    print("\n🧪 Testing Mirror Selector...")
+    
+    try:
+        payload = os.urandom(2 * 1024 * 1024)
+        slow, slow_url = _range_server(payload, bytes_per_s=1024 * 1024)
+        fast, fast_url = _range_server(payload, bytes_per_s=16 * 1024 * 1024)
+        other, other_url = _range_server(payload[:-100])  # a different quantization, say
+        dead_url = "http://127.0.0.1:9/model.gguf"
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = Path(tmp) / "mirrors.json"
+                selector = MirrorSelector(path=path, probe_bytes=128 * 1024, timeout=2, failure_threshold=2)
+                groups = selector.rank([dead_url, slow_url, other_url, fast_url])
+                assert groups == [[fast_url, slow_url], [other_url]], groups
+                assert selector.expected_seconds(fast_url) < selector.expected_seconds(slow_url)
+                selector.rank([dead_url])
+                assert selector.is_open(dead_url) and not selector.is_open(fast_url)
+                assert selector.probe([dead_url])[0]["error"] == "circuit open"
+                reloaded = MirrorSelector(path=path)
+                assert reloaded.is_open(dead_url) and reloaded.stats()[MirrorSelector.host(fast_url)]["mb_per_s"] > 0
+                reloaded.record(dead_url, True)
+                assert not MirrorSelector(path=path).is_open(dead_url)
+                # Starting on the slow mirror, most segments move over to the fast one
+                dest = Path(tmp) / "model.gguf.part"
+                stats = SegmentedDownloader(connections=2, max_connections=2, segment_mb=0.125).download(
+                    slow_url, dest, mirrors=[fast_url, other_url, dead_url])
+                assert dest.read_bytes() == payload
+                assert set(stats["mirrors"]) == {slow_url, fast_url}
+                assert stats["mirrors"][fast_url] > stats["mirrors"][slow_url]
+        finally:
+            for server in (slow, fast, other):
+                server.shutdown()
+        share = stats["mirrors"][fast_url] / len(payload)
+        print(f"✅ Ranked fast mirror first, dead one tripped the breaker; {share:.0%} of bytes from the fast mirror")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Mirror selector test failed: {e}")
+        return False
+
+def test_chunk_manifest():
+    """Test the chunk manifest, parallel verification, Range repair of bad chunks and the health check."""
+    print("\n🧪 Testing Chunk Manifest...")
+    
+    try:
+        payload = os.urandom(5 * 1024 * 1024 + 7)
+        digest = hashlib.sha256(payload).hexdigest()
+        server, url = _range_server(payload, bytes_per_s=64 * 1024 * 1024)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                model = Path(tmp) / "model.gguf"
+                stats = SegmentedDownloader(connections=3, segment_mb=0.5).download(url, model)
+                assert stats["chunks"] == [digest]  # smaller than one 16 MB manifest chunk
+                assert ModelIntegrity.build_manifest(model, "0" * 64, [url], chunk_mb=1) is None
+                manifest = ModelIntegrity.build_manifest(model, digest, [url], chunk_mb=1)
+                assert len(manifest["chunks"]) == 6 and ModelIntegrity.verify(model) == []
+                with open(model, "r+b") as f:
+                    for offset in (2 * 1024 * 1024 + 5, 4 * 1024 * 1024 + 1):
+                        f.seek(offset)
+                        byte = f.read(1)
+                        f.seek(offset)
+                        f.write(bytes([byte[0] ^ 1]))  # one flipped bit
+                bad = ModelIntegrity.verify(model, workers=4)
+                assert bad == [2, 4], bad
+                server.served = 0
+                assert ModelIntegrity.repair(model, bad) == []
+                assert model.read_bytes() == payload and server.served == 2 * 1024 * 1024
+                # Background health check: corrupt the tail, let it find and repair it
+                with open(model, "ab") as f:
+                    f.write(b"junk")
+                results = []
+                # Never rewritten while a pooled model has the file mapped
+                key = ModelPool.make_key(model, 2048, 1, 0)
+                verdant.MODEL_POOL.acquire(key, object)
+                try:
+                    ModelIntegrity.start_health_check(model, on_done=results.append).join(timeout=10)
+                finally:
+                    verdant.MODEL_POOL.evict(key)
+                assert results.pop()["bad"] == 1 and model.read_bytes().endswith(b"junk")
+                ModelIntegrity.start_health_check(model, on_done=results.append).join(timeout=10)
+                assert results[0]["repaired"] == 1 and results[0]["bad"] == 0
+                assert model.read_bytes() == payload
+                assert ModelIntegrity.describe(results[0]).startswith("🩺 Repaired 1")
+                # validate_model only checks size and manifest presence; hashing is left to the health check
+                downloader = ModelDownloader(model_dir=tmp)
+                target = downloader.model_dir / MODELS["tinymistral-248m-q8"].filename
+                model.rename(target)
+                ModelIntegrity.manifest_path(model).rename(ModelIntegrity.manifest_path(target))
+                def no_hashing(*args, **kwargs):
+                    raise AssertionError("validate_model hashed the file")
+                real_verify, ModelIntegrity.verify = ModelIntegrity.verify, staticmethod(no_hashing)
+                try:
+                    assert downloader.validate_model("tinymistral-248m-q8")
+                    with open(target, "ab") as f:
+                        f.write(b"junk")
+                    assert not downloader.validate_model("tinymistral-248m-q8")
+                finally:
+                    ModelIntegrity.verify = staticmethod(real_verify)
+        finally:
+            server.shutdown()
+        print(f"✅ 2 of 6 chunks corrupted and re-fetched (2 MB instead of {len(payload) // (1024 * 1024)} MB)")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Chunk manifest test failed: {e}")
+        return False
+
+def test_model_pool():
+    """Test that the model pool reuses instances and evicts LRU entries."""
+    print("\n🧪 Testing Model Pool...")
+    
+    try:
+        pool = ModelPool(max_models=1)
+        loads = []
+        def loader():
+            loads.append(1)
+            return object()
+        key_a = ModelPool.make_key(Path("a.gguf"), 2048, 4, 0)
+        key_b = ModelPool.make_key(Path("b.gguf"), 2048, 4, 0)
+        first = pool.acquire(key_a, loader)
+        assert pool.acquire(key_a, loader) is first
+        pool.acquire(key_b, loader)
+        stats = pool.stats()
+        assert len(loads) == 2 and stats["hits"] == 1 and stats["misses"] == 2
+        assert stats["evictions"] == 1 and stats["loaded"] == 1
+        # A model that is generating is never closed to make room
+        busy = pool.acquire(key_b, loader)
+        held, done = threading.Event(), threading.Event()
+        def generate():
+            with pool.lock_for(busy):
+                held.set()
+                done.wait(5)
+        worker = threading.Thread(target=generate)
+        worker.start()
+        held.wait(5)
+        pool.acquire(ModelPool.make_key(Path("c.gguf"), 2048, 4, 0), loader)
+        done.set()
+        worker.join()
+        assert pool.stats()["loaded"] == 2 and pool._entry_for(busy) is not None
+        print(f"✅ Model pool stats: {stats}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Model pool test failed: {e}")
+        return False
+
+def test_chat_prompt_prefix():
+    """Test that multi-turn transcripts only ever grow by appending."""
+    print("\n🧪 Testing Chat Prompt Prefix...")
+    
+    try:
+        history = [{"role": "user", "content": "Hi"}]
+        first = build_chat_prompt(history)
+        history += [{"role": "assistant", "content": "Hello!"}, {"role": "user", "content": "Summarize this"}]
+        second = build_chat_prompt(history)
+        assert second.startswith(first)
+        cli = build_chat_prompt([{"user": "Hi", "assistant": "Hello!"}, {"user": "Summarize this"}])
+        assert cli == second
+        print(f"✅ Transcript grows by suffix only ({len(first)} → {len(second)} chars)")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Chat prompt test failed: {e}")
+        return False
+
+class _FakeLlama:
+    """Stand-in for llama_cpp.Llama: byte tokens, a KV cache of token ids and a canned reply."""
+
+    def __init__(self, reply="Fine.", n_ctx=4096):
+        self.ids, self.reply, self._n_ctx = [], reply, n_ctx
+        self.calls, self.saves, self.evaluated = [], 0, 0
+
+    @property
+    def input_ids(self):
+        return np.array(self.ids, dtype=np.intc)
+
+    @property
+    def n_tokens(self):
+        return len(self.ids)
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, data, add_bos=True, special=False):
+        return ([1] if add_bos else []) + list(data)
+
+    def detokenize(self, tokens):
+        return bytes(t for t in tokens if t > 1)
+
+    def reset(self):
+        self.ids = []
+
+    def eval(self, tokens):
+        self.evaluated += len(tokens)
+        self.ids += list(tokens)
+
+    def save_state(self):
+        self.saves += 1
+        return SimpleNamespace(input_ids=np.array(self.ids, dtype=np.intc), n_tokens=len(self.ids),
+                               llama_state=b"", llama_state_size=len(self.ids))
+
+    def load_state(self, state):
+        self.ids = [int(t) for t in state.input_ids[:state.n_tokens]]
+
+    def __call__(self, prompt, max_tokens=16, stream=False, **kwargs):
+        tokens = list(prompt) if isinstance(prompt, list) else self.tokenize(prompt.encode())
+        self.calls.append(tokens)
+        keep = 0
+        for a, b in zip(self.ids, tokens[:-1]):  # llama.cpp reuses the matching prefix
+            if a != b:
+                break
+            keep += 1
+        self.evaluated += len(tokens) - keep
+        text = (self.reply(bytes(t for t in tokens if t > 1).decode()) if callable(self.reply) else self.reply)
+        text = text[:max_tokens]
+        self.ids = self.ids[:keep] + tokens[keep:] + list(text.encode())
+        if stream:
+            return iter([{"choices": [{"text": c}]} for c in text])
+        return {"choices": [{"text": text, "finish_reason": "stop"}]}
+
+def _fake_ai(model_path, llm=None, **kwargs):
+    """AIInference running on a _FakeLlama (llama_cpp is not needed)."""
+    class FakeAI(AIInference):
+        def _load_model(self):
+            self.llm = llm or _FakeLlama()
+            self.tokenizer = TokenizerService(self.llm)
+            self.n_ctx = self.llm.n_ctx()
+            self.pool_key = (str(self.model_path), self.n_ctx)
+    return FakeAI(Path(model_path), use_cache=False, **kwargs)
+
+def _join_threads(name, timeout=5):
+    for t in threading.enumerate():
+        if t.name == name:
+            t.join(timeout)
+
+def test_session_state_save():
+    """Test that a chat's KV state is saved after the reply, off the lock, and never when stale."""
+    print("\n🧪 Testing Session State Save...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            model = Path(tmp) / "fake.gguf"
+            model.write_bytes(b"GGUF" + os.urandom(64))
+            ai = _fake_ai(model)
+            transcript = build_chat_prompt([{"role": "user", "content": "Hello there"}])
+            saves_while_streaming = []
+            for _ in ai.generate_chat_stream(transcript, session_id="save-test-a"):
+                saves_while_streaming.append(ai.llm.saves)
+            _join_threads("verdant-kv-save")
+            assert saves_while_streaming and max(saves_while_streaming) == saves_while_streaming[0]
+            assert ai.llm.saves == saves_while_streaming[0] + 1
+            state = KV_STATE_STORE.get(KVStateStore.make_key("save-test-a", ai.state_model_id()))
+            assert state is not None and list(state.input_ids) == ai.llm.ids
+            # Another request takes over the cache before the save runs: nothing stale is stored
+            saves = ai.llm.saves
+            with ai._llm_lock:
+                list(ai.generate_chat_stream(transcript + " more", session_id="save-test-b"))
+                ai.llm.ids = ai.llm.ids[:5]
+            _join_threads("verdant-kv-save")
+            assert KV_STATE_STORE.get(KVStateStore.make_key("save-test-b", ai.state_model_id())) is None
+            assert ai.llm.saves == saves
+            KV_STATE_STORE.discard_session("save-test-a")
+        print("✅ KV state saved after the stream ended; stale snapshot skipped")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Session state save test failed: {e}")
+        return False
+
+def test_summarizer_keeps_chat_cache():
+    """Test that a summarizer run leaves the chat's KV cache, usage and prefix metrics alone."""
+    print("\n🧪 Testing Summarizer Isolation...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            model = Path(tmp) / "fake.gguf"
+            model.write_bytes(b"GGUF" + os.urandom(64))
+            ai = _fake_ai(model)
+            transcript = build_chat_prompt([{"role": "user", "content": "What is osmosis?"}])
+            list(ai.generate_chat_stream(transcript))
+            cached, usage, metrics = list(ai.llm.ids), dict(ai.last_usage), dict(ai.metrics)
+            turns = [[("user", "What is osmosis?"), ("assistant", "Fine.")]]
+            assert ai.summarize_turns(turns) == "Fine."
+            assert ai.llm.ids == cached and ai.last_usage == usage and ai.metrics == metrics
+            # A cancelled run stops before prefilling and still restores the cache
+            cancel = CancellationToken()
+            cancel.cancel()
+            evaluated = ai.llm.evaluated
+            assert ai.summarize_turns(turns, cancel=cancel) is None
+            assert ai.llm.evaluated == evaluated and ai.llm.ids == cached
+            # The next chat turn only prefills the new tokens
+            follow_up = transcript + "Fine.</s>[INST] And diffusion? [/INST]"
+            list(ai.generate_chat_stream(follow_up))
+            assert ai.llm.evaluated - evaluated < len(follow_up) - len(transcript) + 8
+        print("✅ Chat prefix survived the summarizer")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Summarizer isolation test failed: {e}")
+        return False
+
+def test_generate_batch():
+    """Test batch generation: sequential fallback, callback order and recovery from a failed decode."""
+    print("\n🧪 Testing Batch Generation...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            model = Path(tmp) / "fake.gguf"
+            model.write_bytes(b"GGUF" + os.urandom(64))
+            def reply(prompt):
+                n = re.findall(r"Q(\d)", prompt)[-1]
+                # Sampling is not deterministic: a regenerated reply would not start with "Ans"
+                return "wer " + n if prompt.endswith("Ans") else "Answer " + n
+            ai = _fake_ai(model, llm=_FakeLlama(reply=reply))
+            events = []
+            callbacks = [lambda chunk, i=i: events.append((i, chunk)) for i in range(3)]
+            results = ai.generate_batch(["Q0?", "Q1?", "Q2?"], max_tokens=32, callbacks=callbacks)
+            assert results == ["Answer 0", "Answer 1", "Answer 2"], results
+            assert [i for i, _ in events] == sorted(i for i, _ in events)  # one prompt after another
+            assert all("".join(c for j, c in events if j == i) == results[i] for i in range(3))
+            premium, verdant.IS_PREMIUM = verdant.IS_PREMIUM, True
+            try:
+                # No low-level batch API on this llm: falls back before anything is emitted
+                assert ai.generate_batch(["Q3", "Q4"], max_tokens=32) == ["Answer 3", "Answer 4"]
+                # llama_decode fails mid-way: finished sequences are kept, the rest continued from what was streamed
+                def failing(prompts, max_tokens, cbs, cancel):
+                    cbs[0]("Answer 5")
+                    cbs[1]("Ans")
+                    raise _BatchDecodeError("llama_decode returned 1", ["Answer 5", "Ans"], [True, False], [8, 3])
+                ai._generate_batch_parallel = failing
+                events.clear()
+                results = ai.generate_batch(["Q5", "Q6"], max_tokens=32, callbacks=callbacks[:2])
+                assert results == ["Answer 5", "Answer 6"], results
+                assert "".join(c for i, c in events if i == 1) == "Answer 6"
+                assert bytes(t for t in ai.llm.calls[-1] if t > 1).decode().endswith("[/INST]Ans")
+                assert len([e for e in events if e[0] == 0]) == 1
+            finally:
+                verdant.IS_PREMIUM = premium
+        print(f"✅ {len(results)} replies; callbacks in order; decode failure recovered sequentially")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Batch generation test failed: {e}")
+        return False
+
+def test_kv_state_store():
+    """Test RAM LRU tier, disk spill and model invalidation of KV states."""
+    print("\n🧪 Testing KV State Store...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = KVStateStore(Path(tmp), max_ram_mb=1)
+            state = lambda n: SimpleNamespace(llama_state_size=700 * 1024, input_ids=list(range(n)), n_tokens=n)
+            key_a = KVStateStore.make_key("chat-a", "model1")
+            key_b = KVStateStore.make_key("chat-b", "model1")
+            store.put(key_a, state(3))
+            store.put(key_b, state(5))
+            assert (Path(tmp) / f"{key_a}.kvstate").exists()
+            assert list(store.get(key_a).input_ids) == [0, 1, 2]
+            assert store.stats()["disk_hits"] == 1
+            store.discard_session("chat-a", keep_model_id="model2")
+            assert store.get(key_a) is None and store.get(key_b) is not None
+            # Files are raw bytes plus a JSON header; a pickle planted in the directory is ignored
+            full = SimpleNamespace(input_ids=np.array([5, 6, 7], dtype=np.intc), n_tokens=3, seed=1,
+                                   scores=np.ones((3, 4), dtype=np.single), llama_state=b"\x00kv\xff",
+                                   llama_state_size=4)
+            back = KVStateStore.decode(KVStateStore.encode(full))
+            assert list(back.input_ids) == [5, 6, 7] and back.scores.shape == (3, 4)
+            assert back.llama_state == b"\x00kv\xff" and back.n_tokens == 3
+            key_c = KVStateStore.make_key("chat-c", "model1")
+            (Path(tmp) / f"{key_c}.kvstate").write_bytes(b"\x80\x04cos\nsystem\n.")
+            assert store.get(key_c) is None
+            assert KVStateStore(Path(tmp)).ram_budget_bytes() <= 1024 ** 3
+            print(f"✅ KV state store stats: {store.stats()}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ KV state store test failed: {e}")
+        return False
+
+def test_prefix_snapshots():
+    """Test preset prefix matching and cleanup when presets.json changes."""
+    print("\n🧪 Testing Prefix Snapshots...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            presets = Path(tmp) / "presets.json"
+            presets.write_text('{"grammar_fix": "Fix grammar."}', encoding="utf-8")
+            store = KVStateStore(Path(tmp) / "states", write_through=True)
+            cache = PrefixSnapshotCache(store, presets)
+            chat = build_chat_prompt([{"role": "user", "content": "Fix grammar.\n\nthey is here"}])
+            prefix = cache.match(chat)
+            assert prefix and prefix.endswith("Fix grammar.\n\n")
+            assert cache.match("<s>[INST] Fix grammar.\n\nUser prompt: hi [/INST]")
+            # Building a snapshot on a miss already serves this request's prefix
+            model = Path(tmp) / "fake.gguf"
+            model.write_bytes(b"GGUF" + os.urandom(64))
+            ai = _fake_ai(model)
+            tokens = ai._tokenize(chat)
+            usable = len(ai._tokenize(prefix))
+            assert ai._restore_prefix_snapshot(chat, tokens, 0, cache) == usable and cache.builds == 1
+            assert ai.llm.ids == tokens[:usable]
+            ai.llm.reset()
+            assert ai._restore_prefix_snapshot(chat, tokens, 0, cache) == usable and cache.hits == 1
+            key = KVStateStore.make_key(cache.prefix_name(prefix), "model1")
+            store.put(key, SimpleNamespace(input_ids=[1, 2]))
+            presets.write_text('{"grammar_fix": "Correct the grammar."}', encoding="utf-8")
+            os.utime(presets, ns=(1, 1))
+            assert cache.match(chat) != prefix and not store.contains(key)
+            print(f"✅ {len(cache.prefixes())} prefixes tracked; stale snapshot purged")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Prefix snapshot test failed: {e}")
+        return False
+
+def test_batch_checkpoint():
+    """Test JSONL batch input parsing and resume from a torn output file."""
+    print("\n🧪 Testing Batch Checkpoint...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            in_path = Path(tmp) / "in.jsonl"
+            in_path.write_text('"plain"\n{"id": "q2", "prompt": "hi", "preset": "p"}\nnot json\n', encoding="utf-8")
+            items = list(_iter_batch_items(in_path, None, {"p": "Be brief."}))
+            assert items[0] == ("line-1", "plain", 512)
+            assert items[1][0] == "q2" and items[1][1].startswith("Be brief.")
+            out_path = Path(tmp) / "out.jsonl"
+            out_path.write_text('{"id": "line-1", "key": "k1", "response": "ok"}\n'
+                                '{"id": "q2", "key": "k2", "error": "boom"}\n'
+                                '{"id": "q3", "key": "k3", "resp', encoding="utf-8")
+            done, responses = _load_batch_checkpoint(out_path)
+            assert done == {"line-1"} and responses == {"k1": "ok"}
+            assert out_path.read_text(encoding="utf-8").endswith('"boom"}\n')
+            print(f"✅ Parsed {len(items)} items; resume keeps {len(done)} finished result(s)")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Batch checkpoint test failed: {e}")
+        return False
+
+class _EchoModel:
+    """Stand-in for AIInference that streams the prompt back word by word."""
+    temperature = 0.7
+    top_p = 0.9
+    stopped = False
+
+    def generate_chat_stream(self, transcript, max_tokens=512, session_id=None, cancel=None):
+        yield from ["Hello", " there"]
+
+    def generate_response_stream(self, prompt, max_tokens=512, cancel=None):
+        if prompt == "boom":
+            yield "❌ Generation error: boom"
+            return
+        for word in prompt.split():
+            if cancel is not None and cancel.cancelled:
+                self.stopped = True
+                return
+            if word == "wait":
+                time.sleep(0.05)
+            yield word + " "
+
+    def count_tokens(self, text, special=False):
+        return len(text.split())
+
+    def pack_chat(self, history, packer, max_tokens=512, pinned=None, sticky=True, system_prompt=None):
+        return build_chat_prompt(history, system_prompt)
+
+def test_http_server():
+    """Test the OpenAI-compatible server on localhost, with and without streaming."""
+    print("\n🧪 Testing HTTP Server...")
+    
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    model = _EchoModel()
+    server = VerdantServer(model, port=0, model_name="test")
+    try:
+        import requests
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+        base = f"http://127.0.0.1:{server.port}/v1"
+        r = requests.post(f"{base}/chat/completions", json={"messages": [{"role": "user", "content": "Hi"}]}, timeout=5)
+        assert r.json()["choices"][0]["message"]["content"] == "Hello there"
+        assert r.json()["choices"][0]["finish_reason"] == "stop"
+        r = requests.post(f"{base}/completions", json={"prompt": "one two", "max_tokens": 2}, timeout=5)
+        assert r.json()["choices"][0]["finish_reason"] == "length"
+        r = requests.post(f"{base}/completions", json={"prompt": "boom"}, timeout=5)
+        assert r.status_code == 500 and "boom" in r.json()["error"]["message"]
+        r = requests.post(f"{base}/completions", json={"prompt": "one two", "stream": True}, stream=True, timeout=5)
+        events = [line[6:] for line in r.iter_lines(decode_unicode=True) if line.startswith("data: ")]
+        assert events[-1] == "[DONE]"
+        text = "".join(json.loads(e)["choices"][0]["text"] for e in events[:-1])
+        assert text == "one two "
+        assert requests.post(f"{base}/completions", data="[]", timeout=5).status_code == 400
+        # Packing a long chat happens off the event loop: other connections are still served meanwhile
+        gate, replies = threading.Event(), []
+        model.pack_chat = lambda history, *args, **kwargs: gate.wait(5) and build_chat_prompt(history)
+        slow = threading.Thread(target=lambda: replies.append(requests.post(
+            f"{base}/chat/completions", json={"messages": [{"role": "user", "content": "Hi"}]}, timeout=10)))
+        slow.start()
+        time.sleep(0.2)
+        assert requests.get(f"http://127.0.0.1:{server.port}/health", timeout=2).status_code == 200
+        gate.set()
+        slow.join(10)
+        assert replies[0].json()["choices"][0]["message"]["content"] == "Hello there"
+        # A non-streaming client that hangs up stops the generation
+        body = json.dumps({"prompt": "wait " * 100}).encode()
+        with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+            sock.sendall(b"POST /v1/completions HTTP/1.1\r\nHost: x\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            time.sleep(0.2)
+        deadline = time.time() + 3
+        while not model.stopped and time.time() < deadline:
+            time.sleep(0.05)
+        assert model.stopped, "generation not cancelled on disconnect"
+        print(f"✅ Served chat + {len(events) - 1} SSE events on port {server.port}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ HTTP server test failed: {e}")
+        return False
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+def test_fair_scheduler():
+    """Test fair queuing, priorities, quotas and admission control."""
+    print("\n🧪 Testing Fair Scheduler...")
+    
+    try:
+        sched = FairScheduler(quota_tokens_per_min=7000, max_queue_delay_s=1000, initial_tokens_per_s=10)
+        for i in range(3):
+            sched.submit("essay", f"essay-{i}", 2000)
+        sched.submit("grammar", "fix", 50)
+        sched.submit("grader", "bulk", 50, priority="batch")
+        order = [sched.next(timeout=0)["item"] for _ in range(5)]
+        assert order[:2] == ["essay-0", "fix"] and order[-1] == "bulk"
+        try:
+            sched.submit("essay", "too-much", 4000)
+            raise AssertionError("quota not enforced")
+        except SchedulerRejected:
+            pass
+        busy = FairScheduler(max_queue_delay_s=5, initial_tokens_per_s=10)
+        busy.submit("a", "x", 40)
+        try:
+            busy.submit("b", "y", 40)
+            raise AssertionError("admission control not enforced")
+        except SchedulerRejected as e:
+            assert e.retry_after > 0
+        # Finish tags are dropped once the queue drains and the virtual clock passes them
+        churn = FairScheduler(quota_tokens_per_min=10**9, max_queue_delay_s=10**9)
+        for i in range(200):
+            churn.submit(f"client-{i % 2}", i, 10)
+            churn.submit(f"client-{i}", i, 10)
+            churn.next(timeout=0)
+            churn.complete(churn.next(timeout=0), 10, 1.0)
+        assert churn._finish == {}
+        stats = sched.stats()
+        assert stats["rejected"]["quota"] == 1 and sum(stats["wait_seconds_histogram"]["interactive"].values()) == 4
+        print(f"✅ Dispatch order {order}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Fair scheduler test failed: {e}")
+        return False
+
+def test_speculative_draft():
+    """Test draft acceptance tracking, low-acceptance fallback and draft lookup."""
+    print("\n🧪 Testing Speculative Draft...")
+    
+    try:
+        draft = SpeculativeDraft(Path("draft.gguf"), n_ctx=512, n_threads=1, min_acceptance=0.5, warmup_tokens=8)
+        # Main model kept the first 3 of 4 drafted tokens, then emitted its own
+        draft._last_len, draft._last_proposal = 2, [5, 6, 7, 8]
+        draft._score_last_proposal([1, 2, 5, 6, 7, 9])
+        assert (draft.proposed, draft.accepted) == (4, 3) and draft.enabled
+        # Two misses push acceptance below the threshold after warm-up
+        for _ in range(2):
+            draft._last_len, draft._last_proposal = 1, [4, 4]
+            draft._score_last_proposal([1, 3])
+        assert not draft.enabled and draft.stats()["acceptance_rate"] == 3 / 8
+        with tempfile.TemporaryDirectory() as d:
+            main = Path(d) / MODELS["mistral-7b-q4"].filename
+            main.write_bytes(b"x")
+            assert find_draft_model(main) is None
+            (Path(d) / MODELS["tinymistral-248m-q8"].filename).write_bytes(b"x")
+            assert find_draft_model(main).name == MODELS["tinymistral-248m-q8"].filename
+        print(f"✅ Draft disabled at {draft.stats()['acceptance_rate']:.0%} acceptance")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Speculative draft test failed: {e}")
+        return False
+
+def test_response_cache():
+    """Test exact-match response caching, LRU eviction and replay."""
+    print("\n🧪 Testing Response Cache...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            cache = ResponseCache(Path(d) / "responses.sqlite3")
+            cache.max_bytes = 20
+            key = ResponseCache.make_key("model", "<s>[INST] Hi [/INST]", temperature=0.7, seed=1)
+            assert key != ResponseCache.make_key("model", "<s>[INST] Hi [/INST]", temperature=0.7, seed=2)
+            assert cache.get(key) is None
+            cache.put(key, "Hello there!", tokens=3)
+            cache.put("errors", "❌ Generation error: boom")
+            assert cache.get(key) == "Hello there!" and cache.get("errors") is None
+            time.sleep(0.01)
+            cache.put("other", "0123456789")  # over budget: evicts the least recently used entry
+            assert cache.get(key) is None and cache.get("other") == "0123456789"
+            assert "".join(ResponseCache.replay("a few words here", 10000)) == "a few words here"
+            stats = cache.stats()
+            assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 3, 1)
+            cache.close()
+        print(f"✅ {stats['hits']} hits, {stats['misses']} misses, {stats['tokens_saved']} tokens saved")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Response cache test failed: {e}")
+        return False
+
+class _WordEmbedder:
+    """Bag-of-words stand-in for the GGUF embedding model."""
+
+    def embed(self, text):
+        import numpy as np
+        vec = np.zeros(64, dtype=np.float32)
+        for word in text.lower().split():
+            if len(word) > 3:  # skip filler words
+                vec[sum(map(ord, word)) % 64] += 1.0
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+def test_semantic_cache():
+    """Test near-duplicate lookups, scoping, false-hit removal and the entry cap."""
+    print("\n🧪 Testing Semantic Cache...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            cache = SemanticCache(_WordEmbedder(), Path(d) / "semantic.sqlite3", threshold=0.8, max_entries=2)
+            cache.put("summarize photosynthesis", "scope-a", "Plants turn light into sugar.")
+            hit = cache.lookup("please summarize photosynthesis", "scope-a")
+            assert hit and hit["text"] == "Plants turn light into sugar." and hit["similarity"] >= 0.8
+            assert cache.lookup("summarize photosynthesis", "scope-b") is None
+            assert cache.lookup("explain mitosis stages", "scope-a") is None
+            cache.report_false_hit(hit["id"])
+            assert cache.lookup("summarize photosynthesis", "scope-a") is None
+            for topic in ("mitosis", "osmosis", "enzymes"):
+                cache.put(f"explain {topic}", "scope-a", f"About {topic}.")
+            stats = cache.stats()
+            assert stats["entries"] == 2 and stats["false_hits"] == 1 and stats["hits"] == 1
+            cache.close()
+            # The index is rebuilt from disk by a fresh instance
+            reopened = SemanticCache(_WordEmbedder(), Path(d) / "semantic.sqlite3", threshold=0.8)
+            assert reopened.lookup("explain enzymes", "scope-a")["text"] == "About enzymes."
+            assert reopened.lookup("explain mitosis", "scope-a") is None
+            reopened.close()
+        print(f"✅ Hit rate {stats['hit_rate']:.0%}, {stats['avg_lookup_ms']:.2f} ms/lookup, {stats['index_kb']:.2f} KB index")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Semantic cache test failed: {e}")
+        return False
+
+class _SlowModel:
+    """Stand-in for AIInference decoding one token every 10 ms until cancelled."""
+
+    def generate_response_stream(self, prompt, max_tokens=512, cancel=None):
+        for i in range(max_tokens):
+            time.sleep(0.01)  # one "decode step"
+            if cancel is not None and cancel(None, None):
+                return
+            yield f"tok{i} "
+
+def test_cancellation():
+    """Test cancellation tokens, Ctrl+C handling and stop-to-idle measurement."""
+    print("\n🧪 Testing Cancellation...")
+    
+    try:
+        token = CancellationToken()
+        assert not token(None, None)
+        token.cancel()
+        assert token.cancelled and token(None, None) and token.cancelled_at is not None
+        with cancel_on_sigint(CancellationToken()) as cancel:
+            signal.raise_signal(signal.SIGINT)  # first Ctrl+C cancels instead of raising
+        assert cancel.cancelled
+        latency = measure_stop_latency(_SlowModel(), "prompt", after_chunks=3)
+        assert latency is not None and latency < 0.5
+        print(f"✅ Stop-to-idle latency {latency * 1000:.0f} ms")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Cancellation test failed: {e}")
+        return False
+
+class _ByteTokenizerModel:
+    """Llama stand-in whose vocabulary is one token per UTF-8 byte."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def tokenize(self, data, add_bos=True, special=False):
+        self.calls += 1
+        return ([1] if add_bos else []) + list(data)
+
+def test_tokenizer_service():
+    """Test exact token counts, LRU memoization and the no-model estimate."""
+    print("\n🧪 Testing Tokenizer Service...")
+    
+    try:
+        model = _ByteTokenizerModel()
+        tok = TokenizerService(model, max_entries=2)
+        assert tok.count("héllo") == 6 and tok.count("héllo") == 6 and model.calls == 1
+        assert tok.tokenize("hi", add_bos=True) == [1, 104, 105] and model.calls == 2
+        tok.count("other")  # evicts "héllo"
+        tok.count("héllo")
+        assert model.calls == 4 and tok.stats()["entries"] == 2
+        ai = SimpleNamespace(count_tokens=tok.count)
+        assert count_tokens("abc", ai) == 3
+        assert count_tokens("one two three four", None) == 5  # ~4 chars per token without a model
+        assert count_tokens("", None) == 0
+        print(f"✅ Tokenizer cache: {tok.stats()}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Tokenizer service test failed: {e}")
+        return False
+
+def test_context_packer():
+    """Test token-budgeted packing, stable prefixes, pinned presets and the length cache."""
+    print("\n🧪 Testing Context Packer...")
+    
+    try:
+        calls = []
+        def count(text):
+            calls.append(text)
+            return len(text) // 4 + 1
+        packer = ContextPacker(system_prompt="Be brief.", low_water=0.5)
+        history = []
+        prompts = []
+        for i in range(12):
+            history.append({"role": "user", "content": f"question {i} " + "x" * 80})
+            prompts.append(packer.pack(history, count, budget=200))
+            history.append({"role": "assistant", "content": f"answer {i} " + "y" * 80})
+        assert all(count(p) <= 200 for p in prompts)
+        assert "question 11" in prompts[-1] and "question 0 " not in prompts[-1] and packer.dropped > 0
+        assert prompts[-1].startswith("<s>[INST] <<SYS>>Be brief.<</SYS>>")
+        # Dropping to the low-water mark keeps the same first turn for the next message
+        assert prompts[-2].split("[/INST]")[0] == prompts[-1].split("[/INST]")[0]
+        calls.clear()
+        packer.pack(history + [{"role": "user", "content": "new"}], count, budget=200)
+        assert len(calls) == 2  # only the newest reply and question are tokenized
+        pinned = packer.pack(history, count, budget=200, pinned="Fix grammar:")
+        assert "<<SYS>>Be brief.\n\nFix grammar:<</SYS>>" in pinned
+        huge = packer.pack([{"role": "user", "content": "start " + "z" * 2000 + " end"}], count, budget=100)
+        assert count(huge) <= 100 and huge.endswith(" end [/INST]")
+        print(f"✅ {packer.dropped} turn(s) dropped, last prompt {packer.last_tokens} tokens")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Context packer test failed: {e}")
+        return False
+
+def test_rolling_summarizer():
+    """Test that dropped turns are folded into a memory block in the background."""
+    print("\n🧪 Testing Rolling Summarizer...")
+    
+    try:
+        class _Summarizing:
+            def __init__(self):
+                self.calls = []
+            def summarize_turns(self, turns, memory="", max_tokens=160, cancel=None):
+                self.calls.append(len(turns))
+                return f"{memory} " * bool(memory) + " ".join(t[0][1].split()[1] for t in turns)
+
+        count = lambda text: len(text) // 4 + 1
+        packer = ContextPacker(system_prompt="Be brief.", low_water=0.5)
+        summarizer = RollingSummarizer(packer, idle_delay=0, max_chars=400)
+        ai = _Summarizing()
+        history = []
+        sizes = []
+        for i in range(20):
+            history.append({"role": "user", "content": f"question {i} " + "x" * 80})
+            prompt = packer.pack(history, count, budget=200)
+            sizes.append(count(prompt))
+            history.append({"role": "assistant", "content": f"answer {i} " + "y" * 80})
+            summarizer.schedule(ai, history)
+            summarizer.wait(5)
+        assert packer.memory and packer.memory["turns"] == packer.dropped
+        assert packer.memory["text"].split()[:3] == ["0", "1", "2"]
+        assert "Summary of the earlier conversation: 0 1 2" in prompt and "question 0 " not in prompt
+        assert max(sizes) <= 200 and max(ai.calls) <= 2  # small slices, bounded prompt
+        # Preempting before the idle delay leaves the memory untouched
+        slow = RollingSummarizer(packer, idle_delay=5)
+        before = dict(packer.memory)
+        history.append({"role": "user", "content": "question 20 " + "x" * 800})
+        packer.pack(history, count, budget=200)
+        assert slow.schedule(ai, history)
+        slow.preempt()
+        slow.wait(1)
+        assert packer.memory == before
+        print(f"✅ {packer.memory['turns']} turn(s) summarized in {len(ai.calls)} call(s), prompts ≤ {max(sizes)} tokens")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Rolling summarizer test failed: {e}")
+        return False
+
+def test_model_lifecycle():
+    """Test background preload with warm-up, idle unload and status reporting."""
+    print("\n🧪 Testing Model Lifecycle...")
+    
+    try:
+        key = ModelPool.make_key(Path("lifecycle-test.gguf"), 512, 2, 0)
+        class _Warmable:
+            pool_key = key
+            def __init__(self):
+                self.llm = MODEL_POOL.acquire(key, object)
+                self.warmups = 0
+            def warm_up(self):
+                self.warmups += 1
+                return 0.01
+        events = []
+        made = []
+        def factory():
+            made.append(_Warmable())
+            return made[-1]
+        life = ModelLifecycle(factory, idle_unload_s=0.3, poll_s=0.05,
+                              on_change=lambda state, message: events.append(state))
+        assert life.preload() and not life.preload()  # one load at a time
+        deadline = time.time() + 2
+        while life.state != "ready" and time.time() < deadline:
+            time.sleep(0.01)
+        assert life.state == "ready" and made[0].warmups == 1 and "load_s" in life.timings
+        # A generation holding the model lock blocks the idle unload
+        lock = MODEL_POOL.lock_for(made[0].llm)
+        with lock:
+            time.sleep(0.5)
+            assert life.state == "ready"
+        while life.state == "ready" and time.time() < deadline + 2:
+            time.sleep(0.01)
+        assert life.state == "unloaded" and MODEL_POOL._entry_for(made[0].llm) is None
+        assert events == ["loading", "warming", "ready", "unloaded"]
+        life.close()
+        missing = ModelLifecycle(lambda: None, idle_unload_s=0)
+        missing.preload()
+        time.sleep(0.1)
+        assert missing.state == "missing" and not missing.preload()
+        missing.close()
+        print(f"✅ States {' → '.join(events)}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Model lifecycle test failed: {e}")
+        return False
+
+def test_model_prefetch():
+    """Test page-cache prefetching, the mmap/mlock policy and cold/warm load records."""
+    print("\n🧪 Testing Model Prefetch...")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            model = Path(tmp) / "tiny.gguf"
+            model.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+            prefetcher = ModelPrefetcher(chunk_mb=1)
+            assert prefetcher.start(model) and not prefetcher.start(model)
+            assert prefetcher.wait(model, timeout=5) and prefetcher.completed(model)
+            assert prefetcher.stats()["tiny.gguf"]["mb"] * 1024 * 1024 == model.stat().st_size
+            assert choose_memory_policy(model, use_mmap=False, use_mlock=True) == {"use_mmap": False, "use_mlock": False}
+            assert choose_memory_policy(model)["use_mmap"] is True
+            log = LoadTimeLog(Path(tmp) / "load_times.json")
+            first = log.record(model, 12.0)
+            PREFETCHER.start(model)
+            PREFETCHER.wait(model, timeout=5)
+            second = log.record(model, 1.5)
+            assert second["warm"] and second["prefetched"]
+            assert not first["warm"]
+            stats = log.summary(model)
+            assert stats == {"loads": 2, "cold_s": 12.0, "warm_s": 1.5}
+            print(f"✅ Prefetched {model.stat().st_size} bytes; cold {stats['cold_s']}s vs warm {stats['warm_s']}s")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Model prefetch test failed: {e}")
+        return False
+
+def test_autotune():
+    """Test the thread/batch sweep, its early stop and the per-machine preferences entry."""
+    print("\n🧪 Testing Autotune...")
+    
+    try:
+        calls = []
+        def measure(n_threads, n_threads_batch, n_batch):
+            calls.append((n_threads, n_threads_batch, n_batch))
+            decode = 10 - abs(n_threads - 3)  # memory bound: peaks at 3 threads
+            prefill = 20 * min(n_threads_batch, 6) - {512: 5, 64: 8}.get(n_batch, 0)  # compute bound
+            return float(prefill), float(decode)
+        with tempfile.TemporaryDirectory() as tmp:
+            model = Path(tmp) / "tiny.gguf"
+            model.write_bytes(b"GGUF" + b"\0" * 64)
+            prefs_path = Path(tmp) / "config.json"
+            UserPreferences.save({"model": "mistral-7b-q4"}, prefs_path)
+            tuned = autotune(model, measure=measure, thread_counts=[2, 3, 4, 6, 8, 12, 16, 24],
+                             prefs_path=prefs_path)
+            assert (tuned["n_threads"], tuned["n_threads_batch"], tuned["n_batch"]) == (3, 6, 256)
+            # Stops two candidates past the best instead of trying 16 and 24 threads, and batch 64 last
+            assert [c[0] for c in calls if c[2] == 512] == [2, 3, 4, 6, 8, 12]
+            assert [c[2] for c in calls if c[2] != 512] == [256, 128, 64]
+            assert UserPreferences.tuned_settings(model, prefs_path) == tuned
+            # Saving other settings keeps the per-machine results
+            UserPreferences.save({"model": "mistral-7b-q4", "temperature": 0.5}, prefs_path)
+            assert UserPreferences.tuned_settings(model, prefs_path) == tuned
+        print(f"✅ {tuned['n_threads']} threads, batch {tuned['n_batch']} after {len(calls)} runs")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Autotune test failed: {e}")
+        return False
+
 def main():
     """Run all tests."""
     print("🚀 Verdant MVP Test Suite")
@@ -52,7 +1258,34 @@ def main():
     
     tests = [
         test_hardware_detection,
+        test_hardware_profile,
+        test_numa_topology,
         test_model_downloader,
+        test_segmented_download,
+        test_resumable_download,
+        test_download_checksum,
+        test_mirror_selector,
+        test_chunk_manifest,
+        test_model_pool,
+        test_chat_prompt_prefix,
+        test_kv_state_store,
+        test_session_state_save,
+        test_summarizer_keeps_chat_cache,
+        test_generate_batch,
+        test_prefix_snapshots,
+        test_batch_checkpoint,
+        test_http_server,
+        test_fair_scheduler,
+        test_speculative_draft,
+        test_response_cache,
+        test_semantic_cache,
+        test_cancellation,
+        test_tokenizer_service,
+        test_context_packer,
+        test_rolling_summarizer,
+        test_model_lifecycle,
+        test_model_prefetch,
+        test_autotune,
     ]
     
     passed = 0
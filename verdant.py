@@ -30,6 +30,19 @@ from dataclasses import dataclass
 import argparse
 import time
 import json
+import threading
+import zlib
+import uuid
+import codecs
+import asyncio
+import heapq
+import itertools
+import re
+import sqlite3
+import signal
+import contextlib
+from collections import OrderedDict, deque
+from types import SimpleNamespace
 import certifi
 
 # Helper: resource path (handles PyInstaller onefile/onedir)
@@ -67,6 +80,9 @@ class ModelConfig:
     size_mb: int
     min_ram_gb: int
     candidate_urls: Optional[List[str]] = None
+    checksums: Optional[Dict[str, str]] = None  # pinned SHA-256 per download URL, overrides `checksum`
+    draft_for: Optional[str] = None  # set on small models used only to draft tokens for speculative decoding
+    embedding: bool = False  # sentence-embedding model (semantic cache), not a chat model
 
 # Model configurations
 MODELS = {
@@ -85,12 +101,42 @@ MODELS = {
             "https://huggingface.co/TheBloke/Mistral-7B-Instruct-v0.1-GGUF/resolve/main/mistral-7b-instruct-v0.1.Q4_K_M.gguf",
             "https://huggingface.co/TheBloke/Mistral-7B-Instruct-v0.1-GGUF/resolve/main/mistral-7b-instruct-v0.1.q4_0.gguf"
         ]
-    )
+    ),
+    # Draft model for speculative decoding; shares Mistral's tokenizer
+    "tinymistral-248m-q8": ModelConfig(
+        name="TinyMistral 248M Q8 (draft)",
+        url="https://huggingface.co/afrideva/TinyMistral-248M-GGUF/resolve/main/tinymistral-248m.q8_0.gguf",
+        filename="tinymistral-248m-q8.gguf",
+        checksum="",
+        size_mb=264,
+        min_ram_gb=1,
+        draft_for="mistral-7b-q4",
+    ),
+    # Sentence embeddings for the semantic response cache
+    "nomic-embed-text-q4": ModelConfig(
+        name="Nomic Embed Text v1.5 Q4 (embeddings)",
+        url="https://huggingface.co/nomic-ai/nomic-embed-text-v1.5-GGUF/resolve/main/nomic-embed-text-v1.5.Q4_K_M.gguf",
+        filename="nomic-embed-text-v1.5-q4.gguf",
+        checksum="",
+        size_mb=84,
+        min_ram_gb=1,
+        embedding=True,
+    ),
 }
 
 PREFERENCES_DIR = Path.home() / ".verdant"
 PREFERENCES_FILE = PREFERENCES_DIR / "config.json"
 PRESETS_FILE = _resource_path("presets.json")
+KV_STATE_DIR = PREFERENCES_DIR / "kv_states"
+PREFIX_STATE_DIR = PREFERENCES_DIR / "prefix_states"
+RESPONSE_CACHE_FILE = PREFERENCES_DIR / "response_cache.sqlite3"
+SEMANTIC_CACHE_FILE = PREFERENCES_DIR / "semantic_cache.sqlite3"
+LOAD_TIMES_FILE = PREFERENCES_DIR / "load_times.json"
+HARDWARE_PROFILE_FILE = PREFERENCES_DIR / "hardware.json"
+HARDWARE_PROFILE_TTL_S = 7 * 24 * 3600
+MIRRORS_FILE = PREFERENCES_DIR / "mirrors.json"
+MANIFEST_CHUNK_MB = 16
+SYSTEM_PROMPT = "You are Verdant, an eco-conscious local AI assistant. Be helpful, concise, and friendly."
 
 class UserPreferences:
     """Load and save user preferences for Verdant."""
@@ -122,17 +168,47 @@ class UserPreferences:
     def save(prefs: Dict[str, Any], path: Optional[Path] = None) -> None:
         prefs_path = path or PREFERENCES_FILE
         prefs_path.parent.mkdir(parents=True, exist_ok=True)
+        # Autotune results are per machine, not a setting: keep the newest of each entry, so a
+        # GUI saving its settings does not drop results of an `--autotune` run made meanwhile
+        tuned = dict(UserPreferences.load(prefs_path).get("autotune") or {})
+        for key, entry in (prefs.get("autotune") or {}).items():
+            if entry.get("tuned_at", 0) >= tuned.get(key, {}).get("tuned_at", 0):
+                tuned[key] = entry
+        if tuned:
+            prefs = dict(prefs, autotune=tuned)
         with open(prefs_path, "w", encoding="utf-8") as f:
             json.dump(prefs, f, indent=2)
 
+    @staticmethod
+    def tuning_key(model_path: Path) -> str:
+        """Autotune results are per machine (CPU model) and per model file."""
+        path = Path(model_path)
+        try:
+            size = path.stat().st_size
+        except Exception:
+            size = 0
+        return f"{HardwareDetector.cpu_model()}|{path.name}|{size}"
+
+    @staticmethod
+    def tuned_settings(model_path: Path, path: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+        tuned = UserPreferences.load(path).get("autotune") or {}
+        return tuned.get(UserPreferences.tuning_key(model_path))
+
+    @staticmethod
+    def save_tuned_settings(model_path: Path, settings: Dict[str, Any], path: Optional[Path] = None) -> None:
+        prefs = UserPreferences.load(path)
+        prefs.setdefault("autotune", {})[UserPreferences.tuning_key(model_path)] = settings
+        UserPreferences.save(prefs, path)
+
 class PresetsManager:
     """Manage prompt presets from presets.json."""
 
     @staticmethod
-    def load_presets() -> Dict[str, str]:
+    def load_presets(path: Optional[Path] = None) -> Dict[str, str]:
+        presets_path = path or PRESETS_FILE
         try:
-            if PRESETS_FILE.exists():
-                with open(PRESETS_FILE, "r", encoding="utf-8") as f:
+            if presets_path.exists():
+                with open(presets_path, "r", encoding="utf-8") as f:
                     data = json.load(f)
                 if isinstance(data, dict):
                     return {k: str(v) for k, v in data.items()}
@@ -140,10 +216,987 @@ class PresetsManager:
             pass
         return {}
 
+def build_chat_prompt(history: List[Dict[str, Any]], system_prompt: str = SYSTEM_PROMPT) -> str:
+    """Build a Mistral Instruct multi-turn transcript from chat history.
+
+    Accepts GUI-style {role, content} messages and CLI-style {user, assistant}
+    pairs. The output for earlier turns never changes as new turns are appended,
+    so consecutive prompts share a token prefix that the KV cache can reuse.
+    """
+    turns = []
+    pair_count = 0
+    for role, content in _chat_messages(history):
+        if role == "user":
+            if pair_count == 0:
+                # First pair includes system prompt
+                turns.append(f"<s>[INST] <<SYS>>{system_prompt}<</SYS>> {content} [/INST]")
+            else:
+                turns.append(f"<s>[INST] {content} [/INST]")
+            pair_count += 1
+        elif role == "assistant" and content:
+            turns.append(content)
+    return "".join(turns)
+
+def _chat_messages(history: List[Dict[str, Any]]) -> List[tuple]:
+    """(role, content) pairs from {role, content} messages or {user, assistant} pairs."""
+    messages = []
+    for msg in history:
+        if "role" in msg:
+            messages.append((msg.get("role"), msg.get("content", "")))
+        else:
+            messages.append(("user", msg.get("user", "")))
+            messages.append(("assistant", msg.get("assistant")))
+    return messages
+
+class ContextPacker:
+    """Fits a chat transcript into a token budget (n_ctx - max_tokens).
+
+    The system prompt, an optional pinned preset and the latest user turn
+    always stay; older turns are dropped oldest-first. Token lengths of
+    messages are cached, so repacking a growing chat only tokenizes new
+    messages. When a chat overflows, turns are dropped down to low_water of
+    the budget and the first kept turn sticks on later calls, so the
+    transcript keeps a stable prefix for KV-cache reuse instead of shifting
+    by one turn every message. If memory holds a summary of the first N turns
+    (see RollingSummarizer), it is added to the system block and those turns
+    are never sent in full again.
+    """
+
+    def __init__(self, system_prompt: str = SYSTEM_PROMPT, low_water: float = 0.75, max_entries: int = 4096):
+        self.system_prompt = system_prompt
+        self.low_water = low_water
+        self.max_entries = max_entries
+        self._lengths: "OrderedDict[tuple, int]" = OrderedDict()
+        self._model_id: Optional[Any] = None
+        self._anchor: Optional[tuple] = None  # first kept (role, content) of the last pack
+        self.memory: Optional[Dict[str, Any]] = None  # {"text": summary, "turns": turns it covers}
+        self.dropped = 0
+        self.last_tokens = 0
+
+    def pack(self, history: List[Dict[str, Any]], count: Callable[[str], int], budget: int,
+             pinned: Optional[str] = None, model_id: Optional[Any] = None, sticky: bool = True,
+             system_prompt: Optional[str] = None) -> str:
+        if model_id != self._model_id:
+            self._lengths.clear()
+            self._model_id = model_id
+        turns = self.turns(history)
+        if not turns:
+            return ""
+
+        def render(kept: List[List[tuple]], system: str) -> str:
+            return build_chat_prompt([{"role": r, "content": c} for t in kept for r, c in t], system)
+
+        base = system_prompt or self.system_prompt
+        pin = pinned if pinned and not any(pinned in c for t in turns for _, c in t) else None
+        system = f"{base}\n\n{pin}" if pin else base
+        memory = self.memory or {}
+        covered = min(int(memory.get("turns", 0)), len(turns) - 1) if memory.get("text") else 0
+        if covered:
+            system = f"{system}\n\nSummary of the earlier conversation: {memory['text']}"
+        head = self._length(("system", system), count, f"<s>[INST] <<SYS>>{system}<</SYS>> ")
+        costs = [sum(self._turn_length(m, count) for m in t) for t in turns]
+
+        start = 0
+        if sticky and self._anchor is not None:
+            start = next((i for i, t in enumerate(turns) if t[0] == self._anchor), 0)
+        start = max(start, covered)
+        if head + sum(costs[start:]) > budget:
+            target = budget * (self.low_water if sticky else 1.0)
+            while start < len(turns) - 1 and head + sum(costs[start:]) > target:
+                start += 1
+        self.dropped = start
+        kept = [list(t) for t in turns[start:]]
+        self._anchor = kept[0][0] if sticky else None
+
+        # A single turn longer than the budget: keep the end of the user message
+        if head + sum(costs[start:]) > budget:
+            role, content = kept[-1][0]
+            room = budget - head - sum(costs[start:-1])
+            kept[-1] = [(role, self._truncate_head(content, count, room))]
+        self.last_tokens = min(budget, head + sum(costs[start:]))  # sum of cached per-message lengths
+        return render(kept, system)
+
+    @staticmethod
+    def turns(history: List[Dict[str, Any]]) -> List[List[tuple]]:
+        """Group a transcript into turns: a user message plus the reply that follows it."""
+        turns: List[List[tuple]] = []
+        for role, content in _chat_messages(history):
+            if role == "user" or not turns:
+                turns.append([])
+            if role in ("user", "assistant") and content:
+                turns[-1].append((role, content))
+        return [t for t in turns if t]
+
+    def _turn_length(self, message: tuple, count: Callable[[str], int]) -> int:
+        role, content = message
+        text = f"<s>[INST] {content} [/INST]" if role == "user" else content
+        return self._length(message, count, text)
+
+    def _length(self, key: tuple, count: Callable[[str], int], text: str) -> int:
+        n = self._lengths.get(key)
+        if n is None:
+            n = count(text)
+            self._lengths[key] = n
+            while len(self._lengths) > self.max_entries:
+                self._lengths.popitem(last=False)
+        else:
+            self._lengths.move_to_end(key)
+        return n
+
+    @staticmethod
+    def _truncate_head(text: str, count: Callable[[str], int], room: int) -> str:
+        """Longest suffix of text (wrapped as a user turn) that fits in room tokens."""
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if count(f"<s>[INST] {text[mid:]} [/INST]") <= room:
+                hi = mid
+            else:
+                lo = mid + 1
+        return text[lo:]
+
+DOWNLOAD_HEADERS = {
+    "User-Agent": "Verdant/0.2 (+https://github.com/kaankutluturk/verdant)",
+    "Accept": "application/octet-stream, */*"
+}
+
+def _make_download_session(max_connections: int = 16) -> requests.Session:
+    """requests.Session with a connection pool large enough for segmented downloads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DOWNLOAD_HEADERS)
+    session.verify = certifi.where()
+    return session
+
+class DownloadChanged(IOError):
+    """The remote file no longer matches the partial download (If-Range answered with the full body)."""
+
+class ChecksumMismatch(IOError):
+    """The downloaded bytes do not hash to the pinned SHA-256."""
+
+class _StreamHasher:
+    """SHA-256 of a file whose bytes are written out of order.
+
+    Workers offer() each chunk right after writing it; the downloading thread
+    advance()s the hash along the contiguous written prefix, using those
+    buffered chunks and reading back from the file only what did not fit in
+    the buffer (or was written by an earlier, resumed attempt). Alongside the
+    whole-file hash it hashes every chunk_size block for the model's manifest
+    (see ModelIntegrity).
+    """
+
+    def __init__(self, buffer_limit: int, chunk_size: int = MANIFEST_CHUNK_MB * 1024 * 1024):
+        self.sha = hashlib.sha256()
+        self.chunk_size = chunk_size
+        self.chunk = hashlib.sha256()
+        self.chunks: List[str] = []
+        self.offset = 0
+        self.pending: Dict[int, bytes] = {}
+        self.pending_bytes = 0
+        self.buffer_limit = buffer_limit
+        self.reread = 0
+        self.lock = threading.Lock()
+
+    def offer(self, offset: int, data: bytes) -> None:
+        with self.lock:
+            if offset >= self.offset and self.pending_bytes + len(data) <= self.buffer_limit:
+                self.pending[offset] = data
+                self.pending_bytes += len(data)
+
+    def advance(self, upto: int, read_at: Callable[[int, int], bytes], budget: Optional[int] = None) -> None:
+        """Hash up to byte `upto`; read back at most `budget` bytes from the file in this call."""
+        read = 0
+        while self.offset < upto:
+            with self.lock:
+                data = self.pending.pop(self.offset, None)
+                if data is not None:
+                    self.pending_bytes -= len(data)
+                else:
+                    stop = min([k for k in self.pending if k > self.offset] + [upto])
+            if data is None:
+                if budget is not None and read >= budget:
+                    break
+                size = min(stop - self.offset, 1024 * 1024)
+                data = read_at(self.offset, size)
+                if len(data) != size:
+                    raise IOError(f"short read at byte {self.offset} while hashing")
+                read += size
+            self.update(data)
+        self.reread += read
+        with self.lock:
+            for k in [k for k in self.pending if k < self.offset]:
+                self.pending_bytes -= len(self.pending.pop(k))
+
+    def update(self, data: bytes) -> None:
+        """Hash the next bytes of the file, in order."""
+        view = memoryview(data)
+        while view:
+            part = view[:self.chunk_size - self.offset % self.chunk_size]
+            self.sha.update(part)
+            self.chunk.update(part)
+            self.offset += len(part)
+            view = view[len(part):]
+            if self.offset % self.chunk_size == 0:
+                self.chunks.append(self.chunk.hexdigest())
+                self.chunk = hashlib.sha256()
+
+    def hexdigest(self) -> str:
+        return self.sha.hexdigest()
+
+    def chunk_hashes(self) -> List[str]:
+        """SHA-256 of each chunk_size block, the last one possibly shorter."""
+        tail = [self.chunk.hexdigest()] if self.offset % self.chunk_size else []
+        return self.chunks + tail
+
+class SegmentedDownloader:
+    """Parallel HTTP Range download of a single file.
+
+    The destination is preallocated and split into fixed-size segments that
+    worker threads take from a shared queue. Each worker fetches its segment
+    with a Range request over a pooled requests.Session and writes it in place
+    with os.pwrite (seek+write on a per-thread handle where pwrite is missing).
+    The number of connections adapts to measured throughput: starting from
+    `connections`, one more is opened while that still raises the total rate
+    by at least 10%, up to max_connections. A failed segment is retried from
+    the byte where it stopped. Servers without range support, or files
+    smaller than one segment, are fetched as one plain stream.
+
+    With a journal_path, the completed byte ranges and the server's validator
+    (strong ETag or Last-Modified, per URL) are kept in a JSON sidecar, so a
+    later call picks up where a failed one stopped, also from another mirror
+    serving the same-sized file. Range requests then carry If-Range; if the
+    file changed, the partial data and journal are discarded.
+
+    The SHA-256 is computed while downloading (see _StreamHasher), so the file
+    is never read again afterwards, and checked against expected_sha256 or
+    else the X-Linked-Etag Hugging Face sends for LFS files. A mismatch
+    raises ChecksumMismatch and discards the partial file.
+
+    `mirrors` are further URLs expected to serve the same bytes. Those that
+    report the same size (and SHA-256, when both publish one) share the
+    segments: each segment goes to the mirror with the best measured rate,
+    every eighth to another one so a mirror that got faster is noticed, and a
+    mirror failing twice in a row is dropped for the rest of the download.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, connections: int = 4,
+                 max_connections: int = 16, segment_mb: float = 8, timeout: float = 30,
+                 segment_retries: int = 3, sample_s: float = 1.5, hash_buffer_mb: float = 64):
+        self.session = session or _make_download_session(max_connections)
+        self.connections = max(1, connections)
+        self.max_connections = max(self.connections, max_connections)
+        self.segment_size = max(64 * 1024, int(segment_mb * 1024 * 1024))
+        self.timeout = timeout
+        self.segment_retries = segment_retries
+        self.sample_s = sample_s
+        self.hash_buffer = int(hash_buffer_mb * 1024 * 1024)
+
+    def download(self, url: str, dest: Path,
+                 on_progress: Optional[Callable[[int, int], None]] = None,
+                 journal_path: Optional[Path] = None, expected_sha256: str = "",
+                 mirrors: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Fetch url into dest; on_progress(downloaded_bytes, total_bytes). Returns transfer stats."""
+        start = time.perf_counter()
+        total, final_url, ranges, validator, linked_sha = self._probe(url)
+        expected = (expected_sha256 or linked_sha).lower()
+        if not ranges or total <= self.segment_size:
+            if journal_path is not None and journal_path.exists():
+                journal_path.unlink()
+            downloaded, hasher = self._download_single(final_url, dest, total, on_progress)
+            digest = hasher.hexdigest()
+            self._verify(digest, expected, dest)
+            stats = self._stats(downloaded, start, connections=1, segments=1)
+            stats.update(sha256=digest, verified=bool(expected), reread=0,
+                         chunk_size=hasher.chunk_size, chunks=hasher.chunk_hashes())
+            return stats
+
+        segments = [(offset, min(offset + self.segment_size, total) - 1)
+                    for offset in range(0, total, self.segment_size)]
+        state = _SegmentState(segments)
+        state.hasher = _StreamHasher(self.hash_buffer)
+        state.mirrors = [_SegmentState.mirror(url, final_url, validator)]
+        state.mirrors += self._probe_mirrors([m for m in mirrors or [] if m != url], total, linked_sha)
+        journal = self._load_journal(journal_path, url, total, validator)
+        if journal and dest.exists() and dest.stat().st_size == total:
+            state.resume(journal["done"])
+            state.validators = journal["validators"]
+        else:
+            with open(dest, "wb") as f:
+                self._preallocate(f, total)
+        for m in state.mirrors:
+            if m["validator"]:
+                state.validators[m["url"]] = m["validator"]
+        resumed = state.done
+        if resumed:
+            print(f"\n   ↩️  Resuming at {resumed / (1024 * 1024):.1f} MB of {total / (1024 * 1024):.1f} MB")
+            if on_progress:
+                on_progress(resumed, total)
+        fd = os.open(dest, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        state.fd = fd
+        reader = open(dest, "rb")
+
+        def read_at(offset: int, size: int) -> bytes:
+            reader.seek(offset)
+            return reader.read(size)
+
+        last_saved = time.perf_counter()
+        threads: List[threading.Thread] = []
+        try:
+            def spawn() -> None:
+                with state.lock:
+                    state.active += 1
+                t = threading.Thread(target=self._worker, args=(state, dest), daemon=True)
+                threads.append(t)
+                t.start()
+
+            state.target = min(self.connections, len(segments))
+            for _ in range(state.target):
+                spawn()
+            growing, best_rate = True, 0.0
+            last_t, last_bytes = time.perf_counter(), state.done
+            while any(t.is_alive() for t in threads):
+                state.stop.wait(0.2)
+                if on_progress:
+                    on_progress(state.done, total)
+                state.hasher.advance(state.written_prefix(), read_at, budget=64 * 1024 * 1024)
+                now = time.perf_counter()
+                if journal_path is not None and now - last_saved >= 1.0:
+                    self._save_journal(journal_path, total, state)
+                    last_saved = now
+                if now - last_t < self.sample_s or state.stop.is_set():
+                    continue
+                rate = (state.done - last_bytes) / (now - last_t)
+                last_t, last_bytes = now, state.done
+                if not growing or not state.queue:
+                    continue
+                if rate > best_rate * 1.1 and state.target < self.max_connections:
+                    best_rate = rate
+                    state.target += 1
+                    state.peak = max(state.peak, state.target)
+                    spawn()
+                else:
+                    # The last connection did not pay off: settle, and drop it if it hurt
+                    growing = False
+                    if rate < best_rate * 0.9 and state.target > 1:
+                        state.target -= 1
+            if state.error is not None:
+                raise state.error
+            if state.done != total:
+                raise IOError(f"incomplete download: {state.done}/{total} bytes")
+            state.hasher.advance(total, read_at)
+            digest = state.hasher.hexdigest()
+            if expected and digest != expected:
+                state.error = ChecksumMismatch(f"SHA-256 {digest} does not match pinned {expected}")
+                raise state.error
+        finally:
+            state.stop.set()  # also on errors/Ctrl+C in this thread: let workers finish their chunk
+            deadline = time.perf_counter() + 2.0
+            for t in threads:
+                t.join(timeout=max(0.0, deadline - time.perf_counter()))
+            reader.close()
+            changed = isinstance(state.error, (DownloadChanged, ChecksumMismatch))
+            if journal_path is not None and not changed and state.done != total:
+                self._save_journal(journal_path, total, state)
+            os.close(fd)
+            state.fd = -1
+            if journal_path is not None and (changed or state.done == total):
+                journal_path.unlink(missing_ok=True)
+            if changed:
+                dest.unlink(missing_ok=True)
+        if on_progress:
+            on_progress(total, total)
+        stats = self._stats(total, start, connections=state.peak, segments=len(segments))
+        stats.update(resumed=resumed, sha256=digest, verified=bool(expected), reread=state.hasher.reread,
+                     mirrors={m["url"]: m["bytes"] for m in state.mirrors},
+                     chunk_size=state.hasher.chunk_size, chunks=state.hasher.chunk_hashes())
+        return stats
+
+    def _probe(self, url: str) -> tuple:
+        """(total bytes, final URL after redirects, whether byte ranges are supported, validator,
+        SHA-256 from X-Linked-Etag or "")."""
+        with self.session.get(url, headers={"Range": "bytes=0-0"}, stream=True,
+                              timeout=self.timeout, allow_redirects=True) as r:
+            r.raise_for_status()
+            etag = r.headers.get("ETag", "")
+            # If-Range only accepts strong validators
+            validator = etag if etag and not etag.startswith("W/") else r.headers.get("Last-Modified", "")
+            # Hugging Face puts the LFS object's SHA-256 on the redirect to its CDN
+            linked = next((h.headers["X-Linked-Etag"] for h in [*r.history, r] if "X-Linked-Etag" in h.headers), "")
+            linked = linked.strip('"') if re.fullmatch(r'"?[0-9a-fA-F]{64}"?', linked) else ""
+            match = re.match(r"bytes\s+\d+-\d+/(\d+)", r.headers.get("Content-Range", ""))
+            if r.status_code == 206 and match:
+                return int(match.group(1)), r.url, True, validator, linked
+            return int(r.headers.get("content-length", 0) or 0), r.url, False, validator, linked
+
+    def _probe_mirrors(self, urls: List[str], total: int, sha256: str) -> List[Dict[str, Any]]:
+        """Probe alternative URLs concurrently; keep those serving ranges of the same file."""
+        if not urls:
+            return []
+        from concurrent.futures import ThreadPoolExecutor
+
+        def probe(u: str) -> Optional[Dict[str, Any]]:
+            try:
+                size, final, ranges, validator, linked = self._probe(u)
+            except Exception:
+                return None
+            if not ranges or size != total or (sha256 and linked and linked.lower() != sha256.lower()):
+                return None
+            return _SegmentState.mirror(u, final, validator)
+
+        with ThreadPoolExecutor(max_workers=min(8, len(urls))) as pool:
+            return [m for m in pool.map(probe, urls) if m is not None]
+
+    @staticmethod
+    def _pick_mirror(state: "_SegmentState") -> Dict[str, Any]:
+        with state.lock:
+            live = [m for m in state.mirrors if not m["dead"]]
+            if not live:
+                raise IOError("no working mirror left")
+            state.picks += 1
+            untried = [m for m in live if m["tries"] == 0]
+            if untried:
+                mirror = untried[0]
+            elif len(live) > 1 and state.picks % 8 == 0:
+                mirror = min(live, key=lambda m: m["sampled_at"])  # re-check the stalest estimate
+            else:
+                mirror = max(live, key=lambda m: m["rate"] or 0.0)
+            mirror["tries"] += 1
+            return mirror
+
+    @staticmethod
+    def _load_journal(path: Optional[Path], url: str, total: int, validator: str) -> Optional[Dict[str, Any]]:
+        """Journal of an earlier attempt at the same file, or None if there is none or it went stale."""
+        if path is None or not path.exists():
+            return None
+        try:
+            journal = json.loads(path.read_text(encoding="utf-8"))
+            if int(journal.get("size", -1)) != total:
+                return None
+            known = journal.get("validators", {}).get(url)
+            if known and validator and known != validator:
+                return None  # this URL now serves a different file
+            return {"done": [tuple(r) for r in journal.get("done", [])],
+                    "validators": dict(journal.get("validators", {}))}
+        except Exception:
+            return None
+
+    @staticmethod
+    def _save_journal(path: Path, total: int, state: "_SegmentState") -> None:
+        try:
+            if state.fd >= 0:
+                os.fsync(state.fd)  # never record ranges whose bytes are not on disk yet
+            data = {"size": total, "validators": state.validators, "done": state.completed_ranges()}
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data), encoding="utf-8")
+            tmp.replace(path)
+        except Exception:
+            pass
+
+    def _worker(self, state: "_SegmentState", dest: Path) -> None:
+        handle, counted = None, True
+        try:
+            while not state.stop.is_set():
+                with state.lock:
+                    if state.active > state.target or not state.queue:
+                        # Retired by the controller, or nothing left; stop counting as active
+                        # in the same critical section so the controller never sees a ghost worker
+                        state.active -= 1
+                        counted = False
+                        break
+                    index = state.queue.popleft()
+                try:
+                    if handle is None and not hasattr(os, "pwrite"):
+                        handle = open(dest, "r+b")
+                    self._fetch_segment(state, index, handle)
+                except Exception as e:
+                    with state.lock:
+                        live = any(not m["dead"] for m in state.mirrors)
+                        if isinstance(e, DownloadChanged) and live:
+                            state.queue.append(index)  # only that mirror changed; the others carry on
+                            continue
+                        state.failures[index] = state.failures.get(index, 0) + 1
+                        if isinstance(e, DownloadChanged) or not live or state.failures[index] > self.segment_retries:
+                            state.error = e
+                            state.stop.set()
+                        else:
+                            state.queue.append(index)  # resumes from its last byte
+        finally:
+            if counted:
+                with state.lock:
+                    state.active -= 1
+            if handle is not None:
+                handle.close()
+
+    def _fetch_segment(self, state: "_SegmentState", index: int, handle: Any) -> None:
+        first, last = state.segments[index]
+        pos = first + state.progress[index]
+        if pos > last:
+            return
+        mirror = self._pick_mirror(state)
+        headers = {"Range": f"bytes={pos}-{last}"}
+        if mirror["validator"]:
+            headers["If-Range"] = mirror["validator"]
+        started, begin = time.perf_counter(), pos
+        try:
+            with self.session.get(mirror["final"], headers=headers, stream=True, timeout=self.timeout) as r:
+                if r.status_code == 200 and mirror["validator"]:
+                    raise DownloadChanged(f"file changed on {mirror['url']} since the download started")
+                if r.status_code != 206:
+                    raise IOError(f"server ignored Range request (HTTP {r.status_code})")
+                for chunk in r.iter_content(chunk_size=1024 * 256):
+                    if state.stop.is_set():
+                        return
+                    if not chunk:
+                        continue
+                    chunk = chunk[:last + 1 - pos]
+                    self._write(state, handle, pos, chunk)
+                    state.hasher.offer(pos, chunk)
+                    pos += len(chunk)
+                    with state.lock:
+                        state.progress[index] += len(chunk)
+                        state.done += len(chunk)
+                        mirror["bytes"] += len(chunk)
+                    if pos > last:
+                        break
+            if pos <= last:
+                raise IOError(f"segment {index} ended at byte {pos}, expected {last + 1}")
+        except Exception as e:
+            with state.lock:
+                mirror["failures"] += 1
+                others = any(not m["dead"] for m in state.mirrors if m is not mirror)
+                if isinstance(e, DownloadChanged) or (mirror["failures"] >= 2 and others):
+                    mirror["dead"] = True
+            raise
+        rate = (pos - begin) / max(time.perf_counter() - started, 1e-6)
+        with state.lock:
+            mirror["failures"] = 0
+            mirror["rate"] = rate if mirror["rate"] is None else 0.5 * mirror["rate"] + 0.5 * rate
+            mirror["sampled_at"] = time.perf_counter()
+
+    @staticmethod
+    def _write(state: "_SegmentState", handle: Any, offset: int, data: bytes) -> None:
+        if handle is None:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(state.fd, view, offset)
+                view, offset = view[written:], offset + written
+        else:
+            handle.seek(offset)
+            handle.write(data)
+
+    @staticmethod
+    def _preallocate(f: Any, total: int) -> None:
+        try:
+            os.posix_fallocate(f.fileno(), 0, total)  # real blocks: no fragmentation, early ENOSPC
+        except (AttributeError, OSError):
+            f.truncate(total)
+
+    def _download_single(self, url: str, dest: Path, total: int,
+                         on_progress: Optional[Callable[[int, int], None]]) -> tuple:
+        """(bytes written, _StreamHasher) of a plain streamed download."""
+        downloaded = 0
+        hasher = _StreamHasher(0)
+        with self.session.get(url, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            total = total or int(r.headers.get("content-length", 0) or 0)
+            with open(dest, "wb") as f:
+                for chunk in r.iter_content(chunk_size=1024 * 256):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    downloaded += len(chunk)
+                    if on_progress:
+                        on_progress(downloaded, total)
+        if total and downloaded != total:
+            raise IOError(f"incomplete download: {downloaded}/{total} bytes")
+        return downloaded, hasher
+
+    @staticmethod
+    def _verify(digest: str, expected: str, dest: Path) -> None:
+        if expected and digest != expected:
+            dest.unlink(missing_ok=True)
+            raise ChecksumMismatch(f"SHA-256 {digest} does not match pinned {expected}")
+
+    @staticmethod
+    def _stats(size: int, start: float, connections: int, segments: int) -> Dict[str, Any]:
+        seconds = time.perf_counter() - start
+        return {"bytes": size, "seconds": seconds, "connections": connections, "segments": segments,
+                "mb_per_s": size / (1024 * 1024) / seconds if seconds > 0 else 0.0}
+
+class _SegmentState:
+    """Shared bookkeeping of one SegmentedDownloader.download() call."""
+
+    def __init__(self, segments: List[tuple]):
+        self.segments = segments
+        self.progress = [0] * len(segments)  # bytes written per segment
+        self.queue = deque(range(len(segments)))
+        self.failures: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.error: Optional[Exception] = None
+        self.done = 0
+        self.active = 0
+        self.target = 1
+        self.peak = 0
+        self.fd = -1
+        self.mirrors: List[Dict[str, Any]] = []
+        self.picks = 0
+        self.validators: Dict[str, str] = {}
+        self.hasher: Optional[_StreamHasher] = None
+
+    @staticmethod
+    def mirror(url: str, final_url: str, validator: str) -> Dict[str, Any]:
+        return {"url": url, "final": final_url, "validator": validator, "rate": None, "tries": 0,
+                "sampled_at": 0.0, "failures": 0, "dead": False, "bytes": 0}
+
+    def resume(self, done: List[tuple]) -> None:
+        """Mark bytes from a journal's completed [start, end) ranges as already written."""
+        for index, (first, last) in enumerate(self.segments):
+            for start, end in done:
+                if start <= first < end:
+                    self.progress[index] = min(end, last + 1) - first
+        self.done = sum(self.progress)
+
+    def written_prefix(self) -> int:
+        """End of the contiguous run of written bytes from the start of the file."""
+        with self.lock:
+            for (first, last), n in zip(self.segments, self.progress):
+                if n < last + 1 - first:
+                    return first + n
+        return self.segments[-1][1] + 1
+
+    def completed_ranges(self) -> List[List[int]]:
+        """Written bytes as merged [start, end) ranges."""
+        with self.lock:
+            ranges = [[first, first + n] for (first, _), n in zip(self.segments, self.progress) if n]
+        merged: List[List[int]] = []
+        for start, end in ranges:
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return merged
+
+class MirrorSelector:
+    """Ranks download URLs by latency and throughput, with scores kept across runs.
+
+    probe() fetches the first probe_bytes of every URL concurrently, so dead or
+    slow mirrors cost one short timeout in parallel instead of a 30 s timeout
+    each in turn. Scores are per host (moving averages of latency and MB/s,
+    also fed by finished downloads). A circuit breaker skips a host after
+    failure_threshold consecutive failures, for cooldown_s doubling with each
+    further failure (at most a day); once the cooldown has passed, one probe
+    is let through and a success closes the breaker again.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, path: Path = MIRRORS_FILE,
+                 probe_bytes: int = 256 * 1024, timeout: float = 8, failure_threshold: int = 3,
+                 cooldown_s: float = 900):
+        self.session = session or _make_download_session()
+        self.path = Path(path)
+        self.probe_bytes = probe_bytes
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self._lock = threading.Lock()
+        self._scores: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @staticmethod
+    def host(url: str) -> str:
+        from urllib.parse import urlsplit
+        return urlsplit(url).netloc.lower()
+
+    def is_open(self, url: str) -> bool:
+        """True while the breaker for url's host is open (the mirror is skipped)."""
+        with self._lock:
+            score = self._load().get(self.host(url), {})
+            return score.get("open_until", 0) > time.time()
+
+    def probe(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """Probe all URLs at once; one result per URL, in the given order."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def one(url: str) -> Dict[str, Any]:
+            result: Dict[str, Any] = {"url": url, "ok": False}
+            if self.is_open(url):
+                result["error"] = "circuit open"
+                return result
+            try:
+                start = time.perf_counter()
+                with self.session.get(url, headers={"Range": f"bytes=0-{self.probe_bytes - 1}"}, stream=True,
+                                      timeout=self.timeout, allow_redirects=True) as r:
+                    r.raise_for_status()
+                    latency = time.perf_counter() - start
+                    received = 0
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        received += len(chunk)
+                        if received >= self.probe_bytes:
+                            break
+                    elapsed = max(time.perf_counter() - start - latency, 1e-3)
+                    match = re.match(r"bytes\s+\d+-\d+/(\d+)", r.headers.get("Content-Range", ""))
+                    size = int(match.group(1)) if match else int(r.headers.get("content-length", 0) or 0)
+                    linked = next((h.headers["X-Linked-Etag"] for h in [*r.history, r]
+                                   if "X-Linked-Etag" in h.headers), "").strip('"')
+                result.update(ok=True, latency_s=latency, mb_per_s=received / (1024 * 1024) / elapsed,
+                              size=size, ranges=r.status_code == 206, sha256=linked)
+                self.record(url, True, latency_s=latency, mb_per_s=result["mb_per_s"])
+            except Exception as e:
+                result["error"] = str(e)
+                self.record(url, False)
+            return result
+
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(8, len(urls))) as pool:
+            return list(pool.map(one, urls))
+
+    def rank(self, urls: List[str]) -> List[List[str]]:
+        """Live URLs grouped by the file they serve, fastest mirror first within each group.
+
+        Groups keep the order of `urls`, which lists preferred files first; only
+        URLs with the same size (and SHA-256, when both publish one) are treated
+        as mirrors of each other.
+        """
+        groups: List[Dict[str, Any]] = []
+        for result in self.probe(urls):
+            if not result["ok"]:
+                continue
+            for group in groups:
+                if group["size"] == result["size"] and (not group["sha256"] or not result["sha256"]
+                                                        or group["sha256"] == result["sha256"]):
+                    group["urls"].append(result["url"])
+                    group["sha256"] = group["sha256"] or result["sha256"]
+                    break
+            else:
+                groups.append({"size": result["size"], "sha256": result["sha256"], "urls": [result["url"]]})
+        return [sorted(g["urls"], key=self.expected_seconds) for g in groups]
+
+    def expected_seconds(self, url: str, mb: float = 8.0) -> float:
+        """Estimated time to fetch an mb-sized segment from url's host (lower is better)."""
+        with self._lock:
+            score = self._load().get(self.host(url), {})
+        if not score.get("mb_per_s"):
+            return float("inf")
+        return score.get("latency_s", 0.0) + mb / score["mb_per_s"]
+
+    def record(self, url: str, ok: bool, latency_s: Optional[float] = None,
+               mb_per_s: Optional[float] = None) -> None:
+        """Fold a probe or download outcome into the host's score and breaker state."""
+        with self._lock:
+            scores = self._load()
+            score = scores.setdefault(self.host(url), {"failures": 0})
+            if ok:
+                score["failures"] = 0
+                score.pop("open_until", None)
+                for key, value in (("latency_s", latency_s), ("mb_per_s", mb_per_s)):
+                    if value is not None:
+                        score[key] = value if key not in score else 0.7 * score[key] + 0.3 * value
+            else:
+                score["failures"] = score.get("failures", 0) + 1
+                over = score["failures"] - self.failure_threshold
+                if over >= 0:
+                    score["open_until"] = time.time() + min(self.cooldown_s * 2 ** over, 86400)
+            score["at"] = time.time()
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(scores, indent=1), encoding="utf-8")
+                tmp.replace(self.path)
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {host: dict(score) for host, score in self._load().items()}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._scores is None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self._scores = data if isinstance(data, dict) else {}
+            except Exception:
+                self._scores = {}
+        return self._scores
+
+class ModelIntegrity:
+    """Chunk-hash manifests for model files: parallel verification and repair of just the bad chunks.
+
+    The manifest (<model>.manifest.json next to the file) lists the SHA-256 of
+    every MANIFEST_CHUNK_MB block. It is written when a download finishes, from
+    the hashes computed inline, or by build_manifest() for an older download
+    whose full SHA-256 still matches the published one. verify() hashes chunks
+    on a thread pool (hashlib releases the GIL on large buffers); repair()
+    re-fetches only the mismatching chunks with Range requests from the
+    manifest's URLs and checks each against its hash before writing it.
+    """
+
+    @staticmethod
+    def manifest_path(model_path: Path) -> Path:
+        model_path = Path(model_path)
+        return model_path.with_name(model_path.name + ".manifest.json")
+
+    @staticmethod
+    def save_manifest(model_path: Path, size: int, sha256: str, chunk_size: int, chunks: List[str],
+                      urls: List[str], verified: bool) -> Dict[str, Any]:
+        manifest = {"file": Path(model_path).name, "size": size, "sha256": sha256, "verified": verified,
+                    "chunk_size": chunk_size, "chunks": chunks, "urls": urls, "created": time.time()}
+        path = ModelIntegrity.manifest_path(model_path)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(manifest, indent=1), encoding="utf-8")
+        tmp.replace(path)
+        return manifest
+
+    @staticmethod
+    def load_manifest(model_path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            manifest = json.loads(ModelIntegrity.manifest_path(model_path).read_text(encoding="utf-8"))
+            if manifest.get("chunks") and manifest.get("chunk_size"):
+                return manifest
+        except Exception:
+            pass
+        return None
+
+    @staticmethod
+    def build_manifest(model_path: Path, expected_sha256: str, urls: List[str],
+                       chunk_mb: float = MANIFEST_CHUNK_MB) -> Optional[Dict[str, Any]]:
+        """Manifest for a file downloaded before manifests existed; None unless it matches expected_sha256."""
+        if not expected_sha256:
+            return None
+        hasher = _StreamHasher(0, chunk_size=int(chunk_mb * 1024 * 1024))
+        with open(model_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(block)
+        if hasher.hexdigest() != expected_sha256.lower():
+            return None
+        return ModelIntegrity.save_manifest(model_path, hasher.offset, hasher.hexdigest(), hasher.chunk_size,
+                                            hasher.chunk_hashes(), urls, verified=True)
+
+    @staticmethod
+    def verify(model_path: Path, manifest: Optional[Dict[str, Any]] = None,
+               workers: Optional[int] = None) -> Optional[List[int]]:
+        """Indices of chunks that do not match the manifest ([] = intact, None = no manifest)."""
+        manifest = manifest or ModelIntegrity.load_manifest(model_path)
+        if manifest is None:
+            return None
+        from concurrent.futures import ThreadPoolExecutor
+        chunk_size, expected = manifest["chunk_size"], manifest["chunks"]
+
+        def check(index: int) -> bool:
+            sha = hashlib.sha256()
+            remaining = min(chunk_size, manifest["size"] - index * chunk_size)
+            try:
+                with open(model_path, "rb") as f:
+                    f.seek(index * chunk_size)
+                    while remaining > 0:
+                        block = f.read(min(remaining, 1024 * 1024))
+                        if not block:
+                            return False
+                        sha.update(block)
+                        remaining -= len(block)
+            except OSError:
+                return False
+            return sha.hexdigest() == expected[index]
+
+        workers = workers or min(8, os.cpu_count() or 2)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            bad = [i for i, ok in enumerate(pool.map(check, range(len(expected)))) if not ok]
+        try:
+            if Path(model_path).stat().st_size > manifest["size"] and (len(expected) - 1) not in bad:
+                bad.append(len(expected) - 1)  # trailing garbage: repair() truncates it
+        except OSError:
+            pass
+        return bad
+
+    @staticmethod
+    def repair(model_path: Path, bad: List[int], manifest: Optional[Dict[str, Any]] = None,
+               session: Optional[requests.Session] = None, workers: int = 4) -> List[int]:
+        """Re-download the given chunks in place; returns the ones that could not be repaired."""
+        manifest = manifest or ModelIntegrity.load_manifest(model_path)
+        if manifest is None or not bad:
+            return list(bad)
+        from concurrent.futures import ThreadPoolExecutor
+        session = session or _make_download_session()
+        chunk_size, size = manifest["chunk_size"], manifest["size"]
+        lock = threading.Lock()
+        with open(model_path, "r+b") as f:
+            f.truncate(size)
+
+            def fetch(index: int) -> Optional[int]:
+                first = index * chunk_size
+                last = min(first + chunk_size, size) - 1
+                for url in manifest.get("urls", []):
+                    try:
+                        r = session.get(url, headers={"Range": f"bytes={first}-{last}"}, timeout=30)
+                        if r.status_code != 206 or hashlib.sha256(r.content).hexdigest() != manifest["chunks"][index]:
+                            continue
+                        with lock:
+                            f.seek(first)
+                            f.write(r.content)
+                        return None
+                    except Exception:
+                        continue
+                return index
+
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(bad)))) as pool:
+                still_bad = [i for i in pool.map(fetch, bad) if i is not None]
+            f.flush()
+            os.fsync(f.fileno())
+        return still_bad
+
+    @staticmethod
+    def start_health_check(model_path: Path, on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+                           repair: bool = True, workers: int = 2) -> Optional[threading.Thread]:
+        """Verify (and repair) a model in a daemon thread once the prefetcher has read it into the page cache.
+
+        Chunks are only rewritten while no pooled instance has the file mapped;
+        otherwise the bad chunks are reported and left for --verify.
+        """
+        manifest = ModelIntegrity.load_manifest(model_path)
+        if manifest is None:
+            return None
+
+        def run() -> None:
+            PREFETCHER.wait(model_path, timeout=600)
+            start = time.perf_counter()
+            result: Dict[str, Any] = {"model": Path(model_path).name, "chunks": len(manifest["chunks"]),
+                                      "bad": 0, "repaired": 0}
+            try:
+                bad = ModelIntegrity.verify(model_path, manifest, workers=workers) or []
+                # Rewriting a file llama.cpp has mmap'd changes live weights (or SIGBUSes on truncation)
+                repair_now = bad and repair and not MODEL_POOL.is_loaded(model_path)
+                still_bad = ModelIntegrity.repair(model_path, bad, manifest) if repair_now else bad
+                result.update(bad=len(still_bad), repaired=len(bad) - len(still_bad))
+            except Exception as e:
+                result["error"] = str(e)
+            result["seconds"] = time.perf_counter() - start
+            if on_done:
+                try:
+                    on_done(result)
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=run, daemon=True, name="verdant-health-check")
+        thread.start()
+        return thread
+
+    @staticmethod
+    def describe(result: Dict[str, Any]) -> str:
+        """One-line status for a health check result."""
+        if result.get("error"):
+            return f"⚠️ Model check failed: {result['error']}"
+        if result.get("bad"):
+            return f"⚠️ {result['bad']} corrupted model chunk(s); run: python verdant.py --verify"
+        if result.get("repaired"):
+            return f"🩺 Repaired {result['repaired']} corrupted model chunk(s)"
+        return f"🩺 Model OK ({result['chunks']} chunks checked in {result.get('seconds', 0):.1f}s)"
+
 class ModelDownloader:
     """Handle model downloading with progress tracking and validation."""
     
-    def __init__(self, model_dir: Optional[str] = None):
+    def __init__(self, model_dir: Optional[str] = None, connections: int = 4, max_connections: int = 16):
         # For frozen apps, store models in LOCALAPPDATA/Verdant/models to avoid temp dirs
         if model_dir is None:
             if getattr(sys, "frozen", False):
@@ -153,6 +1206,11 @@ class ModelDownloader:
                 model_dir = "models"
         self.model_dir = Path(model_dir)
         self.model_dir.mkdir(parents=True, exist_ok=True)
+        self.session = _make_download_session(max_connections)
+        self.connections = connections
+        self.max_connections = max_connections
+        self.last_transfer: Dict[str, Any] = {}
+        self.mirrors = MirrorSelector(self.session)
     
     def download_model(self, model_key: str, on_progress: Optional[Callable[[float, int, int], None]] = None) -> bool:
         """Download a model with progress tracking.
@@ -177,77 +1235,93 @@ class ModelDownloader:
         if model.url not in urls:
             urls.append(model.url)
         
+        # Probe every candidate at once; dead hosts drop out here instead of timing out one by one
+        groups = self.mirrors.rank(urls)
+        if not groups:
+            print("   ⚠️  No mirror answered the probe; trying each URL in turn")
+            groups = [[u] for u in urls]
+        
         last_error: Optional[Exception] = None
-        for i, u in enumerate(urls, 1):
-            print(f"   URL {i}/{len(urls)}: {u}")
+        for i, group in enumerate(groups, 1):
+            u, alternates = group[0], group[1:]
+            print(f"   URL {i}/{len(groups)}: {u}" + (f" (+{len(alternates)} mirror(s))" if alternates else ""))
             try:
-                self._download_with_retries(u, model_path, on_progress=on_progress)
+                expected = next(((model.checksums or {}).get(m) for m in group
+                                 if (model.checksums or {}).get(m)), model.checksum)
+                self._download_with_retries(u, model_path, on_progress=on_progress, expected_sha256=expected,
+                                            mirrors=alternates)
                 print(f"\n✅ Download complete: {model_path}")
-                checksum = self._calculate_checksum(model_path)
-                print(f"   Checksum: {checksum}")
+                t = self.last_transfer
+                print(f"   SHA-256: {t['sha256']} ({'verified' if t['verified'] else 'no pinned checksum'})")
+                self.mirrors.record(u, True, mb_per_s=t["mb_per_s"])
+                try:
+                    ModelIntegrity.save_manifest(model_path, t["bytes"], t["sha256"], t["chunk_size"], t["chunks"],
+                                                 group, verified=t["verified"])
+                except Exception as e:
+                    print(f"   ⚠️  Could not write the chunk manifest: {e}")
                 return True
             except Exception as e:
                 last_error = e
+                if not isinstance(e, ChecksumMismatch):
+                    self.mirrors.record(u, False)
                 print(f"   ⚠️  Failed URL {i}: {e}")
         
-        print(f"\n❌ Download failed after trying {len(urls)} URL(s): {last_error}")
-        if model_path.exists():
-            try:
-                model_path.unlink()
-            except Exception:
-                pass
+        print(f"\n❌ Download failed after trying {len(groups)} URL(s): {last_error}")
+        if model_path.with_suffix(model_path.suffix + ".part").exists():
+            print("   Partial download kept; run setup again to resume.")
         return False
     
     def _download_with_retries(self, url: str, dest: Path, max_retries: int = 3, timeout: int = 30,
-                               on_progress: Optional[Callable[[float, int, int], None]] = None) -> None:
-        """Robust downloader with retries, progress, and cert handling."""
-        headers = {
-            "User-Agent": "Verdant/0.2 (+https://github.com/kaankutluturk/verdant)",
-            "Accept": "application/octet-stream, */*"
-        }
+                               on_progress: Optional[Callable[[float, int, int], None]] = None,
+                               expected_sha256: str = "", mirrors: Optional[List[str]] = None) -> None:
+        """Robust downloader with retries and progress; parallel Range segments when the server allows.
+        The .part file is only renamed into place once its SHA-256 matches expected_sha256 (if pinned).
+        """
+        downloader = SegmentedDownloader(self.session, connections=self.connections,
+                                         max_connections=self.max_connections, timeout=timeout)
+
+        def report(downloaded: int, total_size: int) -> None:
+            if total_size <= 0:
+                return
+            percent = (downloaded / total_size) * 100
+            if on_progress:
+                on_progress(percent, downloaded, total_size)
+            else:
+                bar_length = 40
+                filled_length = int(bar_length * downloaded // total_size)
+                bar = '█' * filled_length + '-' * (bar_length - filled_length)
+                print(f"\r   [{bar}] {percent:.1f}% ({downloaded / (1024*1024):.1f} MB)", end='', flush=True)
+
         last_err: Optional[Exception] = None
+        tmp_path = dest.with_suffix(dest.suffix + ".part")
+        journal_path = tmp_path.with_suffix(tmp_path.suffix + ".json")
         for attempt in range(1, max_retries + 1):
             try:
-                with requests.get(url, stream=True, headers=headers, timeout=timeout, verify=certifi.where(), allow_redirects=True) as r:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get('content-length', 0))
-                    downloaded = 0
-                    tmp_path = dest.with_suffix(dest.suffix + ".part")
-                    if tmp_path.exists():
-                        tmp_path.unlink()
-                    with open(tmp_path, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=1024 * 256):  # 256KB
-                            if not chunk:
-                                continue
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            if total_size > 0:
-                                percent = (downloaded / total_size) * 100
-                                if on_progress:
-                                    on_progress(percent, downloaded, total_size)
-                                else:
-                                    bar_length = 40
-                                    filled_length = int(bar_length * downloaded // total_size)
-                                    bar = '█' * filled_length + '-' * (bar_length - filled_length)
-                                    print(f"\r   [{bar}] {percent:.1f}% ({downloaded / (1024*1024):.1f} MB)", end='', flush=True)
-                    tmp_path.replace(dest)
+                # The .part file and its journal survive failures, so each attempt resumes
+                self.last_transfer = downloader.download(url, tmp_path, on_progress=report,
+                                                         journal_path=journal_path,
+                                                         expected_sha256=expected_sha256, mirrors=mirrors)
+                tmp_path.replace(dest)
+                t = self.last_transfer
+                print(f"\n   {t['mb_per_s']:.1f} MB/s over {t['connections']} connection(s), {t['segments']} segment(s)")
+                if len(t.get("mirrors", {})) > 1:
+                    for m, size in t["mirrors"].items():
+                        print(f"   {size / (1024 * 1024):.1f} MB from {MirrorSelector.host(m)}")
                 return
+            except ChecksumMismatch:
+                raise  # this URL serves other bytes; retrying it will not help
             except Exception as e:
                 last_err = e
                 print(f"\n⚠️  Attempt {attempt}/{max_retries} failed: {e}")
                 time.sleep(2 * attempt)
         raise RuntimeError(f"All download attempts failed: {last_err}")
 
-    def _calculate_checksum(self, file_path: Path) -> str:
-        """Calculate SHA256 checksum of a file."""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
-    
     def validate_model(self, model_key: str) -> bool:
-        """Validate downloaded model file."""
+        """Validate downloaded model file (size and chunk manifest; no hashing).
+
+        Hashing every chunk reads the whole file, so that is left to the
+        background health check and to --verify / repair_model().
+        """
         if model_key not in MODELS:
             return False
         
@@ -267,6 +1341,50 @@ class ModelDownloader:
                 print(f"✅ Model validation passed: {model_path}")
         except Exception as e:
             print(f"⚠️  Skipping size check: {e}")
+        manifest = ModelIntegrity.load_manifest(model_path)
+        if manifest is None:
+            print("ℹ️  No chunk manifest yet; run: python verdant.py --verify")
+        elif manifest.get("size") != model_path.stat().st_size:
+            print(f"❌ File is {model_path.stat().st_size} bytes but its manifest says {manifest.get('size')}; "
+                  "run: python verdant.py --verify")
+            return False
+        return True
+
+    def repair_model(self, model_key: str) -> bool:
+        """Verify a model chunk by chunk and re-download only the corrupted chunks."""
+        model = MODELS.get(model_key)
+        model_path = self.model_dir / model.filename if model else None
+        if model_path is None or not model_path.exists():
+            print(f"❌ Model not found: {model_key}")
+            return False
+        manifest = ModelIntegrity.load_manifest(model_path)
+        if manifest is None:
+            # Downloaded before manifests: only trust the file if it matches a published SHA-256
+            print("🔎 No chunk manifest yet; checking the whole file against the published SHA-256…")
+            urls = (model.candidate_urls or []) + ([model.url] if model.url not in (model.candidate_urls or []) else [])
+            size = model_path.stat().st_size
+            probes = [p for p in self.mirrors.probe(urls) if p["ok"] and p["size"] == size]
+            pinned = [(model.checksums or {}).get(p["url"]) or model.checksum or p["sha256"] for p in probes]
+            expected = next((sha for sha in pinned if sha), "")
+            manifest = ModelIntegrity.build_manifest(model_path, expected, [p["url"] for p in probes])
+            if manifest is None:
+                why = "it does not match" if expected else "no published checksum to compare with"
+                print(f"❌ Cannot verify {model_path.name}: {why}. Delete it and run --setup again.")
+                return False
+            print(f"✅ {model_path.name} matches {expected[:12]}…; manifest written")
+            return True
+        start = time.perf_counter()
+        bad = ModelIntegrity.verify(model_path, manifest) or []
+        print(f"🩺 {len(manifest['chunks'])} chunks checked in {time.perf_counter() - start:.1f}s, {len(bad)} corrupted")
+        if not bad:
+            return True
+        still_bad = ModelIntegrity.repair(model_path, bad, manifest, session=self.session)
+        if still_bad:
+            print(f"❌ {len(still_bad)} chunk(s) could not be re-downloaded")
+            return False
+        size, chunk_size = manifest["size"], manifest["chunk_size"]
+        fetched = sum(min(chunk_size, size - i * chunk_size) for i in bad)
+        print(f"✅ Repaired {len(bad)} chunk(s) ({fetched / (1024 * 1024):.1f} MB re-downloaded)")
         return True
     
     def get_model_path(self, model_key: str) -> Optional[Path]:
@@ -282,81 +1400,1374 @@ class ModelDownloader:
         
         return model_path
 
-class AIInference:
-    """Handle AI model inference using llama-cpp-python."""
-    
-    def __init__(self, model_path: Path, n_ctx: Optional[int] = None, n_threads: Optional[int] = None,
-                 temperature: float = 0.7, top_p: float = 0.9, n_gpu_layers_override: Optional[int] = None):
-        self.model_path = model_path
-        self.llm = None
-        self.n_ctx_override = n_ctx
-        self.n_threads_override = n_threads
-        self.temperature = temperature
-        self.top_p = top_p
-        self.n_gpu_layers_override = n_gpu_layers_override
-        self._load_model()
-    
-    def _load_model(self):
-        """Load the model with hardware-optimized settings."""
+class TokenizerService:
+    """Exact token counts using a loaded model's vocabulary.
+
+    Tokenization only reads the vocabulary, so it runs without the generation
+    lock; recent strings (system prompts, presets, chat transcripts) are
+    memoized in an LRU so repeated metrics and limits cost a dict lookup.
+    """
+
+    def __init__(self, llm: Any, max_entries: int = 1024):
+        self.llm = llm
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tokenize(self, text: str, add_bos: bool = False, special: bool = False) -> List[int]:
+        key = (text, add_bos, special)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(tokens)
+        data = text.encode("utf-8")
         try:
-            # For frozen Windows builds, ensure packaged llama_cpp DLLs are on the path
-            if getattr(sys, "frozen", False) and platform.system() == "Windows":
-                try:
-                    meipass = Path(getattr(sys, "_MEIPASS", ""))
-                    dll_dir = meipass / "llama_cpp" / "lib"
-                    if dll_dir.exists():
-                        if hasattr(os, "add_dll_directory"):
-                            os.add_dll_directory(str(dll_dir))
-                        os.environ["PATH"] = f"{dll_dir};" + os.environ.get("PATH", "")
-                except Exception:
-                    pass
-            
-            from llama_cpp import Llama
-            
-            # Get hardware info for optimization
-            info = HardwareDetector.get_system_info()
-            performance_tier = HardwareDetector.get_performance_tier()
-            
-            # Configure based on hardware or overrides
-            if performance_tier == "high":
-                default_n_ctx = 4096
-                default_threads = info["cpu_count"]
-            elif performance_tier == "medium":
-                default_n_ctx = 2048
-                default_threads = max(4, info["cpu_count"] // 2)
-            else:
-                default_n_ctx = 1024
-                default_threads = max(2, info["cpu_count"] // 2)
+            tokens = tuple(self.llm.tokenize(data, add_bos=add_bos, special=special))
+        except TypeError:
+            # Older llama-cpp-python without the special flag
+            tokens = tuple(self.llm.tokenize(data, add_bos=add_bos))
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return list(tokens)
 
-            n_ctx = self.n_ctx_override or default_n_ctx
-            n_threads = self.n_threads_override or default_threads
-            # Enforce capability caps (e.g., demo vs premium)
-            try:
-                caps = get_capabilities()
-                if isinstance(caps, dict) and "max_context" in caps and isinstance(caps["max_context"], int):
-                    n_ctx = min(n_ctx, int(caps["max_context"]))
-            except Exception:
-                pass
-            # GPU layers (optional, depends on installed wheel build)
-            n_gpu_layers = 0
-            try:
-                if self.n_gpu_layers_override is not None:
-                    n_gpu_layers = max(0, int(self.n_gpu_layers_override))
-            except Exception:
-                n_gpu_layers = 0
-            
-            print(f"🔧 Loading model with {n_threads} threads, context {n_ctx}")
-            
-            self.llm = Llama(
-                model_path=str(self.model_path),
-                n_ctx=n_ctx,
-                n_threads=n_threads,
-                n_gpu_layers=n_gpu_layers,
-                verbose=False
-            )
-            
-            print("✅ Model loaded successfully!")
-            
+    def count(self, text: str, special: bool = False) -> int:
+        return len(self.tokenize(text, special=special)) if text else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+def estimate_tokens(text: str) -> int:
+    """Token estimate for when no model is loaded (demo mode): about 4 characters per token."""
+    return max(len(text.split()), (len(text) + 3) // 4) if text else 0
+
+def count_tokens(text: str, ai: Any = None, special: bool = False) -> int:
+    """Exact count with ai's tokenizer when a model is loaded, otherwise an estimate."""
+    counter = getattr(ai, "count_tokens", None)
+    if callable(counter):
+        try:
+            return counter(text, special=special)
+        except Exception:
+            pass
+    return estimate_tokens(text)
+
+class ModelPool:
+    """Process-wide pool of loaded Llama instances.
+
+    Instances are keyed by (model path, n_ctx, n_threads, n_gpu_layers) so every
+    frontend asking for the same configuration shares one mmap'd model instead of
+    re-initializing the GGUF on each message. Least-recently-used models are
+    evicted when RAM runs low or the pool is full.
+    """
+
+    def __init__(self, max_models: int = 2, min_free_ram_gb: float = 1.0):
+        self.max_models = max_models
+        self.min_free_ram_gb = min_free_ram_gb
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_path: Path, n_ctx: int, n_threads: int, n_gpu_layers: int, **options: Any) -> tuple:
+        """Pool key; extra load options (e.g. a draft model) that change the instance are appended."""
+        try:
+            path = str(Path(model_path).resolve())
+        except Exception:
+            path = str(model_path)
+        return (path, int(n_ctx), int(n_threads), int(n_gpu_layers)) + tuple(sorted(options.items()))
+
+    def acquire(self, key: tuple, loader: Callable[[], Any]) -> Any:
+        """Return the pooled instance for key, calling loader() on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["llm"]
+            self.misses += 1
+            self._make_room(self._estimate_size_gb(key[0]))
+            llm = loader()
+            self._entries[key] = {"llm": llm, "lock": threading.RLock(), "metrics": {}, "loaded_at": time.time()}
+            return llm
+
+    def lock_for(self, llm: Any) -> "threading.RLock":
+        """Lock serializing generation on a shared instance (llama contexts are not thread-safe)."""
+        entry = self._entry_for(llm)
+        return entry["lock"] if entry else threading.RLock()
+
+    def tokenizer_for(self, llm: Any) -> TokenizerService:
+        """Shared tokenizer (and its LRU) for a pooled instance."""
+        entry = self._entry_for(llm)
+        if entry is None:
+            return TokenizerService(llm)
+        with self._lock:
+            if "tokenizer" not in entry:
+                entry["tokenizer"] = TokenizerService(llm)
+            return entry["tokenizer"]
+
+    def metrics_for(self, llm: Any) -> Dict[str, Any]:
+        """Counters that live as long as the pooled instance, shared by every AIInference using it."""
+        entry = self._entry_for(llm)
+        return entry["metrics"] if entry else {}
+
+    def _entry_for(self, llm: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["llm"] is llm:
+                    return entry
+        return None
+
+    def is_loaded(self, model_path: Path) -> bool:
+        """True if any pooled instance has this model file open."""
+        path = self.make_key(model_path, 0, 0, 0)[0]
+        with self._lock:
+            return any(key[0] == path for key in self._entries)
+
+    def evict(self, key: tuple) -> bool:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self.evictions += 1
+        self._close(entry["llm"])
+        return True
+
+    def evict_idle(self, key: tuple) -> bool:
+        """Evict key only if no generation currently holds its instance lock."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry["lock"].acquire(blocking=False):
+                return False
+            try:
+                del self._entries[key]
+                self.evictions += 1
+            finally:
+                entry["lock"].release()
+        self._close(entry["llm"])
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            keys = list(self._entries.keys())
+        for key in keys:
+            self.evict(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loaded": len(self._entries),
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+    def _make_room(self, needed_gb: float) -> None:
+        """Evict idle models, least recently used first; models mid-generation are never closed."""
+        while self._entries:
+            if len(self._entries) < self.max_models and self._free_ram_gb() - needed_gb >= self.min_free_ram_gb:
+                return
+            for key in list(self._entries):
+                if self.evict_idle(key):
+                    print(f"♻️  Evicted least recently used model: {Path(key[0]).name} (ctx {key[1]})")
+                    break
+            else:
+                print("⚠️  Every pooled model is busy; loading over the memory budget")
+                return
+
+    @staticmethod
+    def _free_ram_gb() -> float:
+        try:
+            import psutil
+            return psutil.virtual_memory().available / (1024**3)
+        except Exception:
+            return float("inf")
+
+    @staticmethod
+    def _estimate_size_gb(model_path: str) -> float:
+        try:
+            return Path(model_path).stat().st_size / (1024**3)
+        except Exception:
+            return 0.0
+
+    @staticmethod
+    def _close(llm: Any) -> None:
+        try:
+            close = getattr(llm, "close", None)
+            if callable(close):
+                close()
+        except Exception:
+            pass
+
+MODEL_POOL = ModelPool()
+
+def choose_memory_policy(model_path: Path, use_mmap: Optional[bool] = None,
+                         use_mlock: Optional[bool] = None) -> Dict[str, bool]:
+    """use_mmap/use_mlock for loading a GGUF; None picks a value from available RAM.
+
+    mmap stays on unless turned off explicitly: weights are shared with the OS
+    page cache (which the prefetcher fills) instead of being copied. mlock pins
+    them so they are not paged out between messages, which only pays off when
+    the model fits with room to spare and the memlock limit allows it; on a
+    tight machine it would push everything else into swap.
+    """
+    if use_mmap is None:
+        use_mmap = True
+    if use_mlock is None:
+        size_gb = ModelPool._estimate_size_gb(str(model_path))
+        use_mlock = ModelPool._free_ram_gb() - size_gb >= max(4.0, size_gb)
+        try:
+            import resource
+            soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+            if soft != resource.RLIM_INFINITY and soft < size_gb * (1024**3):
+                use_mlock = False
+        except Exception:
+            pass  # no memlock limit to check (Windows)
+    return {"use_mmap": bool(use_mmap), "use_mlock": bool(use_mlock and use_mmap)}
+
+class ModelPrefetcher:
+    """Streams GGUF files into the OS page cache on background threads.
+
+    Started while the UI (or llama_cpp import) is still coming up, so the load
+    that follows reads from RAM instead of a slow disk. posix_fadvise(WILLNEED)
+    or madvise(WILLNEED) starts kernel readahead, and a sequential read makes
+    sure every page is touched where those hints are missing or capped.
+    Skipped when the file would not fit in available RAM, since it would just
+    evict itself.
+    """
+
+    def __init__(self, chunk_mb: int = 8):
+        self.chunk_mb = chunk_mb
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, model_path: Path) -> bool:
+        path = str(Path(model_path))
+        with self._lock:
+            if path in self._jobs:
+                return False
+            size_gb = ModelPool._estimate_size_gb(path)
+            if not size_gb or size_gb > ModelPool._free_ram_gb() * 0.9:
+                return False
+            job = {"bytes": 0, "size": int(size_gb * (1024**3)), "done": threading.Event(),
+                   "cancel": threading.Event(), "seconds": None}
+            self._jobs[path] = job
+        threading.Thread(target=self._run, args=(path, job), daemon=True).start()
+        return True
+
+    def completed(self, model_path: Path) -> bool:
+        job = self._jobs.get(str(Path(model_path)))
+        return bool(job and job["done"].is_set() and not job["cancel"].is_set())
+
+    def wait(self, model_path: Path, timeout: Optional[float] = None) -> bool:
+        job = self._jobs.get(str(Path(model_path)))
+        return bool(job and job["done"].wait(timeout))
+
+    def cancel(self) -> None:
+        with self._lock:
+            for job in self._jobs.values():
+                job["cancel"].set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {Path(p).name: {"mb": job["bytes"] / (1024**2), "seconds": job["seconds"],
+                                   "done": job["done"].is_set()} for p, job in self._jobs.items()}
+
+    def _run(self, path: str, job: Dict[str, Any]) -> None:
+        start = time.perf_counter()
+        try:
+            with open(path, "rb", buffering=0) as f:
+                fd = f.fileno()
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                else:
+                    try:
+                        import mmap
+                        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                            mm.madvise(mmap.MADV_WILLNEED)
+                    except Exception:
+                        pass  # no madvise (Windows); the read below does the work
+                buf = bytearray(self.chunk_mb * 1024 * 1024)
+                while not job["cancel"].is_set():
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    job["bytes"] += n
+        except Exception:
+            job["cancel"].set()
+        finally:
+            job["seconds"] = time.perf_counter() - start
+            job["done"].set()
+
+PREFETCHER = ModelPrefetcher()
+
+class LoadTimeLog:
+    """Recorded model load times, so cold (from disk) and warm (page cache) loads can be compared.
+
+    A load counts as warm when the prefetcher finished reading the file first,
+    or when the same file was already loaded since the last boot.
+    """
+
+    def __init__(self, path: Path = LOAD_TIMES_FILE, max_records: int = 200):
+        self.path = Path(path)
+        self.max_records = max_records
+        self._lock = threading.Lock()
+
+    def record(self, model_path: Path, seconds: float, **details: Any) -> Dict[str, Any]:
+        with self._lock:
+            records = self.records()
+            name = Path(model_path).name
+            boot = self._boot_time()
+            prefetched = PREFETCHER.completed(model_path)
+            reloaded = any(r.get("model") == name and r.get("boot") == boot for r in records)
+            entry = {"model": name, "seconds": round(seconds, 3), "warm": prefetched or reloaded,
+                     "prefetched": prefetched, "boot": boot, "at": time.time()}
+            entry.update(details)
+            records = (records + [entry])[-self.max_records:]
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.path.write_text(json.dumps(records, indent=1), encoding="utf-8")
+            except Exception:
+                pass
+            return entry
+
+    def summary(self, model_path: Optional[Path] = None) -> Dict[str, Any]:
+        """Median cold and warm load seconds (None when there is no such load yet)."""
+        name = Path(model_path).name if model_path else None
+        records = [r for r in self.records() if name is None or r.get("model") == name]
+
+        def median(values: List[float]) -> Optional[float]:
+            values = sorted(values)
+            return values[len(values) // 2] if values else None
+
+        return {"loads": len(records),
+                "cold_s": median([r["seconds"] for r in records if not r.get("warm")]),
+                "warm_s": median([r["seconds"] for r in records if r.get("warm")])}
+
+    def records(self) -> List[Dict[str, Any]]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            return data if isinstance(data, list) else []
+        except Exception:
+            return []
+
+    @staticmethod
+    def _boot_time() -> Optional[float]:
+        try:
+            import psutil
+            return round(psutil.boot_time())
+        except Exception:
+            return None
+
+LOAD_TIMES = LoadTimeLog()
+
+_FINGERPRINTS: Dict[tuple, str] = {}
+
+def model_fingerprint(model_path: Path) -> str:
+    """Cheap identity hash of a model file (size, mtime and head/tail bytes).
+
+    Used to key cached KV states so they are invalidated when the model file
+    changes, without re-reading the whole multi-GB file.
+    """
+    path = Path(model_path)
+    st = path.stat()
+    memo_key = (str(path), st.st_size, st.st_mtime_ns)
+    fp = _FINGERPRINTS.get(memo_key)
+    if fp:
+        return fp
+    h = hashlib.sha256(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    span = 1024 * 1024
+    with open(path, "rb") as f:
+        h.update(f.read(span))
+        if st.st_size > span:
+            f.seek(max(span, st.st_size - span))
+            h.update(f.read(span))
+    fp = h.hexdigest()
+    _FINGERPRINTS[memo_key] = fp
+    return fp
+
+class KVStateStore:
+    """Two-tier store for llama KV states (save_state/load_state snapshots).
+
+    Recent states stay in a RAM LRU tier; older ones spill to zlib-compressed
+    files under ~/.verdant/kv_states. Keys combine the session id with the model
+    fingerprint and context size, so a changed model never restores stale state.
+    Without max_ram_mb the RAM tier takes at most a quarter of the currently
+    available memory (and never more than 1 GB). Files hold a small JSON header
+    plus the raw token ids, logits and llama state bytes; nothing is unpickled,
+    so a file dropped into the directory cannot run code.
+    """
+
+    MAGIC = b"VKVSTATE1\n"
+
+    def __init__(self, directory: Path = KV_STATE_DIR, max_ram_mb: Optional[int] = None, max_disk_mb: int = 4096,
+                 write_through: bool = False):
+        self.directory = Path(directory)
+        self.max_ram_mb = max_ram_mb
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        # Write every state to disk immediately (for snapshots that should outlive the process)
+        self.write_through = write_through
+        self._ram: "OrderedDict[str, Any]" = OrderedDict()
+        self._ram_sizes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.ram_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(session_id: str, model_id: str) -> str:
+        # No "-" in the session part so a session's keys share an unambiguous prefix
+        safe = "".join(c if c.isalnum() else "_" for c in str(session_id))[:64]
+        return f"{safe}-{model_id}"
+
+    def put(self, key: str, state: Any) -> None:
+        with self._lock:
+            self._ram[key] = state
+            self._ram.move_to_end(key)
+            self._ram_sizes[key] = self._state_size(state)
+            if self.write_through:
+                self._write_file(key, state)
+            else:
+                self._discard_file(key)
+            self._spill_over_budget()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            state = self._ram.get(key)
+            if state is not None:
+                self._ram.move_to_end(key)
+                self.ram_hits += 1
+                return state
+            path = self._path(key)
+            if path.exists():
+                try:
+                    state = self.decode(path.read_bytes())
+                    os.utime(path, None)
+                    self.disk_hits += 1
+                    # Promote back to the RAM tier; the file stays as the spill copy
+                    self._ram[key] = state
+                    self._ram_sizes[key] = self._state_size(state)
+                    self._spill_over_budget()
+                    return state
+                except Exception:
+                    self._discard_file(key)
+            self.misses += 1
+            return None
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._ram or self._path(key).exists()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._ram.pop(key, None)
+            self._ram_sizes.pop(key, None)
+            self._discard_file(key)
+
+    def discard_session(self, session_id: str, keep_model_id: Optional[str] = None) -> None:
+        """Drop every state for a session, e.g. those built with an older model file."""
+        prefix = self.make_key(session_id, "")
+        with self._lock:
+            for key in [k for k in self._ram if k.startswith(prefix)]:
+                if keep_model_id is None or key != prefix + keep_model_id:
+                    self.discard(key)
+            if self.directory.exists():
+                for path in self.directory.glob(f"{prefix}*.kvstate"):
+                    key = path.name[:-len(".kvstate")]
+                    if keep_model_id is None or key != prefix + keep_model_id:
+                        self._discard_file(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ram_states": len(self._ram),
+                "ram_mb": sum(self._ram_sizes.values()) / (1024 * 1024),
+                "ram_hits": self.ram_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def _spill_over_budget(self) -> None:
+        # Keep the most recent state in RAM even if it alone exceeds the budget
+        budget = self.ram_budget_bytes()
+        while len(self._ram) > 1 and sum(self._ram_sizes.values()) > budget:
+            key, state = self._ram.popitem(last=False)
+            self._ram_sizes.pop(key, None)
+            self._write_file(key, state)
+
+    def _write_file(self, key: str, state: Any) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(self.encode(state))
+            tmp.replace(path)
+            self._prune_disk()
+        except Exception as e:
+            print(f"⚠️  Could not spill KV state to disk: {e}")
+
+    def ram_budget_bytes(self) -> int:
+        if self.max_ram_mb is not None:
+            return self.max_ram_mb * 1024 * 1024
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+        except Exception:
+            available = 1024 ** 3
+        return int(min(1024 ** 3, available // 4))
+
+    @classmethod
+    def encode(cls, state: Any) -> bytes:
+        """Serialize a llama state: JSON header, then zlib-compressed raw arrays and state bytes."""
+        import numpy as np
+        input_ids = np.ascontiguousarray(getattr(state, "input_ids", []))
+        scores = getattr(state, "scores", None)
+        scores = np.ascontiguousarray(scores) if scores is not None else None
+        llama_state = bytes(getattr(state, "llama_state", b"") or b"")
+        header = {
+            "n_tokens": int(getattr(state, "n_tokens", len(input_ids))),
+            "llama_state_size": int(getattr(state, "llama_state_size", len(llama_state))),
+            "seed": getattr(state, "seed", None),
+            "input_ids": [input_ids.dtype.str, list(input_ids.shape)],
+            "scores": [scores.dtype.str, list(scores.shape)] if scores is not None else None,
+            "llama_state_len": len(llama_state),
+        }
+        body = input_ids.tobytes() + (scores.tobytes() if scores is not None else b"") + llama_state
+        head = json.dumps(header).encode("utf-8")
+        return cls.MAGIC + len(head).to_bytes(4, "little") + head + zlib.compress(body, 1)
+
+    @classmethod
+    def decode(cls, data: bytes) -> Any:
+        """Inverse of encode(); returns a llama_cpp.LlamaState when llama_cpp is installed."""
+        import numpy as np
+        if not data.startswith(cls.MAGIC):
+            raise ValueError("not a Verdant KV state file")
+        offset = len(cls.MAGIC)
+        size = int.from_bytes(data[offset:offset + 4], "little")
+        header = json.loads(data[offset + 4:offset + 4 + size].decode("utf-8"))
+        body = zlib.decompress(data[offset + 4 + size:])
+
+        def array(spec: Optional[list], start: int) -> tuple:
+            if spec is None:
+                return None, start
+            dtype = np.dtype(spec[0])
+            if dtype.kind not in "iuf":
+                raise ValueError(f"unexpected dtype {dtype}")
+            shape = tuple(int(n) for n in spec[1])
+            nbytes = dtype.itemsize * int(np.prod(shape))
+            return np.frombuffer(body[start:start + nbytes], dtype=dtype).reshape(shape).copy(), start + nbytes
+
+        input_ids, pos = array(header["input_ids"], 0)
+        scores, pos = array(header["scores"], pos)
+        fields = {"input_ids": input_ids, "scores": scores, "n_tokens": header["n_tokens"],
+                  "llama_state": body[pos:pos + header["llama_state_len"]],
+                  "llama_state_size": header["llama_state_size"], "seed": header["seed"]}
+        try:
+            from llama_cpp import LlamaState
+            try:
+                return LlamaState(**fields)
+            except TypeError:
+                fields.pop("seed")  # older llama-cpp-python
+                return LlamaState(**fields)
+        except ImportError:
+            return SimpleNamespace(**fields)
+
+    def _prune_disk(self) -> None:
+        files = sorted(self.directory.glob("*.kvstate"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        while files and total > self.max_disk_bytes:
+            oldest = files.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
+
+    def _discard_file(self, key: str) -> None:
+        try:
+            self._path(key).unlink(missing_ok=True)
+        except Exception:
+            pass
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.kvstate"
+
+    @staticmethod
+    def _state_size(state: Any) -> int:
+        size = int(getattr(state, "llama_state_size", 0) or 0)
+        for attr in ("input_ids", "scores"):
+            size += int(getattr(getattr(state, attr, None), "nbytes", 0) or 0)
+        return size
+
+KV_STATE_STORE = KVStateStore()
+
+class PrefixSnapshotCache:
+    """KV snapshots of the fixed prompt prefixes shared by many requests.
+
+    Covers the Verdant system prompt and each preset from presets.json, in both
+    the chat transcript and single-prompt formats. Each (model, prefix) pair is
+    evaluated once and persisted, so later requests restore the snapshot and
+    prefill only the user text. Snapshots for presets that changed or
+    disappeared are deleted when presets.json changes.
+    """
+
+    def __init__(self, store: Optional[KVStateStore] = None, presets_file: Path = PRESETS_FILE):
+        self.store = store or KVStateStore(PREFIX_STATE_DIR, max_ram_mb=512, max_disk_mb=2048, write_through=True)
+        self.presets_file = Path(presets_file)
+        self._presets_sig: Optional[tuple] = None
+        self._prefixes: List[str] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def prefixes(self) -> List[str]:
+        """Known prefix texts, longest first."""
+        with self._lock:
+            sig = self._presets_signature()
+            if sig != self._presets_sig:
+                self._prefixes = self._build_prefixes(PresetsManager.load_presets(self.presets_file))
+                if self._presets_sig is not None:
+                    self._purge_stale()
+                self._presets_sig = sig
+            return list(self._prefixes)
+
+    def match(self, formatted_prompt: str) -> Optional[str]:
+        for prefix in self.prefixes():
+            if formatted_prompt.startswith(prefix):
+                return prefix
+        return None
+
+    @staticmethod
+    def prefix_name(prefix: str) -> str:
+        return "prefix" + hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _build_prefixes(presets: Dict[str, str]) -> List[str]:
+        # Boundaries end on "<</SYS>>" or a blank line so they tokenize the same alone and in context
+        chat_head = f"<s>[INST] <<SYS>>{SYSTEM_PROMPT}<</SYS>>"
+        prefixes = [chat_head]
+        for text in presets.values():
+            prefixes.append(f"{chat_head} {text}\n\n")
+            prefixes.append(f"<s>[INST] {text}\n\n")
+        return sorted(set(prefixes), key=len, reverse=True)
+
+    def _presets_signature(self) -> tuple:
+        try:
+            st = self.presets_file.stat()
+            return (st.st_size, st.st_mtime_ns)
+        except Exception:
+            return (0, 0)
+
+    def _purge_stale(self) -> None:
+        valid = {self.prefix_name(p) for p in self._prefixes}
+        if not self.store.directory.exists():
+            return
+        for path in self.store.directory.glob("prefix*.kvstate"):
+            name = path.name.split("-", 1)[0]
+            if name not in valid:
+                self.store.discard(path.name[:-len(".kvstate")])
+
+PREFIX_SNAPSHOTS = PrefixSnapshotCache()
+
+class ResponseCache:
+    """Disk-backed exact-match cache of generated replies.
+
+    Entries live in a small SQLite file keyed by a hash of the model
+    fingerprint, the formatted prompt and every sampling parameter, so a reply
+    is only replayed for an identical request to an identical model file. The
+    least recently used entries are evicted once the stored text exceeds
+    max_mb. Hit/miss counters are per process and feed the eco meter.
+    """
+
+    def __init__(self, path: Path = RESPONSE_CACHE_FILE, max_mb: int = 32):
+        self.path = Path(path)
+        self.max_bytes = max_mb * 1024 * 1024
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def make_key(model_id: str, formatted_prompt: str, **params: Any) -> str:
+        payload = json.dumps({"model": model_id, "prompt": formatted_prompt, "params": params},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT text, tokens FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                conn.commit()
+                self.hits += 1
+                self.tokens_saved += int(row[1] or 0)
+                return row[0]
+            except Exception as e:
+                print(f"⚠️  Response cache unavailable: {e}")
+                self.misses += 1
+                return None
+
+    def put(self, key: str, text: str, tokens: int = 0) -> None:
+        if not text or text.startswith("❌"):
+            return
+        with self._lock:
+            try:
+                conn = self._connect()
+                now = time.time()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, text, tokens, size, created, last_used, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (key, text, int(tokens), len(text.encode("utf-8")), now, now),
+                )
+                self._evict(conn)
+                conn.commit()
+            except Exception as e:
+                print(f"⚠️  Could not store cached response: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute("DELETE FROM responses")
+                conn.commit()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = 0, 0
+            try:
+                entries, size = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except Exception:
+                pass
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "size_mb": size / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "tokens_saved": self.tokens_saved,
+            }
+
+    @staticmethod
+    def replay(text: str, chars_per_s: float = 0):
+        """Yield cached text in word-sized chunks, paced like a live stream (0 = all at once)."""
+        if chars_per_s <= 0:
+            yield text
+            return
+        for piece in re.findall(r"\S*\s*", text):
+            if piece:
+                time.sleep(len(piece) / chars_per_s)
+                yield piece
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL, "
+                "tokens INTEGER, size INTEGER, created REAL, last_used REAL, hits INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+RESPONSE_CACHE = ResponseCache()
+
+class LocalEmbedder:
+    """Sentence embeddings from a small GGUF model (nomic-embed-text by default).
+
+    Vectors are truncated to the first `dims` components (nomic v1.5 is trained
+    Matryoshka-style, so the prefix stays meaningful) and L2-normalized, which
+    keeps the semantic index at a few hundred bytes per entry.
+    """
+
+    def __init__(self, model_path: Path, dims: int = 256, n_threads: Optional[int] = None,
+                 query_prefix: str = "search_query: "):
+        self.model_path = Path(model_path)
+        self.dims = dims
+        self.n_threads = n_threads
+        self.query_prefix = query_prefix
+        self._llm = None
+        self._lock = threading.Lock()
+
+    def embed(self, text: str):
+        import numpy as np
+        with self._lock:
+            if self._llm is None:
+                from llama_cpp import Llama
+                self._llm = Llama(model_path=str(self.model_path), embedding=True, n_ctx=512,
+                                  n_threads=self.n_threads or HardwareDetector.profile()["physical_cores"], verbose=False)
+            vec = self._llm.embed(self.query_prefix + text)
+        vec = np.asarray(vec, dtype=np.float32)
+        if vec.ndim > 1:  # per-token embeddings when the model has no pooling: mean-pool
+            vec = vec.mean(axis=0)
+        vec = vec[:self.dims]
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+
+class SemanticCache:
+    """Near-duplicate response cache over prompt embeddings.
+
+    Each stored reply keeps the float16 embedding of its prompt; lookups take
+    the cosine similarity against every entry in the same scope (model and
+    sampling settings) and serve the best one above `threshold`. The index is
+    capped at max_entries, evicting the least recently used, so it stays a few
+    MB even on 8 GB laptops. Replies the user rejects (e.g. by regenerating)
+    are reported with report_false_hit and removed.
+    """
+
+    def __init__(self, embedder: Any, path: Path = SEMANTIC_CACHE_FILE, threshold: float = 0.92,
+                 max_entries: int = 2000):
+        self.embedder = embedder
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._ids: List[int] = []
+        self._scopes: List[str] = []
+        self._vectors = None  # float16 matrix, one row per entry
+        self._recent: "OrderedDict[str, Any]" = OrderedDict()  # prompt -> embedding, for lookup-then-put
+        self.hits = 0
+        self.misses = 0
+        self.false_hits = 0
+        self.lookup_seconds = 0.0
+
+    def lookup(self, prompt: str, scope: str) -> Optional[Dict[str, Any]]:
+        """Best stored reply for a similar prompt: {"id", "text", "similarity"} or None."""
+        import numpy as np
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                self._load_index()
+                query = self._embed(prompt)
+                best_id, best_sim = None, -1.0
+                if self._ids:
+                    rows = [i for i, sc in enumerate(self._scopes) if sc == scope]
+                    if rows:
+                        sims = self._vectors[rows].astype(np.float32) @ query
+                        j = int(np.argmax(sims))
+                        best_id, best_sim = self._ids[rows[j]], float(sims[j])
+                if best_id is None or best_sim < self.threshold:
+                    self.misses += 1
+                    return None
+                conn = self._connect()
+                row = conn.execute("SELECT text FROM semantic WHERE id = ?", (best_id,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE semantic SET last_used = ? WHERE id = ?", (time.time(), best_id))
+                conn.commit()
+                self.hits += 1
+                return {"id": best_id, "text": row[0], "similarity": best_sim}
+        except Exception as e:
+            print(f"⚠️  Semantic cache lookup failed: {e}")
+            self.misses += 1
+            return None
+        finally:
+            self.lookup_seconds += time.perf_counter() - start
+
+    def put(self, prompt: str, scope: str, text: str) -> None:
+        if not text or text.startswith("❌"):
+            return
+        import numpy as np
+        try:
+            with self._lock:
+                self._load_index()
+                vec = np.asarray(self._embed(prompt), dtype=np.float16)
+                conn = self._connect()
+                cur = conn.execute(
+                    "INSERT INTO semantic (scope, prompt, text, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (scope, prompt, text, vec.tobytes(), time.time()),
+                )
+                conn.commit()
+                self._ids.append(int(cur.lastrowid))
+                self._scopes.append(scope)
+                row = vec.reshape(1, -1)
+                self._vectors = row if self._vectors is None or not len(self._vectors) else np.vstack([self._vectors, row])
+                if len(self._ids) > self.max_entries:
+                    self._evict(len(self._ids) - self.max_entries)
+        except Exception as e:
+            print(f"⚠️  Could not store semantic cache entry: {e}")
+
+    def report_false_hit(self, entry_id: int) -> None:
+        """The user rejected a semantically matched reply; stop serving it."""
+        with self._lock:
+            self.false_hits += 1
+            try:
+                self._remove([entry_id])
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._ids),
+                "index_kb": (self._vectors.nbytes / 1024) if self._vectors is not None else 0.0,
+                "lookups": lookups,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "false_hits": self.false_hits,
+                "avg_lookup_ms": (self.lookup_seconds / lookups * 1000) if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _embed(self, prompt: str):
+        vec = self._recent.get(prompt)
+        if vec is None:
+            vec = self.embedder.embed(prompt)
+            self._recent[prompt] = vec
+            while len(self._recent) > 32:
+                self._recent.popitem(last=False)
+        else:
+            self._recent.move_to_end(prompt)
+        return vec
+
+    def _evict(self, count: int) -> None:
+        rows = self._connect().execute(
+            "SELECT id FROM semantic ORDER BY last_used ASC LIMIT ?", (count,)).fetchall()
+        self._remove([r[0] for r in rows])
+
+    def _remove(self, entry_ids: List[int]) -> None:
+        import numpy as np
+        conn = self._connect()
+        conn.executemany("DELETE FROM semantic WHERE id = ?", [(i,) for i in entry_ids])
+        conn.commit()
+        drop = set(entry_ids)
+        keep = [i for i, eid in enumerate(self._ids) if eid not in drop]
+        self._ids = [self._ids[i] for i in keep]
+        self._scopes = [self._scopes[i] for i in keep]
+        if self._vectors is not None:
+            self._vectors = self._vectors[np.asarray(keep, dtype=np.intp)]
+
+    def _load_index(self) -> None:
+        if self._vectors is not None:
+            return
+        import numpy as np
+        rows = self._connect().execute("SELECT id, scope, vector FROM semantic ORDER BY id").fetchall()
+        self._ids = [r[0] for r in rows]
+        self._scopes = [r[1] for r in rows]
+        vectors = [np.frombuffer(r[2], dtype=np.float16) for r in rows]
+        self._vectors = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float16)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS semantic (id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, "
+                "prompt TEXT, text TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+_SEMANTIC_CACHE: Optional[SemanticCache] = None
+
+def get_semantic_cache(threshold: Optional[float] = None) -> Optional[SemanticCache]:
+    """Process-wide semantic cache, or None until an embedding model is downloaded."""
+    global _SEMANTIC_CACHE
+    if _SEMANTIC_CACHE is None:
+        key = next((k for k, m in MODELS.items() if m.embedding), None)
+        path = ModelDownloader().get_model_path(key) if key else None
+        if not path:
+            return None
+        _SEMANTIC_CACHE = SemanticCache(LocalEmbedder(path))
+    if threshold is not None:
+        _SEMANTIC_CACHE.threshold = threshold
+    return _SEMANTIC_CACHE
+
+def cache_meter_stats() -> Dict[str, int]:
+    """Replies served from the response caches vs generated, for the eco meters."""
+    exact = RESPONSE_CACHE.stats()
+    semantic = _SEMANTIC_CACHE.stats() if _SEMANTIC_CACHE else {"hits": 0, "false_hits": 0}
+    return {
+        "cached": exact["hits"] + semantic["hits"],
+        # A semantic hit follows an exact-match miss, so it is not a generation
+        "generated": max(0, exact["misses"] - semantic["hits"]),
+        "semantic_hits": semantic["hits"],
+        "false_hits": semantic["false_hits"],
+    }
+
+class SpeculativeDraft:
+    """Draft-token proposer for llama-cpp-python's speculative decoding hook.
+
+    Llama(draft_model=...) calls this with the tokens so far; a small GGUF model
+    sharing the main model's vocabulary greedily proposes the next few tokens,
+    which the main model then verifies in a single batch. Acceptance is tracked
+    from what the main model actually kept; when it stays below min_acceptance
+    the draft stops proposing and decoding falls back to the main model alone.
+    """
+
+    def __init__(self, draft_path: Path, n_ctx: int, n_threads: int, num_pred_tokens: int = 4,
+                 min_acceptance: float = 0.4, warmup_tokens: int = 64):
+        self.draft_path = Path(draft_path)
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.num_pred_tokens = num_pred_tokens
+        self.min_acceptance = min_acceptance
+        self.warmup_tokens = warmup_tokens
+        self.proposed = 0
+        self.accepted = 0
+        self.enabled = True
+        self.disabled_reason = ""
+        self._llm = None
+        self._last_len = 0
+        self._last_proposal: List[int] = []
+
+    def check_vocab(self, target: Any) -> None:
+        """Disable drafting if the draft model cannot share the target's tokens."""
+        try:
+            draft = self._load()
+            if draft.n_vocab() != target.n_vocab() or draft.token_eos() != target.token_eos():
+                self._disable("draft and main model vocabularies differ")
+        except Exception as e:
+            self._disable(f"draft model unavailable ({e})")
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+        tokens = [int(t) for t in input_ids]
+        self._score_last_proposal(tokens)
+        if not self.enabled:
+            return np.array([], dtype=np.intc)
+        draft = []
+        try:
+            for tok in self._load().generate(tokens, temp=0.0, top_k=1, reset=True):
+                draft.append(int(tok))
+                if len(draft) >= self.num_pred_tokens:
+                    break
+        except Exception as e:
+            self._disable(f"draft generation failed ({e})")
+            draft = []
+        self._last_len = len(tokens)
+        self._last_proposal = draft
+        return np.array(draft, dtype=np.intc)
+
+    def reset_stats(self) -> None:
+        self.proposed = 0
+        self.accepted = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "acceptance_rate": (self.accepted / self.proposed) if self.proposed else 0.0,
+            "disabled_reason": self.disabled_reason,
+        }
+
+    def _score_last_proposal(self, tokens: List[int]) -> None:
+        if not self._last_proposal or len(tokens) <= self._last_len:
+            self._last_proposal = []
+            return
+        kept = 0
+        for proposed, actual in zip(self._last_proposal, tokens[self._last_len:]):
+            if proposed != actual:
+                break
+            kept += 1
+        self.proposed += len(self._last_proposal)
+        self.accepted += kept
+        self._last_proposal = []
+        if self.enabled and self.proposed >= self.warmup_tokens and self.accepted / self.proposed < self.min_acceptance:
+            self._disable(f"acceptance {self.accepted / self.proposed:.0%} below {self.min_acceptance:.0%}")
+
+    def _disable(self, reason: str) -> None:
+        if self.enabled:
+            print(f"ℹ️  Speculative decoding off: {reason}")
+        self.enabled = False
+        self.disabled_reason = reason
+
+    def _load(self):
+        if self._llm is None:
+            from llama_cpp import Llama
+            self._llm = Llama(model_path=str(self.draft_path), n_ctx=self.n_ctx,
+                              n_threads=self.n_threads, verbose=False)
+        return self._llm
+
+def find_draft_model(model_path: Path) -> Optional[Path]:
+    """Downloaded draft model registered for the model stored at model_path, if any."""
+    target_keys = [k for k, m in MODELS.items() if m.filename == Path(model_path).name]
+    for cfg in MODELS.values():
+        if cfg.draft_for and cfg.draft_for in target_keys:
+            candidate = Path(model_path).parent / cfg.filename
+            if candidate.exists():
+                return candidate
+    return None
+
+class CancellationToken:
+    """Thread-safe stop flag for an in-flight generation.
+
+    AIInference passes it to llama as a stopping criterion, which is checked
+    after every sampled token, so cancel() ends generation within one decode
+    step and releases the model (and the CPU) without waiting for the next
+    chunk to reach the UI. Prompt prefill is a single llama call and finishes
+    before the check runs.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.cancelled_at: Optional[float] = None
+
+    def cancel(self) -> None:
+        if not self._event.is_set():
+            self.cancelled_at = time.perf_counter()
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def reset(self) -> None:
+        self._event.clear()
+        self.cancelled_at = None
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds; returns True early if cancelled."""
+        return self._event.wait(timeout)
+
+    def __call__(self, input_ids=None, logits=None) -> bool:
+        # llama-cpp-python stopping_criteria signature
+        return self._event.is_set()
+
+@contextlib.contextmanager
+def cancel_on_sigint(token: CancellationToken):
+    """Turn the first Ctrl+C into token.cancel(); a second one interrupts as usual."""
+    if threading.current_thread() is not threading.main_thread():
+        yield token
+        return
+
+    def handler(signum, frame):
+        if token.cancelled:
+            raise KeyboardInterrupt
+        token.cancel()
+
+    previous = signal.signal(signal.SIGINT, handler)
+    try:
+        yield token
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+class _BatchDecodeError(RuntimeError):
+    """llama_decode failed during generate_batch; carries the progress made so far."""
+
+    def __init__(self, message: str, texts: List[str], done: List[bool], emitted: List[int]):
+        super().__init__(message)
+        self.texts = [t.strip() for t in texts]
+        self.done = list(done)
+        self.emitted = list(emitted)
+
+class AIInference:
+    """Handle AI model inference using llama-cpp-python."""
+    
+    def __init__(self, model_path: Path, n_ctx: Optional[int] = None, n_threads: Optional[int] = None,
+                 temperature: float = 0.7, top_p: float = 0.9, n_gpu_layers_override: Optional[int] = None,
+                 speculative: bool = False, seed: Optional[int] = None, use_cache: bool = True,
+                 cache_replay_rate: float = 400.0, response_cache: Optional[ResponseCache] = None,
+                 semantic_cache: Optional[SemanticCache] = None, use_mmap: Optional[bool] = None,
+                 use_mlock: Optional[bool] = None, numa_node: Optional[int] = None):
+        self.model_path = model_path
+        self.llm = None
+        self.speculative = speculative
+        self.draft: Optional[SpeculativeDraft] = None
+        self.pool_key: Optional[tuple] = None
+        self._llm_lock = threading.RLock()
+        self.metrics: Dict[str, Any] = {}
+        self.tokenizer: Optional[TokenizerService] = None
+        self.n_ctx: Optional[int] = None
+        # Exact token usage of the most recent request
+        self.last_usage: Dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0}
+        self.last_prefix_hit = 0
+        self.n_ctx_override = n_ctx
+        self.n_threads_override = n_threads
+        self.temperature = temperature
+        self.top_p = top_p
+        self.n_gpu_layers_override = n_gpu_layers_override
+        # None = chosen from available RAM (see choose_memory_policy)
+        self.use_mmap = use_mmap
+        self.use_mlock = use_mlock
+        # Pin this process (threads and memory) to one NUMA node before loading
+        self.numa_node = numa_node
+        self.seed = seed
+        # Exact-match response cache; cache_replay_rate paces replays in chars/s (0 = instant)
+        self.use_cache = use_cache
+        self.cache_replay_rate = cache_replay_rate
+        self.response_cache = response_cache or RESPONSE_CACHE
+        # Optional near-duplicate layer consulted after an exact-match miss
+        self.semantic_cache = semantic_cache
+        self.last_semantic_hit: Optional[Dict[str, Any]] = None
+        self._load_model()
+    
+    def _load_model(self):
+        """Load the model with hardware-optimized settings."""
+        try:
+            # For frozen Windows builds, ensure packaged llama_cpp DLLs are on the path
+            if getattr(sys, "frozen", False) and platform.system() == "Windows":
+                try:
+                    meipass = Path(getattr(sys, "_MEIPASS", ""))
+                    dll_dir = meipass / "llama_cpp" / "lib"
+                    if dll_dir.exists():
+                        if hasattr(os, "add_dll_directory"):
+                            os.add_dll_directory(str(dll_dir))
+                        os.environ["PATH"] = f"{dll_dir};" + os.environ.get("PATH", "")
+                except Exception:
+                    pass
+            
+            from llama_cpp import Llama
+            
+            # Defaults from the cached hardware profile, unless overridden
+            recommended = HardwareDetector.recommended_settings(self.model_path)
+            performance_tier = HardwareDetector.get_performance_tier()
+            n_ctx = self.n_ctx_override or recommended["n_ctx"]
+            n_threads = self.n_threads_override or recommended["n_threads"]
+            numa_cpus = None
+            if self.numa_node is not None:
+                numa_cpus = _numa_cpus(self.numa_node)
+                if numa_cpus is None:
+                    print(f"ℹ️  NUMA node {self.numa_node} not available; running unpinned")
+                else:
+                    profile = HardwareDetector.profile()
+                    per_core = max(1, profile["logical_cores"] // profile["physical_cores"])
+                    n_threads = self.n_threads_override or max(1, len(numa_cpus) // per_core)
+            # Results of `--autotune` for this CPU and model file, unless threads were set explicitly
+            n_threads_batch, n_batch = None, 512
+            tuned = UserPreferences.tuned_settings(self.model_path)
+            if tuned and not self.n_threads_override:
+                n_threads = int(tuned.get("n_threads") or n_threads)
+                n_threads_batch = tuned.get("n_threads_batch")
+                n_batch = int(tuned.get("n_batch") or n_batch)
+            if numa_cpus:
+                # Tuned for the whole machine; never run more threads than the node has CPUs
+                n_threads = min(n_threads, len(numa_cpus))
+                n_threads_batch = min(int(n_threads_batch or n_threads), len(numa_cpus))
+            # Enforce capability caps (e.g., demo vs premium)
+            try:
+                caps = get_capabilities()
+                if isinstance(caps, dict) and "max_context" in caps and isinstance(caps["max_context"], int):
+                    n_ctx = min(n_ctx, int(caps["max_context"]))
+            except Exception:
+                pass
+            # GPU layers (optional, depends on installed wheel build)
+            n_gpu_layers = 0
+            try:
+                if self.n_gpu_layers_override is not None:
+                    n_gpu_layers = max(0, int(self.n_gpu_layers_override))
+            except Exception:
+                n_gpu_layers = 0
+            
+            # Speculative decoding with a registered draft model, if one is downloaded
+            draft_path = find_draft_model(self.model_path) if self.speculative else None
+            if self.speculative and not draft_path:
+                print("ℹ️  No draft model found; speculative decoding disabled (run --setup --model tinymistral-248m-q8)")
+            options = {"draft": str(draft_path)} if draft_path else {}
+            memory = choose_memory_policy(self.model_path, self.use_mmap, self.use_mlock)
+            if not memory["use_mmap"]:
+                options["mmap"] = False
+            if memory["use_mlock"]:
+                options["mlock"] = True
+            if n_batch != 512:
+                options["n_batch"] = n_batch
+            if n_threads_batch and n_threads_batch != n_threads:
+                options["n_threads_batch"] = int(n_threads_batch)
+            if numa_cpus:
+                options["numa_node"] = self.numa_node
+            key = ModelPool.make_key(self.model_path, n_ctx, n_threads, n_gpu_layers, **options)
+
+            def loader():
+                print(f"🔧 Loading model with {n_threads} threads, context {n_ctx}")
+                if tuned and not self.n_threads_override:
+                    print(f"🎛️  Using autotuned settings: {n_threads} threads "
+                          f"({n_threads_batch or n_threads} for prompts), batch {n_batch}")
+                draft = None
+                if draft_path:
+                    # Drafting costs relatively more on weak CPUs, so demand a higher hit rate there
+                    min_acceptance = 0.55 if performance_tier == "low" else 0.4
+                    draft = SpeculativeDraft(draft_path, n_ctx=n_ctx, n_threads=n_threads,
+                                             min_acceptance=min_acceptance)
+                    print(f"🪶 Speculative decoding with draft model {draft_path.name}")
+                start = time.perf_counter()
+                with numa_thread_affinity(self.numa_node if numa_cpus else None):
+                    llm = Llama(
+                        model_path=str(self.model_path),
+                        n_ctx=n_ctx,
+                        n_threads=n_threads,
+                        n_gpu_layers=n_gpu_layers,
+                        n_batch=n_batch,
+                        n_threads_batch=int(n_threads_batch or n_threads),
+                        draft_model=draft,
+                        use_mmap=memory["use_mmap"],
+                        use_mlock=memory["use_mlock"],
+                        verbose=False
+                    )
+                if draft:
+                    draft.check_vocab(llm)
+                entry = LOAD_TIMES.record(self.model_path, time.perf_counter() - start, **memory)
+                cold = LOAD_TIMES.summary(self.model_path)["cold_s"]
+                detail = f"{'warm' if entry['warm'] else 'cold'} load {entry['seconds']:.1f}s"
+                if entry["warm"] and cold:
+                    detail += f", cold loads take {cold:.1f}s"
+                print(f"✅ Model loaded successfully! ({detail}{', mlock' if memory['use_mlock'] else ''})")
+                return llm
+
+            hits_before = MODEL_POOL.hits
+            self.llm = MODEL_POOL.acquire(key, loader)
+            self._llm_lock = MODEL_POOL.lock_for(self.llm)
+            if numa_cpus:
+                self._llm_lock = _NumaLock(self._llm_lock, self.numa_node)
+            self.metrics = MODEL_POOL.metrics_for(self.llm)
+            self.tokenizer = MODEL_POOL.tokenizer_for(self.llm)
+            self.n_ctx = n_ctx
+            self.pool_key = key
+            self.draft = getattr(self.llm, "draft_model", None) if draft_path else None
+            if MODEL_POOL.hits > hits_before:
+                stats = MODEL_POOL.stats()
+                print(f"♻️  Reusing loaded model (pool hits {stats['hits']}, misses {stats['misses']})")
+            
         except ImportError:
             print("❌ llama-cpp-python not installed. Run: pip install llama-cpp-python")
             raise
@@ -364,8 +2775,15 @@ class AIInference:
             print(f"❌ Failed to load model: {e}")
             raise
     
-    def generate_response(self, prompt: str, max_tokens: int = 512) -> str:
-        """Generate a response using the loaded model."""
+    def generate_response(self, prompt: str, max_tokens: int = 512, semantic_prompt: Optional[str] = None,
+                          cancel: Optional[CancellationToken] = None) -> str:
+        """Generate a response using the loaded model.
+
+        semantic_prompt is the part of the prompt the user typed (without any
+        preset), used as the semantic cache query; it defaults to the prompt.
+        Cancelling `cancel` stops generation after the current token and
+        returns the text produced so far.
+        """
         if not self.llm:
             return "❌ Model not loaded"
         
@@ -373,28 +2791,44 @@ class AIInference:
             # Format prompt for Mistral Instruct
             formatted_prompt = f"<s>[INST] {prompt} [/INST]"
             
+            semantic_prompt = semantic_prompt or prompt
+            cached = self._cached_reply(formatted_prompt, semantic_prompt, max_tokens)
+            if cached is not None:
+                print("♻️  Served from response cache")
+                return cached.strip()
+            
             start_time = time.time()
             
-            response = self.llm(
-                formatted_prompt,
-                max_tokens=max_tokens,
-                temperature=self.temperature,
-                top_p=self.top_p,
-                stop=["</s>", "[INST]"],
-                echo=False
-            )
+            with self._llm_lock:
+                response = self.llm(
+                    self._prepare_prompt(formatted_prompt),
+                    max_tokens=max_tokens,
+                    temperature=self.temperature,
+                    top_p=self.top_p,
+                    stop=["</s>", "[INST]"],
+                    echo=False,
+                    **self._sampling_kwargs(cancel)
+                )
             
             generation_time = time.time() - start_time
             
             # Extract the generated text
             if response and 'choices' in response and len(response['choices']) > 0:
                 generated_text = response['choices'][0]['text'].strip()
+                if self._record_cancel(cancel):
+                    return generated_text
+                completion = response.get('usage', {}).get('completion_tokens', 0)
+                self.last_usage["completion_tokens"] = completion or self.count_tokens(response['choices'][0]['text'])
+                self._store_reply(formatted_prompt, semantic_prompt, max_tokens, response['choices'][0]['text'], completion)
                 
                 # Calculate tokens per second
                 if 'usage' in response and 'total_tokens' in response['usage']:
                     tokens = response['usage']['total_tokens']
                     tokens_per_sec = tokens / generation_time if generation_time > 0 else 0
                     print(f"⚡ Generated {tokens} tokens in {generation_time:.2f}s ({tokens_per_sec:.1f} tok/s)")
+                    if self.draft:
+                        completion = response['usage'].get('completion_tokens', 0)
+                        self._report_speculative(completion, generation_time)
                 
                 return generated_text
             else:
@@ -403,57 +2837,903 @@ class AIInference:
         except Exception as e:
             return f"❌ Generation error: {e}"
 
-    def generate_response_stream(self, prompt: str, max_tokens: int = 512):
+    def _sampling_kwargs(self, cancel: Optional[CancellationToken] = None) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {}
+        if self.seed is not None:
+            kwargs["seed"] = self.seed
+        if cancel is not None:
+            kwargs["stopping_criteria"] = cancel
+        return kwargs
+
+    def _record_cancel(self, cancel: Optional[CancellationToken]) -> bool:
+        """True if the generation was cancelled; records how long stopping took."""
+        if cancel is None or not cancel.cancelled:
+            return False
+        if cancel.cancelled_at is not None:
+            self.metrics["stop_latency_s"] = time.perf_counter() - cancel.cancelled_at
+        return True
+
+    def _cache_key(self, formatted_prompt: str, max_tokens: int) -> Optional[str]:
+        """Response cache key for this request, or None when caching is bypassed."""
+        if not self.use_cache:
+            return None
+        try:
+            model_id = model_fingerprint(self.model_path)
+        except Exception:
+            return None
+        return ResponseCache.make_key(model_id, formatted_prompt, max_tokens=max_tokens,
+                                      temperature=self.temperature, top_p=self.top_p, seed=self.seed)
+
+    def _cached_reply(self, formatted_prompt: str, prompt: Optional[str], max_tokens: int) -> Optional[str]:
+        """Exact-match hit, else a semantic near-duplicate hit for the raw prompt."""
+        self.last_semantic_hit = None
+        self.last_usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        cache_key = self._cache_key(formatted_prompt, max_tokens)
+        if not cache_key:
+            return None
+        cached = self.response_cache.get(cache_key)
+        if cached is None and self.semantic_cache and prompt:
+            hit = self.semantic_cache.lookup(prompt, self._semantic_scope(formatted_prompt, prompt, max_tokens))
+            if hit is not None:
+                self.last_semantic_hit = hit
+                print(f"🔎 Semantic cache hit (similarity {hit['similarity']:.2f})")
+                cached = hit["text"]
+        if cached is not None:
+            self.last_usage["completion_tokens"] = self.count_tokens(cached)
+        return cached
+
+    def _store_reply(self, formatted_prompt: str, prompt: Optional[str], max_tokens: int,
+                     text: str, tokens: int) -> None:
+        cache_key = self._cache_key(formatted_prompt, max_tokens)
+        if not cache_key:
+            return
+        self.response_cache.put(cache_key, text, tokens)
+        if self.semantic_cache and prompt:
+            self.semantic_cache.put(prompt, self._semantic_scope(formatted_prompt, prompt, max_tokens), text)
+
+    def _semantic_scope(self, formatted_prompt: str, prompt: str, max_tokens: int) -> Optional[str]:
+        # Same model, settings and prompt template (system prompt, preset wrapper), any user text
+        return self._cache_key(formatted_prompt.replace(prompt, "{prompt}"), max_tokens)
+
+    def speculative_stats(self) -> Dict[str, Any]:
+        """Draft acceptance counters and effective decode speed for speculative mode."""
+        stats = self.draft.stats() if self.draft else {"enabled": False}
+        stats["effective_tok_s"] = self.metrics.get("speculative_tok_s", 0.0)
+        return stats
+
+    def _report_speculative(self, completion_tokens: int, elapsed: float) -> None:
+        tok_s = completion_tokens / elapsed if elapsed > 0 else 0.0
+        self.metrics["speculative_tok_s"] = tok_s
+        st = self.draft.stats()
+        state = "on" if st["enabled"] else f"off ({st['disabled_reason']})"
+        print(f"🪶 Speculative {state}: acceptance {st['acceptance_rate']:.0%} "
+              f"({st['accepted']}/{st['proposed']}), effective {tok_s:.1f} tok/s")
+
+    def generate_response_stream(self, prompt: str, max_tokens: int = 512, semantic_prompt: Optional[str] = None,
+                                 cancel: Optional[CancellationToken] = None):
         """Yield response chunks if streaming is supported; otherwise yield once with full text."""
         if not self.llm:
             yield "❌ Model not loaded"
             return
         
         formatted_prompt = f"<s>[INST] {prompt} [/INST]"
+        semantic_prompt = semantic_prompt or prompt
+        cached = self._cached_reply(formatted_prompt, semantic_prompt, max_tokens)
+        if cached is not None:
+            yield from ResponseCache.replay(cached, self.cache_replay_rate)
+            return
         try:
-            # Attempt streaming
-            resp_iter = self.llm(
-                formatted_prompt,
-                max_tokens=max_tokens,
+            # Attempt streaming; hold the shared instance for the whole stream
+            with self._llm_lock:
+                start, parts = time.time(), []
+                resp_iter = self.llm(
+                    self._prepare_prompt(formatted_prompt),
+                    max_tokens=max_tokens,
+                    temperature=self.temperature,
+                    top_p=self.top_p,
+                    stop=["</s>", "[INST]"],
+                    echo=False,
+                    stream=True,
+                    **self._sampling_kwargs(cancel)
+                )
+                for chunk in resp_iter:
+                    try:
+                        text = chunk.get("choices", [{}])[0].get("text", "")
+                    except Exception:
+                        text = ""
+                    if text:
+                        parts.append(text)
+                        yield text
+                    if cancel is not None and cancel.cancelled:
+                        break
+                text = "".join(parts)
+                self.last_usage["completion_tokens"] = self.count_tokens(text)
+                if self.draft:
+                    self._report_speculative(self.last_usage["completion_tokens"], time.time() - start)
+                if self._record_cancel(cancel):
+                    return
+                self._store_reply(formatted_prompt, semantic_prompt, max_tokens, text, self.last_usage["completion_tokens"])
+        except Exception:
+            # Fallback to non-streaming
+            full = self.generate_response(prompt, max_tokens=max_tokens, semantic_prompt=semantic_prompt, cancel=cancel)
+            if full:
+                yield full
+
+    def generate_chat_stream(self, transcript: str, max_tokens: int = 512, session_id: Optional[str] = None,
+                             semantic_prompt: Optional[str] = None, cancel: Optional[CancellationToken] = None):
+        """Stream a reply to an already formatted multi-turn transcript.
+
+        The transcript's tokens are diffed against those already evaluated in the
+        KV cache of the pooled instance, so only the new suffix (typically the
+        latest user turn) is prefilled. With a session_id, the KV state of that
+        chat is restored from KV_STATE_STORE when the cache holds another
+        conversation, and saved again once the reply is complete. Pass the user
+        message as semantic_prompt on the first turn of a chat to let the
+        semantic cache answer near-duplicate questions.
+        """
+        if not self.llm:
+            yield "❌ Model not loaded"
+            return
+        
+        cached = self._cached_reply(transcript, semantic_prompt, max_tokens)
+        if cached is not None:
+            yield from ResponseCache.replay(cached, self.cache_replay_rate)
+            return
+        try:
+            with self._llm_lock:
+                start, parts = time.time(), []
+                resp_iter = self.llm(
+                    self._prepare_prompt(transcript, session_id=session_id),
+                    max_tokens=max_tokens,
+                    temperature=self.temperature,
+                    top_p=self.top_p,
+                    stop=["</s>", "[INST]"],
+                    echo=False,
+                    stream=True,
+                    **self._sampling_kwargs(cancel)
+                )
+                for chunk in resp_iter:
+                    try:
+                        text = chunk.get("choices", [{}])[0].get("text", "")
+                    except Exception:
+                        text = ""
+                    if text:
+                        parts.append(text)
+                        yield text
+                    if cancel is not None and cancel.cancelled:
+                        break
+                text = "".join(parts)
+                self.last_usage["completion_tokens"] = self.count_tokens(text)
+                if self.draft:
+                    self._report_speculative(self.last_usage["completion_tokens"], time.time() - start)
+                if self._record_cancel(cancel):
+                    return
+                self._store_reply(transcript, semantic_prompt, max_tokens, text, self.last_usage["completion_tokens"])
+                evaluated = self._evaluated_tokens() if session_id else None
+            if evaluated:
+                # Copying the KV state takes a while; do it after the reply, off the caller's thread
+                self._save_session_state_later(session_id, evaluated)
+        except Exception as e:
+            yield f"❌ Generation error: {e}"
+
+    def save_session_state(self, session_id: str, store: Optional[KVStateStore] = None) -> bool:
+        """Snapshot the current KV cache for a chat session."""
+        store = store or KV_STATE_STORE
+        try:
+            with self._llm_lock:
+                state = self.llm.save_state()
+            store.put(KVStateStore.make_key(session_id, self.state_model_id()), state)
+            return True
+        except Exception as e:
+            print(f"⚠️  Could not save KV state: {e}")
+            return False
+
+    def _evaluated_tokens(self) -> Optional[List[int]]:
+        """Token ids currently in the KV cache (call with _llm_lock held)."""
+        try:
+            return [int(t) for t in self.llm.input_ids[: self.llm.n_tokens]]
+        except Exception:
+            return None
+
+    def _save_session_state_later(self, session_id: str, evaluated: List[int],
+                                  store: Optional[KVStateStore] = None) -> threading.Thread:
+        """Snapshot the KV cache in a background thread, unless another request has changed it by then."""
+        store = store or KV_STATE_STORE
+
+        def run() -> None:
+            try:
+                with self._llm_lock:
+                    if self.llm is None or self._evaluated_tokens() != evaluated:
+                        return
+                    state = self.llm.save_state()
+                store.put(KVStateStore.make_key(session_id, self.state_model_id()), state)
+            except Exception as e:
+                print(f"⚠️  Could not save KV state: {e}")
+
+        thread = threading.Thread(target=run, daemon=True, name="verdant-kv-save")
+        thread.start()
+        return thread
+
+    def restore_session_state(self, session_id: str, store: Optional[KVStateStore] = None) -> bool:
+        """Load a chat session's KV cache so its history needs no prefill."""
+        with self._llm_lock:
+            return self._restore_session_state(session_id, None, store) > 0
+
+    def state_model_id(self) -> str:
+        """Identity of the loaded model and context size that KV states depend on."""
+        n_ctx = self.pool_key[1] if self.pool_key else 0
+        return f"{model_fingerprint(self.model_path)[:16]}-{n_ctx}"
+
+    def _restore_session_state(self, session_id: str, tokens: Optional[List[int]],
+                               store: Optional[KVStateStore] = None) -> int:
+        """Restore a stored state if it covers more of tokens than the live cache; returns its hit length."""
+        store = store or KV_STATE_STORE
+        try:
+            model_id = self.state_model_id()
+            store.discard_session(session_id, keep_model_id=model_id)
+            state = store.get(KVStateStore.make_key(session_id, model_id))
+            if state is None:
+                return 0
+            stored = [int(t) for t in state.input_ids[: state.n_tokens]]
+            if tokens is None:
+                hit = len(stored)
+            else:
+                hit = 0
+                for a, b in zip(stored, tokens[:-1]):
+                    if a != b:
+                        break
+                    hit += 1
+                if hit <= self._cached_prefix_len(tokens):
+                    return 0
+            self.llm.load_state(state)
+            return hit
+        except Exception as e:
+            print(f"⚠️  Could not restore KV state: {e}")
+            return 0
+
+    def generate_batch(self, prompts: List[str], max_tokens: int = 256,
+                       callbacks: Optional[List[Optional[Callable[[str], None]]]] = None,
+                       cancel: Optional[CancellationToken] = None) -> List[str]:
+        """Generate replies for several prompts as parallel sequences in one llama context.
+
+        Prompt tokens of all sequences are packed into shared prefill batches, then
+        each decode step advances every unfinished sequence by one token; sequences
+        finish independently on EOS, a stop string or max_tokens. callbacks[i], if
+        given, receives sequence i's text chunks as they are generated. Without
+        the allow_batch capability (or on llama-cpp-python builds lacking the
+        low-level batch API) prompts run one after another. Cancelling `cancel`
+        stops every sequence after the current decode step.
+
+        If llama_decode fails part-way, sequences that already finished keep their
+        text and the rest are finished one by one, continuing from the text their
+        callbacks were already sent, so the stream and the result stay consistent.
+        """
+        if not self.llm:
+            return ["❌ Model not loaded" for _ in prompts]
+        callbacks = list(callbacks or [])
+        callbacks += [None] * (len(prompts) - len(callbacks))
+        results: List[Optional[str]] = [None] * len(prompts)
+        streamed = [""] * len(prompts)
+        if len(prompts) > 1 and get_capabilities().get("allow_batch"):
+            try:
+                with self._llm_lock:
+                    return self._generate_batch_parallel(prompts, max_tokens, callbacks, cancel)
+            except (AttributeError, ImportError, NotImplementedError) as e:
+                print(f"ℹ️  Parallel decoding unavailable ({e}); running prompts sequentially")
+            except _BatchDecodeError as e:
+                print(f"⚠️  Parallel decoding failed ({e}); finishing the remaining prompts sequentially")
+                results = [text if finished else None for text, finished in zip(e.texts, e.done)]
+                streamed = [text[:n] for text, n in zip(e.texts, e.emitted)]
+        for i, (prompt, cb) in enumerate(zip(prompts, callbacks)):
+            if results[i] is not None:
+                continue
+            if cancel is not None and cancel.cancelled:
+                results[i] = streamed[i].strip()
+            elif streamed[i]:
+                results[i] = self._continue_reply(prompt, streamed[i], max_tokens, cb, cancel).strip()
+            else:
+                parts = []
+                with contextlib.closing(self.generate_response_stream(prompt, max_tokens=max_tokens,
+                                                                      cancel=cancel)) as stream:
+                    for chunk in stream:
+                        parts.append(chunk)
+                        if cb:
+                            cb(chunk)
+                results[i] = "".join(parts).strip()
+        return results
+
+    def _continue_reply(self, prompt: str, prefix: str, max_tokens: int, callback: Optional[Callable[[str], None]],
+                        cancel: Optional[CancellationToken] = None) -> str:
+        """Finish a reply whose first characters (prefix) were already streamed; returns the whole text."""
+        parts = [prefix]
+        budget = max_tokens - self.count_tokens(prefix)
+        if budget <= 0:
+            return prefix
+        with self._llm_lock:
+            for chunk in self.llm(
+                self._tokenize(f"<s>[INST] {prompt} [/INST]" + prefix),
+                max_tokens=budget,
                 temperature=self.temperature,
                 top_p=self.top_p,
                 stop=["</s>", "[INST]"],
                 echo=False,
-                stream=True
-            )
-            for chunk in resp_iter:
+                stream=True,
+                **self._sampling_kwargs(cancel)
+            ):
+                text = chunk.get("choices", [{}])[0].get("text", "")
+                if text:
+                    parts.append(text)
+                    if callback:
+                        callback(text)
+                if cancel is not None and cancel.cancelled:
+                    break
+        return "".join(parts)
+
+    def _generate_batch_parallel(self, prompts: List[str], max_tokens: int,
+                                 callbacks: List[Optional[Callable[[str], None]]],
+                                 cancel: Optional[CancellationToken] = None) -> List[str]:
+        import numpy as np
+        import llama_cpp
+
+        n_seq = len(prompts)
+        seqs = [self._tokenize(f"<s>[INST] {p} [/INST]") for p in prompts]
+        n_batch = 512
+        stops = ["</s>", "[INST]"]
+        eos = self.llm.token_eos()
+        n_vocab = self.llm.n_vocab()
+        rng = np.random.default_rng()
+
+        # A dedicated context sharing the loaded weights. Unless the KV cache is
+        # unified, llama.cpp gives every sequence n_ctx / n_seq_max cells, so size
+        # each share for the longest prompt plus its reply.
+        params = type(self.llm.context_params).from_buffer_copy(self.llm.context_params)
+        params.n_ctx = n_seq * (max(len(t) for t in seqs) + max_tokens)
+        params.n_batch = max(n_batch, n_seq)
+        if hasattr(params, "n_ubatch"):
+            params.n_ubatch = params.n_batch
+        if hasattr(params, "n_seq_max"):
+            params.n_seq_max = n_seq
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        ctx = new_context(self.llm.model, params)
+        if not ctx:
+            raise NotImplementedError("could not create a multi-sequence context")
+        batch = llama_cpp.llama_batch_init(params.n_batch, 0, n_seq)
+
+        texts = [""] * n_seq
+        emitted = [0] * n_seq
+        decoders = [codecs.getincrementaldecoder("utf-8")(errors="ignore") for _ in range(n_seq)]
+        n_past = [0] * n_seq
+        n_gen = [0] * n_seq
+        done = [False] * n_seq
+        next_token: List[Optional[int]] = [None] * n_seq
+        start = time.time()
+
+        def add(token: int, seq: int, logits: bool) -> int:
+            i = batch.n_tokens
+            batch.token[i] = token
+            batch.pos[i] = n_past[seq]
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq
+            batch.logits[i] = logits
+            batch.n_tokens += 1
+            n_past[seq] += 1
+            return i
+
+        def decode() -> None:
+            status = llama_cpp.llama_decode(ctx, batch)
+            if status != 0:
+                raise _BatchDecodeError(f"llama_decode returned {status}", texts, done, emitted)
+
+        def sample(i: int) -> int:
+            logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(ctx, i), shape=(n_vocab,))
+            return self._sample_token(logits, rng)
+
+        def accept(seq: int, token: int) -> None:
+            n_gen[seq] += 1
+            if token == eos:
+                done[seq] = True
+                return
+            texts[seq] += decoders[seq].decode(self.llm.detokenize([token]))
+            for stop in stops:
+                cut = texts[seq].find(stop)
+                if cut != -1:
+                    texts[seq] = texts[seq][:cut]
+                    done[seq] = True
+            # Hold back text that could still become a stop string
+            safe = len(texts[seq]) if done[seq] else max(emitted[seq], len(texts[seq]) - max(len(x) for x in stops))
+            if callbacks[seq] and safe > emitted[seq]:
+                callbacks[seq](texts[seq][emitted[seq]:safe])
+            emitted[seq] = max(emitted[seq], safe)
+            if n_gen[seq] >= max_tokens:
+                done[seq] = True
+            next_token[seq] = None if done[seq] else token
+
+        try:
+            # Shared prefill: pack prompt tokens of all sequences into common batches
+            pending = [(seq, j) for seq in range(n_seq) for j in range(len(seqs[seq]))]
+            for offset in range(0, len(pending), params.n_batch):
+                batch.n_tokens = 0
+                last_rows = {}
+                for seq, j in pending[offset:offset + params.n_batch]:
+                    row = add(seqs[seq][j], seq, j == len(seqs[seq]) - 1)
+                    if j == len(seqs[seq]) - 1:
+                        last_rows[seq] = row
+                decode()
+                for seq, row in last_rows.items():
+                    accept(seq, sample(row))
+            # Decode: one token per unfinished sequence per step
+            while not all(done):
+                if cancel is not None and cancel.cancelled:
+                    break
+                batch.n_tokens = 0
+                rows = {}
+                for seq in range(n_seq):
+                    if not done[seq] and next_token[seq] is not None:
+                        rows[seq] = add(next_token[seq], seq, True)
+                if not rows:
+                    break
+                decode()
+                for seq, row in rows.items():
+                    accept(seq, sample(row))
+        finally:
+            llama_cpp.llama_batch_free(batch)
+            llama_cpp.llama_free(ctx)
+
+        self._record_cancel(cancel)
+        elapsed = time.time() - start
+        total = sum(n_gen)
+        self.metrics["batch_tokens"] = self.metrics.get("batch_tokens", 0) + total
+        print(f"⚡ Batch of {n_seq}: {total} tokens in {elapsed:.2f}s ({total / elapsed if elapsed > 0 else 0:.1f} tok/s aggregate)")
+        return [t.strip() for t in texts]
+
+    def _sample_token(self, logits, rng) -> int:
+        """Temperature + top-p sampling over a logits row (greedy when temperature is 0)."""
+        import numpy as np
+        if self.temperature <= 0:
+            return int(np.argmax(logits))
+        z = logits.astype(np.float64) / self.temperature
+        z -= z.max()
+        probs = np.exp(z)
+        probs /= probs.sum()
+        if self.top_p < 1.0:
+            order = np.argsort(-probs)
+            keep = order[: int(np.searchsorted(np.cumsum(probs[order]), self.top_p)) + 1]
+            return int(rng.choice(keep, p=probs[keep] / probs[keep].sum()))
+        return int(rng.choice(len(probs), p=probs))
+
+    def prefix_cache_stats(self) -> Dict[str, Any]:
+        """Prefix reuse counters for the pooled model instance."""
+        prompt_tokens = self.metrics.get("prompt_tokens", 0)
+        saved = self.metrics.get("saved_prefill_tokens", 0)
+        return {
+            "requests": self.metrics.get("chat_requests", 0),
+            "prompt_tokens": prompt_tokens,
+            "saved_prefill_tokens": saved,
+            "last_hit_tokens": self.last_prefix_hit,
+            "hit_ratio": (saved / prompt_tokens) if prompt_tokens else 0.0,
+        }
+
+    def _prepare_prompt(self, formatted_prompt: str, session_id: Optional[str] = None) -> List[int]:
+        """Tokenize a prompt and load the best cached KV state for it.
+
+        Tries, in order, the live KV cache, the session's saved state and the
+        system/preset prefix snapshot. llama.cpp then prefills only the tokens
+        after the longest match. Call with the instance lock held.
+        """
+        tokens = self._tokenize(formatted_prompt)
+        self.last_usage = {"prompt_tokens": len(tokens), "completion_tokens": 0}
+        hit = self._cached_prefix_len(tokens)
+        if session_id and hit < len(tokens) - 1:
+            hit = max(hit, self._restore_session_state(session_id, tokens))
+        if hit < len(tokens) - 1:
+            hit = max(hit, self._restore_prefix_snapshot(formatted_prompt, tokens, hit))
+        self._record_prefix_hit(hit, len(tokens))
+        return tokens
+
+    def _restore_prefix_snapshot(self, formatted_prompt: str, tokens: List[int], hit: int,
+                                 snapshots: Optional[PrefixSnapshotCache] = None) -> int:
+        """Restore (building on first use) the snapshot of the prompt's system/preset prefix."""
+        snapshots = snapshots or PREFIX_SNAPSHOTS
+        try:
+            prefix = snapshots.match(formatted_prompt)
+            if not prefix:
+                return 0
+            prefix_tokens = self._tokenize(prefix)
+            usable = 0
+            for a, b in zip(prefix_tokens, tokens[:-1]):
+                if a != b:
+                    break
+                usable += 1
+            if usable <= hit:
+                return 0
+            name = snapshots.prefix_name(prefix)
+            model_id = self.state_model_id()
+            snapshots.store.discard_session(name, keep_model_id=model_id)
+            key = KVStateStore.make_key(name, model_id)
+            state = snapshots.store.get(key)
+            if state is not None:
+                self.llm.load_state(state)
+                snapshots.hits += 1
+                return usable
+            # Evaluating the prefix now costs no more than prefilling it with the prompt,
+            # and llama.cpp then reuses it for this request just like a restored snapshot
+            self.llm.reset()
+            self.llm.eval(prefix_tokens)
+            snapshots.store.put(key, self.llm.save_state())
+            snapshots.builds += 1
+            return usable
+        except Exception as e:
+            print(f"⚠️  Prefix snapshot unavailable: {e}")
+            return 0
+
+    def precompute_prefix_snapshots(self, snapshots: Optional[PrefixSnapshotCache] = None) -> int:
+        """Build any missing system/preset prefix snapshots ahead of time; returns how many were built."""
+        snapshots = snapshots or PREFIX_SNAPSHOTS
+        built = snapshots.builds
+        model_id = self.state_model_id()
+        with self._llm_lock:
+            for prefix in snapshots.prefixes():
+                if snapshots.store.contains(KVStateStore.make_key(snapshots.prefix_name(prefix), model_id)):
+                    continue
+                # A one-token suffix makes the whole prefix eligible for reuse
+                self._restore_prefix_snapshot(prefix + " ", self._tokenize(prefix + " "), 0, snapshots)
+        return snapshots.builds - built
+
+    def _tokenize(self, text: str) -> List[int]:
+        tokenizer = self.tokenizer or TokenizerService(self.llm)
+        return tokenizer.tokenize(text, add_bos=True, special=True)
+
+    def context_budget(self, max_tokens: int = 512) -> int:
+        """Prompt tokens that fit in the context window while leaving room for the reply."""
+        return max(64, int(self.n_ctx or 2048) - max_tokens)
+
+    def pack_chat(self, history: List[Dict[str, Any]], packer: "ContextPacker", max_tokens: int = 512,
+                  pinned: Optional[str] = None, sticky: bool = True, system_prompt: Optional[str] = None) -> str:
+        """Chat transcript packed into context_budget(max_tokens) with exact token counts."""
+        return packer.pack(history, lambda text: self.count_tokens(text, special=True),
+                           self.context_budget(max_tokens), pinned=pinned, model_id=self.pool_key,
+                           sticky=sticky, system_prompt=system_prompt)
+
+    def warm_up(self) -> float:
+        """Evaluate a one-token prompt so the weights are paged in before the first real message."""
+        start = time.perf_counter()
+        if self.llm:
+            with self._llm_lock:
+                self.llm("<s>[INST] Hi [/INST]", max_tokens=1, temperature=0.0, echo=False)
+        return time.perf_counter() - start
+
+    def summarize_turns(self, turns: List[List[tuple]], memory: str = "", max_tokens: int = 160,
+                        cancel: Optional[CancellationToken] = None) -> Optional[str]:
+        """Fold chat turns into the running conversation summary.
+
+        Runs quietly (no cache, no console output, no usage or prefix metrics)
+        so it can be called from a background thread. It borrows the chat's
+        context and restores its KV cache afterwards, and the prompt is
+        prefilled in batches so a cancel takes effect before the whole prompt
+        is evaluated. Returns None if cancelled or on error.
+        """
+        if not self.llm:
+            return None
+        lines = [f"{'Student' if role == 'user' else 'Assistant'}: {content}" for t in turns for role, content in t]
+        prompt = ("Update the summary of a study conversation. Keep names, numbers, definitions, decisions "
+                  f"and open questions; at most 120 words, no preamble.\n\nSummary so far: {memory or '(none)'}"
+                  "\n\nNew messages:\n" + "\n".join(lines))
+        try:
+            with self._llm_lock:
+                saved = self.llm.save_state() if self.llm.n_tokens else None
+                try:
+                    tokens = self._tokenize(f"<s>[INST] {prompt} [/INST]")
+                    self.llm.reset()
+                    step = getattr(self.llm, "n_batch", 512)
+                    for i in range(0, len(tokens) - 1, step):
+                        if cancel is not None and cancel.cancelled:
+                            return None
+                        self.llm.eval(tokens[i:min(i + step, len(tokens) - 1)])
+                    response = self.llm(
+                        tokens,
+                        max_tokens=max_tokens,
+                        temperature=0.2,
+                        top_p=self.top_p,
+                        stop=["</s>", "[INST]"],
+                        echo=False,
+                        **self._sampling_kwargs(cancel)
+                    )
+                finally:
+                    # Hand the chat its cached prefix back
+                    if saved is not None:
+                        self.llm.load_state(saved)
+                    else:
+                        self.llm.reset()
+            if cancel is not None and cancel.cancelled:
+                return None
+            text = response['choices'][0]['text'].strip()
+            return text or None
+        except Exception:
+            return None
+
+    def count_tokens(self, text: str, special: bool = False) -> int:
+        """Exact number of tokens in text for the loaded model's vocabulary."""
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        return self.tokenizer.count(text, special=special)
+
+    def _cached_prefix_len(self, tokens: List[int]) -> int:
+        """Number of leading tokens already evaluated in the KV cache."""
+        try:
+            cached = self.llm.input_ids
+        except Exception:
+            return 0
+        n = 0
+        # llama.cpp always re-evaluates the final prompt token to get fresh logits
+        for a, b in zip(cached, tokens[:-1]):
+            if int(a) != b:
+                break
+            n += 1
+        return n
+
+    def _record_prefix_hit(self, hit: int, prompt_tokens: int) -> None:
+        self.last_prefix_hit = hit
+        self.metrics["chat_requests"] = self.metrics.get("chat_requests", 0) + 1
+        self.metrics["prompt_tokens"] = self.metrics.get("prompt_tokens", 0) + prompt_tokens
+        self.metrics["saved_prefill_tokens"] = self.metrics.get("saved_prefill_tokens", 0) + hit
+
+class HardwareDetector:
+    """Detect system capabilities and recommend optimal settings.
+
+    The hardware profile (cores, SIMD flags, caches, RAM) is probed once per
+    process and persisted to HARDWARE_PROFILE_FILE for ttl_s; it is re-probed
+    sooner if the CPU no longer matches the saved one. Disk speed is measured
+    only when disk_speed() is called and is saved with the profile.
+    """
+
+    _profile: Optional[Dict[str, Any]] = None
+    _cpu_model: Optional[str] = None
+    _numa: Optional[List[Dict[str, Any]]] = None
+    _lock = threading.RLock()
+
+    SIMD_FLAGS = ("sse4_2", "avx", "avx2", "fma", "f16c", "avx512f", "avx512bw", "avx512_vnni", "avx_vnni",
+                  "amx_tile", "neon", "asimd", "asimddp", "sve", "i8mm")
+
+    @staticmethod
+    def get_system_info() -> Dict[str, Any]:
+        """Get basic system information (from the cached profile; available RAM is live)."""
+        profile = HardwareDetector.profile()
+        return {
+            "platform": profile["platform"],
+            "arch": profile["arch"],
+            "cpu_count": profile["logical_cores"],
+            "physical_cores": profile["physical_cores"],
+            "simd": profile["simd"],
+            "memory_gb": profile["memory_gb"],
+            "available_gb": ModelPool._free_ram_gb(),
+            "python_version": platform.python_version()
+        }
+
+    @staticmethod
+    def profile(refresh: bool = False, path: Optional[Path] = None,
+                ttl_s: float = HARDWARE_PROFILE_TTL_S) -> Dict[str, Any]:
+        with HardwareDetector._lock:
+            if HardwareDetector._profile is not None and not refresh:
+                return HardwareDetector._profile
+            path = Path(path or HARDWARE_PROFILE_FILE)
+            identity = {"platform": platform.system(), "arch": platform.machine(),
+                        "cpu_model": HardwareDetector.cpu_model(), "logical_cores": os.cpu_count() or 1}
+            profile = None
+            if not refresh:
                 try:
-                    text = chunk.get("choices", [{}])[0].get("text", "")
+                    data = json.loads(path.read_text(encoding="utf-8"))
+                    if data.get("identity") == identity and time.time() - data.get("probed_at", 0) < ttl_s:
+                        profile = data
                 except Exception:
-                    text = ""
-                if text:
-                    yield text
+                    pass
+            if profile is None:
+                profile = HardwareDetector._probe(identity)
+                HardwareDetector._save(profile, path)
+            HardwareDetector._profile = profile
+            return profile
+
+    @staticmethod
+    def _save(profile: Dict[str, Any], path: Path) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(profile, indent=2), encoding="utf-8")
         except Exception:
-            # Fallback to non-streaming
-            full = self.generate_response(prompt, max_tokens=max_tokens)
-            if full:
-                yield full
+            pass
 
-class HardwareDetector:
-    """Detect system capabilities and recommend optimal settings."""
-    
     @staticmethod
-    def get_system_info() -> Dict[str, Any]:
-        """Get basic system information."""
+    def disk_speed(refresh: bool = False, path: Optional[Path] = None) -> Dict[str, Optional[float]]:
+        """Disk MB/s where models live, measured on first request rather than in profile().
+
+        The probe writes and reads 32 MB, so it only runs when asked for; the
+        result is saved with the profile and reused until that is re-probed.
+        """
+        profile = HardwareDetector.profile(path=path)
+        if profile.get("disk_mbps") and not refresh:
+            return profile["disk_mbps"]
+        disk = HardwareDetector._disk_speed(PREFERENCES_DIR)
+        with HardwareDetector._lock:
+            profile["disk_mbps"] = disk
+            HardwareDetector._save(profile, Path(path or HARDWARE_PROFILE_FILE))
+        return disk
+
+    @staticmethod
+    def _probe(identity: Dict[str, Any]) -> Dict[str, Any]:
+        logical = identity["logical_cores"]
         try:
             import psutil
-            memory_gb = psutil.virtual_memory().total / (1024**3)
+            physical = psutil.cpu_count(logical=False)
+            vm = psutil.virtual_memory()
+            memory_gb, available_gb = vm.total / (1024**3), vm.available / (1024**3)
         except ImportError:
-            memory_gb = 8  # Conservative fallback
-        
-        return {
-            "platform": platform.system(),
-            "arch": platform.machine(),
-            "cpu_count": os.cpu_count(),
-            "memory_gb": memory_gb,
-            "python_version": platform.python_version()
-        }
-    
+            physical = None
+            memory_gb, available_gb = 8, None  # Conservative fallback
+        cpuinfo = HardwareDetector._read_text("/proc/cpuinfo")
+        if not physical and cpuinfo:
+            # Unique (socket, core) pairs; hyper-threads share a core id
+            cores, socket = set(), "0"
+            for line in cpuinfo.splitlines():
+                key, _, value = line.partition(":")
+                if key.strip() == "physical id":
+                    socket = value.strip()
+                elif key.strip() == "core id":
+                    cores.add((socket, value.strip()))
+            physical = len(cores) or None
+        profile = dict(identity)
+        profile.update({
+            "physical_cores": int(physical or logical),
+            "simd": HardwareDetector._simd_flags(cpuinfo, identity),
+            "cache_kb": HardwareDetector._cache_sizes(),
+            "memory_gb": round(memory_gb, 2),
+            "available_gb_at_probe": round(available_gb, 2) if available_gb is not None else None,
+            "probed_at": time.time(),
+            "identity": identity,
+        })
+        return profile
+
+    @staticmethod
+    def _simd_flags(cpuinfo: str, identity: Dict[str, Any]) -> List[str]:
+        flags = set()
+        for line in cpuinfo.splitlines():
+            key, _, value = line.partition(":")
+            if key.strip().lower() in ("flags", "features"):
+                flags.update(value.split())
+        if identity["platform"] == "Darwin":
+            try:
+                out = subprocess.run(["sysctl", "-a"], capture_output=True, text=True, timeout=5).stdout
+                for line in out.splitlines():
+                    key, _, value = line.partition(":")
+                    if key.startswith("hw.optional.") and value.strip() == "1":
+                        flags.add(re.sub(r"_\d+$", "", key.rsplit(".", 1)[1].lower()))  # e.g. avx2_0
+                    elif key.strip() in ("machdep.cpu.features", "machdep.cpu.leaf7_features"):
+                        flags.update(v.lower().replace("avx1.0", "avx") for v in value.split())
+            except Exception:
+                pass
+            if identity["arch"] == "arm64":
+                flags.add("neon")
+        elif identity["platform"] == "Windows":
+            try:
+                import ctypes
+                present = ctypes.windll.kernel32.IsProcessorFeaturePresent
+                for feature, flag in ((39, "avx"), (40, "avx2"), (41, "avx512f"), (19, "neon")):
+                    if present(feature):
+                        flags.add(flag)
+            except Exception:
+                pass
+        if "asimd" in flags:
+            flags.add("neon")  # AArch64 Advanced SIMD is NEON
+        return [f for f in HardwareDetector.SIMD_FLAGS if f in flags]
+
+    @staticmethod
+    def _cache_sizes() -> Dict[str, int]:
+        sizes: Dict[str, int] = {}
+        base = Path("/sys/devices/system/cpu/cpu0/cache")
+        try:
+            for index in sorted(base.glob("index*")):
+                level = (index / "level").read_text().strip()
+                kind = (index / "type").read_text().strip()
+                raw = (index / "size").read_text().strip().upper()
+                kb = int(raw.rstrip("KMG")) * {"K": 1, "M": 1024, "G": 1024 * 1024}.get(raw[-1], 1)
+                name = f"l{level}" + ({"Data": "d", "Instruction": "i"}.get(kind, ""))
+                sizes[name] = kb
+        except Exception:
+            pass
+        if not sizes and platform.system() == "Darwin":
+            for name, key in (("l1d", "hw.l1dcachesize"), ("l2", "hw.l2cachesize"), ("l3", "hw.l3cachesize")):
+                try:
+                    out = subprocess.run(["sysctl", "-n", key], capture_output=True, text=True, timeout=5).stdout
+                    if out.strip() and int(out) > 0:
+                        sizes[name] = int(out) // 1024
+                except Exception:
+                    pass
+        return sizes
+
+    @staticmethod
+    def _disk_speed(directory: Path, size_mb: int = 32) -> Dict[str, Optional[float]]:
+        """Sequential write/read MB/s where models live; read is None if the page cache can't be bypassed."""
+        result: Dict[str, Optional[float]] = {"write": None, "read": None}
+        probe = Path(directory) / ".disk_probe"
+        try:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            block = os.urandom(1024 * 1024)
+            start = time.perf_counter()
+            with open(probe, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+            result["write"] = round(size_mb / (time.perf_counter() - start), 1)
+            if hasattr(os, "posix_fadvise"):
+                with open(probe, "rb", buffering=0) as f:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                    start = time.perf_counter()
+                    while f.read(len(block)):
+                        pass
+                    result["read"] = round(size_mb / (time.perf_counter() - start), 1)
+        except Exception:
+            pass
+        finally:
+            try:
+                probe.unlink()
+            except Exception:
+                pass
+        return result
+
+    @staticmethod
+    def numa_nodes(root: Path = Path("/sys/devices/system/node")) -> List[Dict[str, Any]]:
+        """NUMA nodes with their CPUs and memory; a single node (or [] off Linux) means no NUMA."""
+        if HardwareDetector._numa is not None and root == Path("/sys/devices/system/node"):
+            return HardwareDetector._numa
+        nodes = []
+        for path in sorted(Path(root).glob("node[0-9]*"), key=lambda p: int(p.name[4:])):
+            cpus = _parse_cpulist(HardwareDetector._read_text(str(path / "cpulist")))
+            if not cpus:
+                continue  # memory-only node (e.g. CXL)
+            match = re.search(r"MemTotal:\s+(\d+)\s*kB", HardwareDetector._read_text(str(path / "meminfo")))
+            nodes.append({"node": int(path.name[4:]), "cpus": cpus,
+                          "memory_gb": round(int(match.group(1)) / (1024**2), 2) if match else None})
+        if root == Path("/sys/devices/system/node"):
+            HardwareDetector._numa = nodes
+        return nodes
+
+    @staticmethod
+    def _read_text(path: str) -> str:
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read()
+        except Exception:
+            return ""
+
+    @staticmethod
+    def cpu_model() -> str:
+        """CPU model name, e.g. "Intel(R) Core(TM) i5-8250U CPU @ 1.60GHz"."""
+        if HardwareDetector._cpu_model is None:
+            name = None
+            for line in HardwareDetector._read_text("/proc/cpuinfo").splitlines():
+                if line.lower().startswith(("model name", "hardware", "cpu model")):
+                    name = line.split(":", 1)[1].strip()
+                    break
+            HardwareDetector._cpu_model = name or platform.processor() or platform.machine() or "unknown"
+        return HardwareDetector._cpu_model
+
+    @staticmethod
+    def recommended_settings(model_path: Optional[Path] = None) -> Dict[str, int]:
+        """Default n_threads and n_ctx from the profile.
+
+        Decoding is memory-bound, so one thread per physical core (hyper-threads
+        only add contention). The context grows with the RAM left after the
+        model and ~2GB for the OS, as that is where the KV cache lives.
+        """
+        profile = HardwareDetector.profile()
+        size_gb = ModelPool._estimate_size_gb(str(model_path)) if model_path else 4.1
+        headroom_gb = profile["memory_gb"] - (size_gb or 4.1) - 2.0
+        if headroom_gb >= 6 and profile["physical_cores"] >= 4:
+            n_ctx = 4096
+        elif headroom_gb >= 1.5:
+            n_ctx = 2048
+        else:
+            n_ctx = 1024
+        return {"n_threads": max(1, profile["physical_cores"]), "n_ctx": n_ctx}
+
     @staticmethod
     def get_performance_tier() -> str:
         """Determine performance tier based on hardware."""
@@ -483,16 +3763,297 @@ class HardwareDetector:
         
         print(f"✅ System requirements met:")
         print(f"   RAM: {info['memory_gb']:.1f}GB (required: {model.min_ram_gb}GB)")
-        print(f"   CPU: {info['cpu_count']} cores")
+        simd = ", ".join(info["simd"]) or "none detected"
+        print(f"   CPU: {info['physical_cores']} cores / {info['cpu_count']} threads (SIMD: {simd})")
         print(f"   Platform: {info['platform']} {info['arch']}")
         return True
 
+def _parse_cpulist(text: str) -> List[int]:
+    """Parse a sysfs cpulist such as "0-3,8-11" into [0, 1, 2, 3, 8, 9, 10, 11]."""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        elif part.strip():
+            cpus.append(int(part))
+    return cpus
+
+def _numa_cpus(node: int) -> Optional[List[int]]:
+    """CPUs of a NUMA node, or None if the node does not exist or pinning is not supported here."""
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+    return next((n["cpus"] for n in HardwareDetector.numa_nodes() if n["node"] == node), None)
+
+def _numa_prefer(node: Optional[int]) -> None:
+    """Prefer node's memory for the calling thread's allocations (None: local node again)."""
+    try:
+        import ctypes
+        libnuma = ctypes.CDLL("libnuma.so.1")
+        if libnuma.numa_available() >= 0:
+            if node is None:
+                libnuma.numa_set_localalloc()
+            else:
+                libnuma.numa_set_preferred(int(node))
+    except Exception:
+        pass  # no libnuma: pinned threads still allocate locally on first touch
+
+def pin_to_numa_node(node: int) -> Optional[set]:
+    """Run every thread of this process on one NUMA node's CPUs and prefer its memory.
+
+    For processes that only run inference (benchmarks, --batch workers); an
+    AIInference with numa_node pins just its own threads through
+    numa_thread_affinity(). Returns the previous CPU set for
+    restore_affinity(), or None if pinning is not supported here.
+    """
+    cpus = _numa_cpus(node)
+    if cpus is None:
+        return None
+    previous = os.sched_getaffinity(0)
+    _set_process_affinity(cpus)
+    _numa_prefer(node)
+    return previous
+
+@contextlib.contextmanager
+def numa_thread_affinity(node: Optional[int]):
+    """Pin only the calling thread to a NUMA node's CPUs and memory for the duration.
+
+    Compute threads llama.cpp starts from this thread inherit the affinity,
+    and first-touch allocation keeps the KV cache on the same node, while GUI,
+    server and download threads elsewhere in the process are left alone. The
+    previous CPU set and memory policy are restored on exit.
+    """
+    cpus = _numa_cpus(node) if node is not None else None
+    if cpus is None:
+        yield False
+        return
+    tid = threading.get_native_id()
+    previous = os.sched_getaffinity(tid)
+    os.sched_setaffinity(tid, cpus)
+    _numa_prefer(node)
+    try:
+        yield True
+    finally:
+        os.sched_setaffinity(tid, previous)
+        _numa_prefer(None)
+
+class _NumaLock:
+    """A pooled instance lock that also pins the holding thread to a NUMA node."""
+
+    def __init__(self, lock: "threading.RLock", node: int):
+        self._lock = lock
+        self.node = node
+        self._local = threading.local()
+
+    def __enter__(self) -> "_NumaLock":
+        self._lock.acquire()
+        pin = numa_thread_affinity(self.node)
+        pin.__enter__()
+        self._local.__dict__.setdefault("pins", []).append(pin)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        try:
+            self._local.pins.pop().__exit__(None, None, None)
+        finally:
+            self._lock.release()
+
+def restore_affinity(cpus: Optional[set]) -> None:
+    if cpus and hasattr(os, "sched_setaffinity"):
+        _set_process_affinity(cpus)
+        _numa_prefer(None)
+
+def _set_process_affinity(cpus) -> None:
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            os.sched_setaffinity(int(tid), cpus)
+        except Exception:
+            pass  # thread exited meanwhile
+
+class ModelLifecycle:
+    """Loads the chat model ahead of the first message and unloads it when idle.
+
+    preload() builds an AIInference with factory() on a background thread
+    (through MODEL_POOL, so the instance a later Send creates is a pool hit)
+    and runs a one-token warm-up. touch() marks activity and tells the manager
+    which pooled model the frontend is using; after idle_unload_s seconds
+    without activity that model is evicted, unless a generation holds it
+    (0 disables unloading).
+    Every state change is reported as on_change(state, message), e.g. for a
+    status bar; states are unloaded, loading, warming, ready, missing (no
+    model downloaded) and error. Only an unloaded model is preloaded again, so
+    calling preload() on every keystroke is cheap.
+    """
+
+    def __init__(self, factory: Callable[[], Optional["AIInference"]], idle_unload_s: float = 600.0,
+                 on_change: Optional[Callable[[str, str], None]] = None, poll_s: Optional[float] = None):
+        self.factory = factory
+        self.idle_unload_s = idle_unload_s
+        self.on_change = on_change
+        self.poll_s = poll_s or min(30.0, max(1.0, idle_unload_s / 10))
+        self.state = "unloaded"
+        self.timings: Dict[str, float] = {}
+        self._key: Optional[tuple] = None
+        self._last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def preload(self) -> bool:
+        """Start loading in the background unless a model is loaded or loading."""
+        with self._lock:
+            if self.state != "unloaded":
+                self._last_used = time.monotonic()
+                return False
+            self.state = "loading"
+        self._last_used = time.monotonic()
+        threading.Thread(target=self._load, daemon=True).start()
+        return True
+
+    def touch(self, ai: Optional["AIInference"] = None) -> None:
+        self._last_used = time.monotonic()
+        if ai is not None and ai.pool_key:
+            with self._lock:
+                self._key = ai.pool_key
+                ready = self.state in ("unloaded", "missing", "error")  # loaded by the frontend itself
+                if ready:
+                    self.state = "ready"
+            if ready:
+                self._notify("ready", "Model ready")
+
+    def unload(self) -> bool:
+        with self._lock:
+            if self.state != "ready" or self._key is None:
+                return False
+            if not MODEL_POOL.evict_idle(self._key):
+                return False  # a generation is still using it
+            self.state = "unloaded"
+            self._key = None
+        idle = time.monotonic() - self._last_used
+        self._notify("unloaded", f"Model unloaded after {idle / 60:.0f} min idle to free RAM")
+        return True
+
+    def close(self) -> None:
+        self._closed.set()
+
+    def _load(self) -> None:
+        self._notify("loading", "Loading model in the background…")
+        try:
+            start = time.perf_counter()
+            ai = self.factory()
+            if ai is None or not ai.llm:
+                with self._lock:
+                    self.state = "missing"
+                self._notify("missing", "No model downloaded yet")
+                return
+            self.timings["load_s"] = time.perf_counter() - start
+            with self._lock:
+                self.state = "warming"
+            self._notify("warming", f"Model loaded in {self.timings['load_s']:.1f}s • warming up…")
+            self.timings["warmup_s"] = ai.warm_up()
+            with self._lock:
+                self.state = "ready"
+                self._key = ai.pool_key
+            self._last_used = time.monotonic()
+            self._notify("ready", f"Model ready (load {self.timings['load_s']:.1f}s, "
+                                  f"warm-up {self.timings['warmup_s']:.1f}s)")
+        except Exception as e:
+            with self._lock:
+                self.state = "error"
+            self._notify("error", f"Model preload failed: {e}")
+
+    def _watch(self) -> None:
+        while not self._closed.wait(self.poll_s):
+            idle = time.monotonic() - self._last_used
+            if self.idle_unload_s > 0 and self.state == "ready" and idle > self.idle_unload_s:
+                self.unload()
+
+    def _notify(self, state: str, message: str) -> None:
+        if self.on_change:
+            try:
+                self.on_change(state, message)
+            except Exception:
+                pass
+
+
+class RollingSummarizer:
+    """Idle-time summarization of turns that fell out of the context window.
+
+    After a reply, schedule() checks whether the packer dropped turns that the
+    memory does not cover yet and, if so, starts a daemon thread that waits
+    idle_delay seconds and folds those turns into packer.memory, a few at a
+    time (at most max_chars per model call) so each call stays short. Call
+    preempt() before a user generation: the running call stops within one
+    decode step, freeing the model, and the rest is picked up at the next
+    schedule(). The memory is a plain dict so it can be saved with a session.
+    """
+
+    def __init__(self, packer: ContextPacker, idle_delay: float = 1.5, max_chars: int = 2400,
+                 max_tokens: int = 160):
+        self.packer = packer
+        self.idle_delay = idle_delay
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self._cancel = CancellationToken()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.runs = 0
+
+    def pending(self, history: List[Dict[str, Any]]) -> List[List[tuple]]:
+        """Dropped turns not yet folded into the memory."""
+        covered = int((self.packer.memory or {}).get("turns", 0))
+        return ContextPacker.turns(history)[covered:self.packer.dropped]
+
+    def schedule(self, ai: "AIInference", history: List[Dict[str, Any]]) -> bool:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            if not self.pending(history):
+                return False
+            self._cancel = CancellationToken()
+            self._thread = threading.Thread(target=self._run, args=(ai, list(history), self._cancel), daemon=True)
+            self._thread.start()
+            return True
+
+    def preempt(self) -> None:
+        self._cancel.cancel()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, ai: "AIInference", history: List[Dict[str, Any]], cancel: CancellationToken) -> None:
+        if cancel.wait(self.idle_delay):
+            return
+        while not cancel.cancelled:
+            pending = self.pending(history)
+            if not pending:
+                return
+            batch, size = [], 0
+            for turn in pending:
+                size += sum(len(c) for _, c in turn)
+                if batch and size > self.max_chars:
+                    break
+                batch.append(turn)
+            memory = self.packer.memory or {}
+            text = ai.summarize_turns(batch, memory.get("text", ""), self.max_tokens, cancel)
+            if text is None:
+                return
+            self.packer.memory = {"text": text, "turns": int(memory.get("turns", 0)) + len(batch)}
+            self.runs += 1
+
+
 class InteractiveChat:
     """Handle interactive chat interface."""
     
     def __init__(self, ai_inference: AIInference):
         self.ai = ai_inference
         self.conversation_history: List[Dict[str, Any]] = []
+        self.session_id = uuid.uuid4().hex
+        self.packer = ContextPacker()
+        self.summarizer = RollingSummarizer(self.packer)
     
     def start_chat(self):
         """Start interactive chat session."""
@@ -519,6 +4080,8 @@ class InteractiveChat:
                 
                 if lower == 'clear':
                     self.conversation_history.clear()
+                    self.session_id = uuid.uuid4().hex
+                    self._reset_memory()
                     print("🧹 Conversation history cleared")
                     continue
                 
@@ -538,10 +4101,30 @@ class InteractiveChat:
                     print(f"📥 Loaded conversation from {path}")
                     continue
                 
-                # Generate response
+                # Generate response; earlier turns are served from the KV cache
                 print("\n🤖 Verdant: ", end='', flush=True)
-                response = self.ai.generate_response(user_input)
-                print(response)
+                self.summarizer.preempt()
+                dropped_before = self.packer.dropped
+                transcript = self.ai.pack_chat(self.conversation_history + [{'user': user_input}], self.packer)
+                if self.packer.dropped > dropped_before:
+                    print(f"ℹ️  {self.packer.dropped} earlier turn(s) moved out of the context window; "
+                          "they will be summarized while you type")
+                parts = []
+                first_turn = user_input if not self.conversation_history else None
+                # Ctrl+C stops the reply (within one token) instead of leaving the chat
+                with cancel_on_sigint(CancellationToken()) as cancel:
+                    with contextlib.closing(self.ai.generate_chat_stream(
+                            transcript, session_id=self.session_id, semantic_prompt=first_turn, cancel=cancel)) as stream:
+                        for chunk in stream:
+                            parts.append(chunk)
+                            print(chunk, end='', flush=True)
+                print()
+                response = "".join(parts)
+                if cancel.cancelled:
+                    print(f"⏹  Stopped ({self.ai.metrics.get('stop_latency_s', 0) * 1000:.0f} ms to idle)")
+                    continue
+                if self.ai.last_prefix_hit:
+                    print(f"   ♻️  Reused {self.ai.last_prefix_hit} cached prompt tokens")
                 
                 # Store in history
                 self.conversation_history.append({
@@ -549,6 +4132,7 @@ class InteractiveChat:
                     'assistant': response,
                     'timestamp': time.time()
                 })
+                self.summarizer.schedule(self.ai, self.conversation_history)
                 
             except KeyboardInterrupt:
                 print("\n\n👋 Goodbye! Thanks for using Verdant.")
@@ -568,6 +4152,8 @@ class InteractiveChat:
     def save_history(self, file_path: Path):
         data = {
             'history': self.conversation_history,
+            'session_id': self.session_id,
+            'memory': self.packer.memory,
             'saved_at': time.time(),
             'version': '1.0'
         }
@@ -578,25 +4164,816 @@ class InteractiveChat:
         with open(file_path, "r", encoding="utf-8") as f:
             data = json.load(f)
         self.conversation_history = data.get('history', [])
+        self.session_id = data.get('session_id') or Path(file_path).stem
+        self._reset_memory(data.get('memory'))
+    
+    def _reset_memory(self, memory: Optional[Dict[str, Any]] = None):
+        self.summarizer.preempt()
+        self.packer = ContextPacker()
+        self.packer.memory = memory
+        self.summarizer = RollingSummarizer(self.packer)
+
+
+AUTOTUNE_TEXT = ("Photosynthesis converts light energy into chemical energy stored in glucose. "
+                 "Chlorophyll in the chloroplasts absorbs mostly red and blue light. ") * 12
+
+def autotune(model_path: Path, n_ctx: int = 1024, decode_tokens: int = 16,
+             measure: Optional[Callable[[int, int, int], tuple]] = None, patience: int = 2,
+             thread_counts: Optional[List[int]] = None, prefs_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Sweep n_threads and n_batch with short prefill/decode runs; store the best in preferences.
+
+    Thread counts are tried upward from half the physical cores. Decode speed
+    (memory bound) picks n_threads, prefill speed (compute bound) picks
+    n_threads_batch, and the sweep stops once `patience` candidates in a row
+    are slower than the best so far. n_batch is then swept the same way on
+    prefill. measure(n_threads, n_threads_batch, n_batch) returns
+    (prefill tok/s, decode tok/s) and defaults to loading the model.
+    """
+    profile = HardwareDetector.profile()
+    logical, physical = profile["logical_cores"], profile["physical_cores"]
+    if measure is None:
+        measure = _autotune_measure(model_path, n_ctx, decode_tokens)
+
+    counts = {2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, physical, logical}
+    counts = thread_counts or sorted(c for c in counts if max(1, physical // 2) <= c <= logical)
+    results: Dict[int, tuple] = {}
+    best_decode = best_prefill = 0.0
+    worse = 0
+    for n in counts:
+        prefill, decode = measure(n, n, 512)
+        results[n] = (prefill, decode)
+        print(f"   threads {n:>3}: prefill {prefill:7.1f} tok/s, decode {decode:6.1f} tok/s")
+        improved = decode > best_decode * 1.02 or prefill > best_prefill * 1.02
+        best_decode, best_prefill = max(best_decode, decode), max(best_prefill, prefill)
+        worse = 0 if improved else worse + 1
+        if worse >= patience:
+            break
+    n_threads = max(results, key=lambda n: results[n][1])
+    n_threads_batch = max(results, key=lambda n: results[n][0])
+
+    batches: Dict[int, float] = {512: results[n_threads_batch][0]}
+    best, worse = batches[512], 0
+    for n_batch in (256, 128, 64):
+        prefill, _ = measure(n_threads, n_threads_batch, n_batch)
+        batches[n_batch] = prefill
+        print(f"   batch {n_batch:>4}: prefill {prefill:7.1f} tok/s")
+        if prefill > best * 1.02:
+            best, worse = prefill, 0
+        else:
+            worse += 1
+            if worse >= patience:
+                break
+    n_batch = max(batches, key=lambda b: batches[b])
+
+    settings = {
+        "n_threads": n_threads,
+        "n_threads_batch": n_threads_batch,
+        "n_batch": n_batch,
+        "decode_tps": round(results[n_threads][1], 2),
+        "prefill_tps": round(batches[n_batch], 2),
+        "runs": len(results) + len(batches) - 1,
+        "tuned_at": time.time(),
+    }
+    UserPreferences.save_tuned_settings(model_path, settings, prefs_path)
+    return settings
 
+def _autotune_measure(model_path: Path, n_ctx: int, decode_tokens: int) -> Callable[[int, int, int], tuple]:
+    from llama_cpp import Llama
+
+    def measure(n_threads: int, n_threads_batch: int, n_batch: int) -> tuple:
+        llm = Llama(model_path=str(model_path), n_ctx=n_ctx, n_threads=n_threads,
+                    n_threads_batch=n_threads_batch, n_batch=n_batch, verbose=False)
+        try:
+            prompt = llm.tokenize(f"[INST] {AUTOTUNE_TEXT} Summarize. [/INST]".encode("utf-8"))
+            prompt = prompt[:n_ctx - decode_tokens - 8]
+            start = time.perf_counter()
+            first = last = None
+            n = 0
+            for _ in llm.create_completion(prompt, max_tokens=decode_tokens, temperature=0.0, stream=True):
+                last = time.perf_counter()
+                first = first or last
+                n += 1
+            prefill = len(prompt) / (first - start) if first else 0.0
+            decode = (n - 1) / (last - first) if n > 1 and last > first else 0.0
+            return prefill, decode
+        finally:
+            ModelPool._close(llm)
+
+    return measure
 
 def run_benchmark(ai: AIInference, runs: int = 1) -> None:
     """Run a basic generation benchmark and print throughput."""
     test_prompt = "Explain why local AI can be more eco‑friendly than cloud AI in 3 bullet points."
     total_tokens = 0
     total_time = 0.0
-    for i in range(runs):
-        start = time.time()
-        out = ai.generate_response(test_prompt, max_tokens=256)
-        elapsed = time.time() - start
-        total_time += elapsed
-        # Fallback token estimate if usage not provided
-        tokens = max(1, len(out.split()))
-        total_tokens += tokens
-        print(f"Run {i+1}: {tokens} est. tokens in {elapsed:.2f}s")
-    avg_tps = total_tokens / total_time if total_time > 0 else 0
-    print(f"\n📊 Benchmark: {total_tokens} est. tokens over {runs} run(s) in {total_time:.2f}s → {avg_tps:.1f} tok/s (approx)")
+    use_cache, ai.use_cache = ai.use_cache, False  # measure real generation, not cache replays
+    try:
+        for i in range(runs):
+            start = time.time()
+            out = ai.generate_response(test_prompt, max_tokens=256)
+            elapsed = time.time() - start
+            total_time += elapsed
+            tokens = ai.last_usage.get("completion_tokens") or count_tokens(out, ai)
+            total_tokens += tokens
+            print(f"Run {i+1}: {tokens} tokens in {elapsed:.2f}s")
+        avg_tps = total_tokens / total_time if total_time > 0 else 0
+        print(f"\n📊 Benchmark: {total_tokens} tokens over {runs} run(s) in {total_time:.2f}s → {avg_tps:.1f} tok/s")
+        latency = measure_stop_latency(ai, test_prompt)
+        if latency is not None:
+            print(f"⏹  Stop-to-idle latency: {latency * 1000:.0f} ms")
+    finally:
+        ai.use_cache = use_cache
+
+def benchmark_numa(model_path: Path, node: int = 0, runs: int = 2, max_tokens: int = 128,
+                   n_ctx: Optional[int] = None, factory: Optional[Callable[[Optional[int]], Any]] = None
+                   ) -> Dict[str, Any]:
+    """Decode tok/s of the same model unpinned and pinned to one NUMA node.
+
+    Both runs use the node's core count as n_threads so only placement differs.
+    The process affinity is restored afterwards.
+    """
+    nodes = {n["node"]: n for n in HardwareDetector.numa_nodes()}
+    if node not in nodes:
+        raise ValueError(f"NUMA node {node} not found (nodes: {sorted(nodes) or 'none'})")
+    profile = HardwareDetector.profile()
+    threads = max(1, len(nodes[node]["cpus"]) // max(1, profile["logical_cores"] // profile["physical_cores"]))
+    if factory is None:
+        def factory(numa_node):
+            return AIInference(Path(model_path), n_ctx=n_ctx, n_threads=threads, use_cache=False,
+                               numa_node=numa_node)
+    prompt = "Explain why local AI can be more eco‑friendly than cloud AI in 3 bullet points."
+    results: Dict[str, Any] = {"node": node, "threads": threads}
+    original = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    try:
+        for label, numa_node in (("unpinned", None), ("pinned", node)):
+            ai = factory(numa_node)
+            tokens, elapsed = 0, 0.0
+            for _ in range(runs):
+                start = time.perf_counter()
+                out = ai.generate_response(prompt, max_tokens=max_tokens)
+                elapsed += time.perf_counter() - start
+                tokens += ai.last_usage.get("completion_tokens") or count_tokens(out, ai)
+            results[f"{label}_tps"] = tokens / elapsed if elapsed > 0 else 0.0
+            if getattr(ai, "pool_key", None):
+                MODEL_POOL.evict(ai.pool_key)  # the next run must load its own instance
+            restore_affinity(original)
+    finally:
+        restore_affinity(original)
+    results["speedup"] = results["pinned_tps"] / results["unpinned_tps"] if results["unpinned_tps"] else None
+    return results
+
+def measure_stop_latency(ai: AIInference, prompt: str, after_chunks: int = 8) -> Optional[float]:
+    """Cancel a streaming generation mid-decode, as a Stop button would, and time
+    how long until the generation has returned and the model is free again."""
+    cancel = CancellationToken()
+    reached = threading.Event()
+    chunks = []
+
+    def consume():
+        with contextlib.closing(ai.generate_response_stream(prompt, max_tokens=256, cancel=cancel)) as stream:
+            for chunk in stream:
+                chunks.append(chunk)
+                if len(chunks) == after_chunks:
+                    reached.set()
+        reached.set()
+
+    worker = threading.Thread(target=consume, daemon=True)
+    worker.start()
+    reached.wait()
+    cancel.cancel()
+    worker.join()
+    if len(chunks) < after_chunks:
+        return None  # finished before the cancel point
+    return time.perf_counter() - cancel.cancelled_at
+
+
+# JSONL batch mode: one model per worker process, results streamed as NDJSON
+_BATCH_AI: Optional[AIInference] = None
+
+def _batch_worker_init(model_path: str, n_ctx: Optional[int], n_threads: int,
+                       temperature: float, top_p: float, numa_nodes: Optional[List[int]] = None,
+                       counter: Any = None) -> None:
+    global _BATCH_AI
+    numa_node = None
+    if numa_nodes and counter is not None:
+        # Round-robin workers over the nodes so each instance reads local memory
+        with counter.get_lock():
+            numa_node = numa_nodes[counter.value % len(numa_nodes)]
+            counter.value += 1
+    _BATCH_AI = AIInference(Path(model_path), n_ctx=n_ctx, n_threads=n_threads,
+                            temperature=temperature, top_p=top_p, numa_node=numa_node)
+
+def _batch_worker_generate(key: str, prompt: str, max_tokens: int) -> tuple:
+    start = time.time()
+    response = _BATCH_AI.generate_response(prompt, max_tokens=max_tokens)
+    return key, response, time.time() - start
+
+def _batch_item_key(prompt: str, max_tokens: int) -> str:
+    return hashlib.sha256(f"{max_tokens}\x00{prompt}".encode("utf-8")).hexdigest()
+
+def _iter_batch_items(in_path: Path, default_preset: Optional[str], presets: Dict[str, str]):
+    """Yield (id, final_prompt, max_tokens) for each usable line of a JSONL prompt file.
+
+    Lines may be JSON strings or objects with "prompt" and optional "id",
+    "preset" and "max_tokens". Lines without an id are numbered.
+    """
+    with open(in_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️  Skipping line {line_no}: invalid JSON")
+                continue
+            if isinstance(item, str):
+                item = {"prompt": item}
+            if not isinstance(item, dict) or not item.get("prompt"):
+                print(f"⚠️  Skipping line {line_no}: no prompt")
+                continue
+            prompt = str(item["prompt"])
+            preset = presets.get(item.get("preset") or default_preset or "")
+            if preset:
+                prompt = f"{preset}\n\nUser prompt: {prompt}"
+            yield str(item.get("id", f"line-{line_no}")), prompt, int(item.get("max_tokens") or 512)
+
+def _load_batch_checkpoint(out_path: Path) -> tuple:
+    """Read finished results from a previous run of the same job.
+
+    Returns (done_ids, responses_by_key). A torn last line from a crash is cut
+    off so appending resumes on a clean line boundary.
+    """
+    done: set = set()
+    responses: Dict[str, str] = {}
+    if not out_path.exists():
+        return done, responses
+    valid_bytes = 0
+    with open(out_path, "rb") as f:
+        for raw in f:
+            try:
+                rec = json.loads(raw.decode("utf-8"))
+            except Exception:
+                break
+            if not raw.endswith(b"\n"):
+                break
+            valid_bytes += len(raw)
+            if "response" in rec:
+                done.add(rec.get("id"))
+                if rec.get("key"):
+                    responses[rec["key"]] = rec["response"]
+    if valid_bytes < out_path.stat().st_size:
+        with open(out_path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done, responses
+
+def run_batch_job(model_path: Path, in_path: Path, out_path: Path, workers: Optional[int] = None,
+                  n_ctx: Optional[int] = None, n_threads: Optional[int] = None,
+                  temperature: float = 0.7, top_p: float = 0.9, preset: Optional[str] = None,
+                  numa: bool = True) -> Dict[str, int]:
+    """Generate responses for a JSONL prompt file across a pool of worker processes.
+
+    Each worker loads its own (mmap-shared) copy of the model with the CPU cores
+    split between workers; on multi-socket machines workers are spread over the
+    NUMA nodes and pinned to them. Results are appended to out_path as NDJSON as soon as
+    they finish, so rerunning the same command resumes where it stopped.
+    Identical prompts are generated once and the answer reused.
+    """
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    import multiprocessing
+
+    cores = HardwareDetector.profile()["physical_cores"]
+    nodes = [n["node"] for n in HardwareDetector.numa_nodes()] if numa else []
+    if len(nodes) < 2:
+        nodes = []
+    workers = max(1, workers or max(1, cores // 4))
+    if nodes:
+        workers = -(-workers // len(nodes)) * len(nodes)  # the same number of workers on every node
+    threads_per_worker = n_threads or max(1, cores // workers)
+    mp_context = multiprocessing.get_context()
+    counter = mp_context.Value("i", 0)
+    presets = PresetsManager.load_presets()
+    done_ids, responses = _load_batch_checkpoint(out_path)
+    stats = {"written": 0, "skipped": len(done_ids), "deduplicated": 0, "generated": 0}
+    if done_ids:
+        print(f"↩️  Resuming: {len(done_ids)} result(s) already in {out_path}")
+    print(f"🧵 {workers} worker(s) × {threads_per_worker} thread(s)"
+          + (f" over {len(nodes)} NUMA nodes" if nodes else ""))
+
+    waiting: Dict[str, List[str]] = {}  # key -> ids waiting on that generation
+    start = time.time()
+    with open(out_path, "a", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_batch_worker_init,
+                                initargs=(str(model_path), n_ctx, threads_per_worker, temperature, top_p,
+                                          nodes, counter)) as pool:
+
+        def write(item_id: str, key: str, prompt: str, response: str, elapsed: float) -> None:
+            rec = {"id": item_id, "key": key, "prompt": prompt, "elapsed": round(elapsed, 3)}
+            # Failed generations are recorded without a response so a rerun retries them
+            rec["error" if response.startswith("❌") else "response"] = response
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            stats["written"] += 1
+            if stats["written"] % 20 == 0:
+                os.fsync(out.fileno())
+
+        prompts: Dict[str, str] = {}
+        in_flight = set()
+
+        def drain(block_until: int) -> None:
+            while len(in_flight) > block_until:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    in_flight.discard(fut)
+                    key, response, elapsed = fut.result()
+                    if not response.startswith("❌"):
+                        responses[key] = response
+                    stats["generated"] += 1
+                    prompt = prompts.pop(key, "")
+                    for item_id in waiting.pop(key, []):
+                        write(item_id, key, prompt, response, elapsed)
+                elapsed_total = time.time() - start
+                print(f"\r   {stats['written']} written • {stats['generated'] / elapsed_total if elapsed_total > 0 else 0:.2f} prompts/s", end="", flush=True)
+
+        for item_id, prompt, max_tokens in _iter_batch_items(in_path, preset, presets):
+            if item_id in done_ids:
+                continue
+            key = _batch_item_key(prompt, max_tokens)
+            if key in responses:
+                write(item_id, key, prompt, responses[key], 0.0)
+                stats["deduplicated"] += 1
+                continue
+            if key in waiting:
+                waiting[key].append(item_id)
+                stats["deduplicated"] += 1
+                continue
+            waiting[key] = [item_id]
+            prompts[key] = prompt
+            in_flight.add(pool.submit(_batch_worker_generate, key, prompt, max_tokens))
+            # Bounded look-ahead keeps memory flat on huge input files
+            drain(block_until=workers * 2)
+        drain(block_until=0)
+        os.fsync(out.fileno())
+    print()
+    return stats
+
+class SchedulerRejected(Exception):
+    """Raised when the scheduler refuses a request (quota exhausted or queue too long)."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class FairScheduler:
+    """Fair-share request scheduler in front of a single shared model.
+
+    Interactive requests always run before batch ones. Within a priority class,
+    clients are served by start-time fair queuing on token cost, so one
+    client's long essay cannot starve everyone else's one-line fixes. Each
+    client has a token-bucket quota, and new work is rejected once the
+    predicted queue delay (queued tokens / measured throughput) passes a limit.
+    """
+
+    PRIORITIES = ("interactive", "batch")
+    WAIT_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+    def __init__(self, quota_tokens_per_min: int = 20000, max_queue_delay_s: float = 120.0,
+                 initial_tokens_per_s: float = 8.0):
+        self.quota_rate = quota_tokens_per_min / 60.0
+        self.quota_burst = float(quota_tokens_per_min)
+        self.max_queue_delay_s = max_queue_delay_s
+        self.tokens_per_s = initial_tokens_per_s  # EWMA of measured throughput
+        self._heaps: Dict[str, list] = {p: [] for p in self.PRIORITIES}
+        self._vtime: Dict[str, float] = {p: 0.0 for p in self.PRIORITIES}
+        self._finish: Dict[tuple, float] = {}
+        self._buckets: Dict[str, List[float]] = {}  # client -> [tokens, last refill time]
+        self._queued_tokens: Dict[str, int] = {p: 0 for p in self.PRIORITIES}
+        self._wait_hist: Dict[str, List[int]] = {p: [0] * len(self.WAIT_BUCKETS) for p in self.PRIORITIES}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.rejected = {"quota": 0, "delay": 0}
+
+    def submit(self, client_id: str, item: Any, cost_tokens: int, priority: str = "interactive") -> Dict[str, Any]:
+        """Queue item for client_id; returns its ticket or raises SchedulerRejected."""
+        if priority not in self._heaps:
+            priority = "interactive"
+        cost = max(1, int(cost_tokens))
+        with self._cond:
+            bucket = self._refill(client_id)
+            if bucket[0] < cost:
+                self.rejected["quota"] += 1
+                raise SchedulerRejected(f"Token quota exceeded for client {client_id}",
+                                        retry_after=(cost - bucket[0]) / self.quota_rate)
+            delay = self.predicted_delay(priority) + cost / self.tokens_per_s
+            if delay > self.max_queue_delay_s:
+                self.rejected["delay"] += 1
+                raise SchedulerRejected(f"Server busy: predicted wait {delay:.0f}s",
+                                        retry_after=delay - self.max_queue_delay_s)
+            bucket[0] -= cost
+            start = max(self._vtime[priority], self._finish.get((priority, client_id), 0.0))
+            self._finish[(priority, client_id)] = start + cost
+            ticket = {"client": client_id, "item": item, "cost": cost, "priority": priority,
+                      "start": start, "queued_at": time.time()}
+            heapq.heappush(self._heaps[priority], (start, next(self._seq), ticket))
+            self._queued_tokens[priority] += cost
+            self._cond.notify()
+            return ticket
+
+    def next(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a ticket is runnable; returns None once closed (or on timeout)."""
+        with self._cond:
+            while True:
+                for priority in self.PRIORITIES:
+                    heap = self._heaps[priority]
+                    if heap:
+                        start, _, ticket = heapq.heappop(heap)
+                        self._vtime[priority] = max(self._vtime[priority], start)
+                        self._queued_tokens[priority] -= ticket["cost"]
+                        self._record_wait(priority, time.time() - ticket["queued_at"])
+                        if not heap:
+                            self._prune_finish(priority)
+                        return ticket
+                if self._closed or not self._cond.wait(timeout):
+                    return None
+
+    def _prune_finish(self, priority: str) -> None:
+        """Forget finish tags the virtual clock has passed; they no longer delay anyone."""
+        vtime = self._vtime[priority]
+        for key in [k for k, finish in self._finish.items() if k[0] == priority and finish <= vtime]:
+            del self._finish[key]
+
+    def complete(self, ticket: Dict[str, Any], used_tokens: int, elapsed_s: float) -> None:
+        """Refund unused quota and update the throughput estimate."""
+        with self._cond:
+            bucket = self._refill(ticket["client"])
+            bucket[0] = min(self.quota_burst, bucket[0] + max(0, ticket["cost"] - int(used_tokens)))
+            if used_tokens > 0 and elapsed_s > 0:
+                self.tokens_per_s = 0.8 * self.tokens_per_s + 0.2 * (used_tokens / elapsed_s)
+            priority = ticket["priority"]
+            if not self._heaps[priority]:
+                # Busy period over: the clock catches up with the last finish tag
+                tags = [f for k, f in self._finish.items() if k[0] == priority]
+                self._vtime[priority] = max([self._vtime[priority]] + tags)
+                self._prune_finish(priority)
+
+    def predicted_delay(self, priority: str = "interactive") -> float:
+        """Seconds of queued work that would run before a new request of this priority."""
+        ahead = 0
+        for p in self.PRIORITIES:
+            ahead += self._queued_tokens[p]
+            if p == priority:
+                break
+        return ahead / max(self.tokens_per_s, 1e-6)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            labels = [f"le_{b:g}" if b != float("inf") else "le_inf" for b in self.WAIT_BUCKETS]
+            return {
+                "queue_depth": {p: len(h) for p, h in self._heaps.items()},
+                "queued_tokens": dict(self._queued_tokens),
+                "wait_seconds_histogram": {p: dict(zip(labels, counts)) for p, counts in self._wait_hist.items()},
+                "tokens_per_s": round(self.tokens_per_s, 2),
+                "rejected": dict(self.rejected),
+            }
+
+    def _refill(self, client_id: str) -> List[float]:
+        now = time.time()
+        bucket = self._buckets.setdefault(client_id, [self.quota_burst, now])
+        bucket[0] = min(self.quota_burst, bucket[0] + (now - bucket[1]) * self.quota_rate)
+        bucket[1] = now
+        return bucket
+
+    def _record_wait(self, priority: str, waited: float) -> None:
+        for i, bound in enumerate(self.WAIT_BUCKETS):
+            if waited <= bound:
+                self._wait_hist[priority][i] += 1
+                return
+
+# Texts the generate_*_stream methods yield instead of raising
+_STREAM_ERRORS = ("❌ Generation error:", "❌ Model not loaded")
+
+class _InferenceJob:
+    """One server request travelling from the event loop to the inference thread."""
+
+    def __init__(self, kind: str, prompt: str, max_tokens: int, temperature: float, top_p: float,
+                 emit: Callable[[Optional[str]], None]):
+        self.kind = kind  # "chat" (formatted transcript) or "completion" (plain prompt)
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.emit = emit  # called with each chunk, then with None when finished
+        self.cancel = CancellationToken()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.error: Optional[str] = None
+
+class VerdantServer:
+    """Local OpenAI-compatible HTTP server (/v1/completions, /v1/chat/completions).
+
+    Runs on an asyncio event loop with a single resident AIInference. Requests
+    pass through a FairScheduler onto one inference thread; generated chunks are
+    handed back to the loop with call_soon_threadsafe, so slow generations never
+    block other connections. Streaming responses use Server-Sent Events.
+    Clients that exceed their quota or arrive at a full queue get HTTP 429.
+    """
+
+    def __init__(self, ai: AIInference, host: str = "127.0.0.1", port: int = 8000, model_name: str = "verdant",
+                 scheduler: Optional[FairScheduler] = None):
+        self.ai = ai
+        self.host = host
+        self.port = port
+        self.model_name = model_name
+        self.scheduler = scheduler or FairScheduler()
+        # Shared message-length cache; not sticky, since requests come from many conversations
+        self._packer = ContextPacker()
+        # Prompt packing and token counting tokenize whole chats; one thread keeps them off the event loop
+        # (and serialized, since the packer's cache is shared)
+        from concurrent.futures import ThreadPoolExecutor
+        self._prep = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verdant-prep")
+        self._worker = threading.Thread(target=self._inference_loop, name="verdant-inference", daemon=True)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._worker.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"🌐 Serving OpenAI-compatible API on http://{self.host}:{self.port}/v1")
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.scheduler.close()
+        self._prep.shutdown(wait=False)
+
+    # Inference thread
+    def _inference_loop(self) -> None:
+        while True:
+            ticket = self.scheduler.next()
+            if ticket is None:
+                return
+            job = ticket["item"]
+            if job.cancel.cancelled:
+                self.scheduler.complete(ticket, 0, 0.0)
+                job.emit(None)
+                continue
+            parts, stream = [], None
+            started = time.time()
+            try:
+                self.ai.temperature, self.ai.top_p = job.temperature, job.top_p
+                if job.kind == "chat":
+                    stream = self.ai.generate_chat_stream(job.prompt, max_tokens=job.max_tokens, cancel=job.cancel)
+                else:
+                    stream = self.ai.generate_response_stream(job.prompt, max_tokens=job.max_tokens, cancel=job.cancel)
+                for chunk in stream:
+                    if chunk.startswith(_STREAM_ERRORS):
+                        raise RuntimeError(chunk[1:].strip())
+                    parts.append(chunk)
+                    job.emit(chunk)
+                job.prompt_tokens = count_tokens(job.prompt, self.ai, special=True)
+                job.completion_tokens = count_tokens("".join(parts), self.ai)
+            except Exception as e:
+                job.error = str(e)
+            finally:
+                # Release the model lock now, not whenever the abandoned generator is collected
+                if stream is not None:
+                    stream.close()
+                self.scheduler.complete(ticket, job.prompt_tokens + job.completion_tokens, time.time() - started)
+                job.emit(None)
+
+    def _submit(self, job_args: Dict[str, Any], cost: int, client_id: str = "anonymous",
+                priority: str = "interactive") -> tuple:
+        """Schedule a job costing `cost` tokens; returns (job, asyncio.Queue receiving its chunks and a final None).
+
+        Raises SchedulerRejected when the client's quota or the queue is exhausted.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+        def emit(chunk: Optional[str]) -> None:
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            except RuntimeError:
+                pass  # event loop already closed
+
+        job = _InferenceJob(emit=emit, **job_args)
+        self.scheduler.submit(client_id, job, cost, priority)
+        return job, chunks
+
+    # HTTP handling
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = (lines[0].split(" ", 2) + ["", ""])[:3]
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            body = b""
+            length = int(headers.get("content-length") or 0)
+            if length:
+                body = await reader.readexactly(length)
+            path = path.split("?", 1)[0]
+            if method == "GET" and path in ("/health", "/v1/health"):
+                await self._send_json(writer, 200, {"status": "ok", "scheduler": self.scheduler.stats()})
+            elif method == "GET" and path == "/v1/models":
+                await self._send_json(writer, 200, {"object": "list", "data": [
+                    {"id": self.model_name, "object": "model", "owned_by": "verdant"}]})
+            elif method == "POST" and path in ("/v1/completions", "/v1/chat/completions"):
+                try:
+                    payload = json.loads(body or b"{}")
+                    if not isinstance(payload, dict):
+                        raise ValueError("request body must be a JSON object")
+                    job_args, cost = await asyncio.get_running_loop().run_in_executor(
+                        self._prep, self._prepare, path, payload)
+                except (ValueError, TypeError, KeyError) as e:
+                    await self._send_json(writer, 400, {"error": {"message": str(e), "type": "invalid_request_error"}})
+                    return
+                client_id = self._client_id(headers, writer)
+                priority = str(headers.get("x-priority") or payload.get("priority") or "interactive")
+                try:
+                    job, chunks = self._submit(job_args, cost, client_id, priority)
+                except SchedulerRejected as e:
+                    await self._send_json(writer, 429, {"error": {"message": str(e), "type": "rate_limit_error"}},
+                                          extra_headers={"Retry-After": str(max(1, int(e.retry_after + 0.5)))})
+                    return
+                if payload.get("stream"):
+                    await self._stream(writer, job, chunks)
+                else:
+                    await self._complete(reader, writer, job, chunks)
+            else:
+                await self._send_json(writer, 404, {"error": {"message": f"No route for {method} {path}", "type": "not_found"}})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _client_id(headers: Dict[str, str], writer: asyncio.StreamWriter) -> str:
+        """Fair-share identity: API key, explicit client header, or peer address."""
+        auth = headers.get("authorization", "")
+        if auth.lower().startswith("bearer ") and auth[7:].strip():
+            return "key:" + hashlib.sha256(auth[7:].strip().encode()).hexdigest()[:12]
+        if headers.get("x-client-id"):
+            return "id:" + headers["x-client-id"][:64]
+        peer = writer.get_extra_info("peername")
+        return "ip:" + (str(peer[0]) if peer else "unknown")
+
+    def _prepare(self, path: str, payload: Dict[str, Any]) -> tuple:
+        """(job arguments, scheduler cost in tokens) for a request; runs on the prep thread."""
+        args = self._job_args(path, payload)
+        return args, count_tokens(args["prompt"], self.ai, special=True) + args["max_tokens"]
+
+    def _job_args(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        args = {
+            "max_tokens": int(payload.get("max_tokens") or 512),
+            "temperature": float(payload.get("temperature", self.ai.temperature)),
+            "top_p": float(payload.get("top_p", self.ai.top_p)),
+        }
+        if path.endswith("/chat/completions"):
+            messages = payload["messages"]
+            if not isinstance(messages, list) or not messages:
+                raise ValueError("messages must be a non-empty list")
+            system = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+            history = [{"role": m.get("role"), "content": str(m.get("content", ""))}
+                       for m in messages if m.get("role") in ("user", "assistant")]
+            prompt = self.ai.pack_chat(history, self._packer, args["max_tokens"], sticky=False,
+                                       system_prompt=system or SYSTEM_PROMPT)
+            args.update(kind="chat", prompt=prompt)
+        else:
+            prompt = payload["prompt"]
+            if isinstance(prompt, list):
+                prompt = "".join(str(p) for p in prompt)
+            args.update(kind="completion", prompt=str(prompt))
+        return args
+
+    def _envelope(self, job: _InferenceJob, rid: str, created: int) -> Dict[str, Any]:
+        chat = job.kind == "chat"
+        return {"id": rid, "object": "chat.completion.chunk" if chat else "text_completion",
+                "created": created, "model": self.model_name}
+
+    @staticmethod
+    def _finish_reason(job: _InferenceJob) -> str:
+        return "length" if job.completion_tokens >= job.max_tokens else "stop"
+
+    async def _complete(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, job: _InferenceJob,
+                        chunks: "asyncio.Queue") -> None:
+        parts = []
+        # Nothing is written before the reply is complete, so watch the socket for the client hanging up
+        hangup = asyncio.ensure_future(reader.read(1))
+        try:
+            while True:
+                get = asyncio.ensure_future(chunks.get())
+                await asyncio.wait({get, hangup}, return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    if hangup.exception() is not None or not hangup.result():
+                        raise ConnectionResetError("client disconnected")
+                    hangup = asyncio.ensure_future(reader.read(1))  # stray bytes, keep waiting
+                    continue
+                chunk = get.result()
+                if chunk is None:
+                    break
+                parts.append(chunk)
+        except (ConnectionError, asyncio.CancelledError):
+            # Stop generating for nobody after the current token
+            job.cancel.cancel()
+            raise
+        finally:
+            hangup.cancel()
+        if job.error:
+            await self._send_json(writer, 500, {"error": {"message": job.error, "type": "server_error"}})
+            return
+        text = "".join(parts).strip()
+        created = int(time.time())
+        usage = {"prompt_tokens": job.prompt_tokens, "completion_tokens": job.completion_tokens,
+                 "total_tokens": job.prompt_tokens + job.completion_tokens}
+        if job.kind == "chat":
+            body = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": created,
+                    "model": self.model_name, "usage": usage, "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": text},
+                         "finish_reason": self._finish_reason(job)}]}
+        else:
+            body = {"id": f"cmpl-{uuid.uuid4().hex[:24]}", "object": "text_completion", "created": created,
+                    "model": self.model_name, "usage": usage, "choices": [
+                        {"index": 0, "text": text, "logprobs": None, "finish_reason": self._finish_reason(job)}]}
+        await self._send_json(writer, 200, body)
 
+    async def _stream(self, writer: asyncio.StreamWriter, job: _InferenceJob, chunks: "asyncio.Queue") -> None:
+        chat = job.kind == "chat"
+        rid = f"{'chatcmpl' if chat else 'cmpl'}-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+
+        async def event(choice: Dict[str, Any]) -> None:
+            data = dict(self._envelope(job, rid, created), choices=[dict(index=0, **choice)])
+            writer.write(b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            await writer.drain()
+
+        try:
+            if chat:
+                await event({"delta": {"role": "assistant"}, "finish_reason": None})
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                await event({"delta": {"content": chunk}, "finish_reason": None} if chat
+                            else {"text": chunk, "logprobs": None, "finish_reason": None})
+            if job.error:
+                error = {"error": {"message": job.error, "type": "server_error"}}
+                writer.write(b"data: " + json.dumps(error, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            else:
+                reason = self._finish_reason(job)
+                await event({"delta": {}, "finish_reason": reason} if chat
+                            else {"text": "", "logprobs": None, "finish_reason": reason})
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away: stop generating for it after the current token
+            job.cancel.cancel()
+            raise
+
+    @staticmethod
+    async def _send_json(writer: asyncio.StreamWriter, status: int, body: Dict[str, Any],
+                         extra_headers: Optional[Dict[str, str]] = None) -> None:
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+                  500: "Internal Server Error", 503: "Service Unavailable"}.get(status, "OK")
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        extra = "".join(f"{k}: {v}\r\n" for k, v in (extra_headers or {}).items())
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n{extra}"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+def run_server(ai: AIInference, host: str = "127.0.0.1", port: int = 8000, model_name: str = "verdant",
+               scheduler: Optional[FairScheduler] = None) -> None:
+    """Serve the loaded model until interrupted."""
+    server = VerdantServer(ai, host=host, port=port, model_name=model_name, scheduler=scheduler)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\n👋 Server stopped")
 
 def main():
     """CLI entry point."""
@@ -613,6 +4990,21 @@ def main():
     parser.add_argument("--top_p", type=float, help="Top-p nucleus sampling (default from prefs)")
     parser.add_argument("--gpu", action="store_true", help="Enable GPU acceleration (Premium)")
     parser.add_argument("--gpu-layers", type=int, help="Number of layers to offload to GPU (if supported)")
+    parser.add_argument("--speculative", action="store_true", help="Speed up decoding with a small draft model (if downloaded)")
+    parser.add_argument("--seed", type=int, help="Sampling seed (part of the response cache key)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--semantic-cache", action="store_true", help="Also answer near-duplicate prompts from the cache (needs the embedding model)")
+    parser.add_argument("--semantic-threshold", type=float, default=0.92, help="Minimum cosine similarity for a semantic cache hit")
+    parser.add_argument("--cache-replay-rate", type=float, default=400.0, help="Replay cached replies at this many chars/s (0 = instant)")
+    parser.add_argument("--no-mmap", action="store_true", help="Read the whole model into RAM instead of memory-mapping it")
+    parser.add_argument("--mlock", action="store_true", help="Lock the model in RAM (default: automatic, when RAM allows)")
+    parser.add_argument("--load-stats", action="store_true", help="Show recorded cold vs warm model load times and exit")
+    parser.add_argument("--hardware", action="store_true", help="Re-detect and show the hardware profile, then exit")
+    parser.add_argument("--verify", action="store_true", help="Check the model chunk by chunk and re-download only corrupted chunks")
+    parser.add_argument("--numa-node", type=int, help="Pin the model's threads and memory to this NUMA node while it loads and generates "
+                             "(Linux, multi-socket; the rest of the process is not pinned)")
+    parser.add_argument("--numa-benchmark", action="store_true", help="Compare decode speed pinned to --numa-node (default 0) vs unpinned")
+    parser.add_argument("--no-numa", action="store_true", help="Do not spread --batch workers over NUMA nodes")
 
     # Presets
     parser.add_argument("--preset", type=str, help="Use a prompt preset by name (presets.json)")
@@ -630,6 +5022,19 @@ def main():
     # Benchmark
     parser.add_argument("--benchmark", action="store_true", help="Run a simple generation benchmark and exit")
     parser.add_argument("--benchmark-runs", type=int, default=1, help="Number of benchmark runs")
+    parser.add_argument("--autotune", action="store_true", help="Find the fastest threads/batch size for this machine and model, then save them")
+
+    # Batch
+    parser.add_argument("--batch", type=str, help="Process prompts from a JSONL file (resumable)")
+    parser.add_argument("--out", type=str, help="NDJSON output file for --batch (default: <input>.out.jsonl)")
+    parser.add_argument("--workers", type=int, help="Worker processes for --batch (default: auto)")
+
+    # Server
+    parser.add_argument("--serve", action="store_true", help="Run a local OpenAI-compatible HTTP server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host for --serve (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port for --serve (default: 8000)")
+    parser.add_argument("--client-quota", type=int, default=20000, help="Per-client token quota per minute for --serve")
+    parser.add_argument("--max-queue-delay", type=float, default=120.0, help="Reject requests predicted to wait longer (seconds)")
 
     args = parser.parse_args()
 
@@ -645,6 +5050,8 @@ def main():
     context = args.context if args.context is not None else prefs.get("context")
     temperature = args.temperature if args.temperature is not None else prefs.get("temperature", 0.7)
     top_p = args.top_p if args.top_p is not None else prefs.get("top_p", 0.9)
+    use_mmap = False if args.no_mmap else prefs.get("use_mmap")
+    use_mlock = True if args.mlock else prefs.get("use_mlock")
 
     # Enforce demo constraints
     if context and context > caps["max_context"]:
@@ -661,6 +5068,8 @@ def main():
             "temperature": temperature,
             "top_p": top_p,
             "gpu_layers": args.gpu_layers,
+            "use_mmap": use_mmap,
+            "use_mlock": use_mlock,
         }
         UserPreferences.save(new_prefs, prefs_path)
         print(f"💾 Preferences saved to {prefs_path or PREFERENCES_FILE}")
@@ -690,6 +5099,38 @@ def main():
         print("   python verdant.py --interactive")
         return
 
+    if args.hardware:
+        profile = HardwareDetector.profile(refresh=True)
+        caches = ", ".join(f"{k.upper()} {v} KB" for k, v in profile["cache_kb"].items()) or "unknown"
+        disk = HardwareDetector.disk_speed()
+        recommended = HardwareDetector.recommended_settings()
+        print(f"💻 {profile['cpu_model']} ({profile['platform']} {profile['arch']})")
+        print(f"   Cores: {profile['physical_cores']} physical / {profile['logical_cores']} logical")
+        print(f"   SIMD: {', '.join(profile['simd']) or 'none detected'}")
+        print(f"   Caches: {caches}")
+        print(f"   RAM: {profile['memory_gb']:.1f}GB total, {ModelPool._free_ram_gb():.1f}GB free")
+        print(f"   Disk: write {disk['write'] or '?'} MB/s, read {disk['read'] or '?'} MB/s")
+        print(f"   Defaults: {recommended['n_threads']} threads, context {recommended['n_ctx']}")
+        for node in HardwareDetector.numa_nodes():
+            cpus = node["cpus"]
+            print(f"   NUMA node {node['node']}: {len(cpus)} CPUs ({cpus[0]}-{cpus[-1]}), {node['memory_gb']}GB")
+        return
+
+    if args.verify:
+        ModelDownloader().repair_model(model_key)
+        return
+
+    if args.load_stats:
+        records = LOAD_TIMES.records()
+        if not records:
+            print("(no model loads recorded yet)")
+        for name in sorted({r["model"] for r in records}):
+            stats = LOAD_TIMES.summary(Path(name))
+            cold = f"{stats['cold_s']:.1f}s" if stats["cold_s"] is not None else "n/a"
+            warm = f"{stats['warm_s']:.1f}s" if stats["warm_s"] is not None else "n/a"
+            print(f"⏱️  {name}: {stats['loads']} load(s), median cold {cold}, warm {warm}")
+        return
+
     # List presets if requested
     if args.list_presets:
         presets = PresetsManager.load_presets()
@@ -702,13 +5143,61 @@ def main():
         return
 
     # Ensure model is available if any action requires it
-    if args.interactive or args.prompt or args.benchmark:
+    if (args.interactive or args.prompt or args.benchmark or args.batch or args.serve or args.autotune
+            or args.numa_benchmark):
         downloader = ModelDownloader()
         model_path = downloader.get_model_path(model_key)
         if not model_path:
             print(f"❌ Model not found. Please run setup first:")
             print(f"   python verdant.py --setup --model {model_key}")
             return
+        # Pull the weights into the page cache while llama_cpp is still importing
+        PREFETCHER.start(model_path)
+
+        if args.numa_benchmark:
+            node = args.numa_node if args.numa_node is not None else 0
+            print(f"🧭 NUMA benchmark on node {node}…")
+            try:
+                result = benchmark_numa(model_path, node=node, runs=args.benchmark_runs, n_ctx=context)
+                print(f"📊 {result['threads']} threads: unpinned {result['unpinned_tps']:.1f} tok/s, "
+                      f"pinned {result['pinned_tps']:.1f} tok/s (×{result['speedup'] or 0:.2f})")
+            except Exception as e:
+                print(f"❌ NUMA benchmark failed: {e}")
+            return
+
+        if args.autotune:
+            print(f"🎛️  Autotuning {model_path.name} on {HardwareDetector.cpu_model()}…")
+            try:
+                tuned = autotune(model_path, n_ctx=min(1024, context or 1024))
+                print(f"✅ Best: {tuned['n_threads']} threads ({tuned['n_threads_batch']} for prompts), "
+                      f"batch {tuned['n_batch']} → {tuned['decode_tps']:.1f} tok/s decode, "
+                      f"{tuned['prefill_tps']:.1f} tok/s prefill ({tuned['runs']} runs). Saved to preferences.")
+            except ImportError:
+                print("❌ llama-cpp-python not installed. Run: pip install llama-cpp-python")
+            except Exception as e:
+                print(f"❌ Autotune failed: {e}")
+            return
+
+        # Batch mode (workers load their own model instances)
+        if args.batch:
+            in_path = Path(args.batch)
+            out_path = Path(args.out) if args.out else in_path.with_suffix(".out.jsonl")
+            print(f"📦 Batch: {in_path} → {out_path}")
+            try:
+                stats = run_batch_job(model_path, in_path, out_path, workers=args.workers, n_ctx=context,
+                                      n_threads=threads, temperature=temperature, top_p=top_p, preset=args.preset,
+                                      numa=not args.no_numa)
+                print(f"✅ Batch complete: {stats['written']} written, {stats['generated']} generated, "
+                      f"{stats['deduplicated']} deduplicated, {stats['skipped']} already done")
+            except Exception as e:
+                print(f"❌ Batch failed: {e}")
+            return
+
+        semantic_cache = None
+        if args.semantic_cache and not args.no_cache:
+            semantic_cache = get_semantic_cache(threshold=args.semantic_threshold)
+            if semantic_cache is None:
+                print("ℹ️  Semantic cache needs the embedding model: python verdant.py --setup --model nomic-embed-text-q4")
 
         try:
             # Load AI model (GPU toggle gated; this build uses CPU-only llama.cpp)
@@ -716,13 +5205,23 @@ def main():
             if args.gpu:
                 want_layers = args.gpu_layers if args.gpu_layers is not None else (20 if HardwareDetector.get_performance_tier() == "high" else 10)
                 n_gpu_layers = max(0, int(want_layers))
-            ai = AIInference(model_path, n_ctx=context, n_threads=threads, temperature=temperature, top_p=top_p, n_gpu_layers_override=n_gpu_layers)
+            ai = AIInference(model_path, n_ctx=context, n_threads=threads, temperature=temperature, top_p=top_p,
+                             n_gpu_layers_override=n_gpu_layers, speculative=args.speculative, seed=args.seed,
+                             use_cache=not args.no_cache, cache_replay_rate=args.cache_replay_rate,
+                             semantic_cache=semantic_cache, use_mmap=use_mmap, use_mlock=use_mlock,
+                             numa_node=args.numa_node)
         except Exception as e:
             print(f"❌ Failed to initialize model: {e}")
             print("Please ensure llama-cpp-python is installed:")
             print("   pip install llama-cpp-python")
             return
 
+        # Server mode
+        if args.serve:
+            scheduler = FairScheduler(quota_tokens_per_min=args.client_quota, max_queue_delay_s=args.max_queue_delay)
+            run_server(ai, host=args.host, port=args.port, model_name=model_key, scheduler=scheduler)
+            return
+
         # Benchmark mode
         if args.benchmark:
             print("🚀 Running benchmark...")
@@ -738,6 +5237,8 @@ def main():
                 try:
                     chat.load_history(Path(args.load_session))
                     print(f"📥 Loaded session from {args.load_session}")
+                    if chat.ai.restore_session_state(chat.session_id):
+                        print("⚡ Restored cached KV state for this session")
                 except Exception as e:
                     print(f"⚠️  Failed to load session: {e}")
             
@@ -766,8 +5267,11 @@ def main():
 
             print("💬 Processing prompt...")
             try:
-                response = ai.generate_response(final_prompt)
+                with cancel_on_sigint(CancellationToken()) as cancel:
+                    response = ai.generate_response(final_prompt, semantic_prompt=args.prompt, cancel=cancel)
                 print(f"\n🤖 Verdant: {response}")
+                if cancel.cancelled:
+                    print("⏹  Stopped by user")
             except Exception as e:
                 print(f"❌ Failed to process prompt: {e}")
                 print("Please ensure llama-cpp-python is installed:")
@@ -10,6 +10,7 @@ import platform
 import ctypes
 from pathlib import Path
 import json
+import uuid
 
 # Use ttkbootstrap for modern theming
 import ttkbootstrap as tb
@@ -20,6 +21,15 @@ from verdant import (
     ModelDownloader,
     HardwareDetector,
     AIInference,
+    CancellationToken,
+    ContextPacker,
+    ModelLifecycle,
+    PREFETCHER,
+    ModelIntegrity,
+    RollingSummarizer,
+    cache_meter_stats,
+    count_tokens,
+    get_semantic_cache,
     get_capabilities,
 )
 from verdant import PresetsManager, run_benchmark
@@ -64,9 +74,15 @@ class VerdantGUI:
         self._bubble_items = {}
         self._auto_scroll = True
         self._stop_requested = False
+        self._cancel_token = None  # CancellationToken of the running generation
+        self._packer = ContextPacker()  # fits history into the context window
+        self._summarizer = RollingSummarizer(self._packer)  # folds dropped turns into packer.memory
         self._last_user_prompt = ""
+        self._last_raw_prompt = ""  # as typed, without preset text (semantic cache query)
+        self._last_semantic_hit = None
         self._is_regen = False
         self.chat_history = []  # list of {role: 'user'|'assistant', content: str}
+        self.session_id = uuid.uuid4().hex  # keys this chat's cached KV state
         # New state
         self._active_preset = None
         cap_ctx = self.caps.get("max_context", 2048)
@@ -79,18 +95,48 @@ class VerdantGUI:
         self.top_p_var = tk.DoubleVar(value=self._as_float(self.prefs.get("top_p", 0.9), 0.9))
         self.ctx_var = tk.IntVar(value=self._as_int(self.prefs.get("context"), cap_ctx))
         self.instant_demo_var = tk.BooleanVar(value=bool(self.prefs.get("instant_demo", True)))
+        self.speculative_var = tk.BooleanVar(value=bool(self.prefs.get("speculative", False)))
+        self.response_cache_var = tk.BooleanVar(value=bool(self.prefs.get("response_cache", True)))
+        self.semantic_cache_var = tk.BooleanVar(value=bool(self.prefs.get("semantic_cache", False)))
+        self.idle_unload_var = tk.IntVar(value=self._as_int(self.prefs.get("idle_unload_minutes"), 10))
         self.eco_savings_var = StringVar(value="🌿 0.00 Wh")
-        self._eco_tokens_est = 0
+        self._eco_tokens = 0
         # Download metrics
         self._dl_last_bytes = 0
         self._dl_last_time = 0.0
         self._dl_total_bytes = 0
 
+        # Start reading the model into the page cache while the window is built
+        try:
+            model_path = ModelDownloader().get_model_path(self.model_key.get() or "mistral-7b-q4")
+            if model_path:
+                PREFETCHER.start(model_path)
+        except Exception:
+            pass
+
         self._set_process_dpi_awareness()
         self._set_app_icon()
         self._set_app_user_model_id()
         self._apply_theme()
         self._build_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        # Load and warm the model before the first Send; unload it again after a quiet spell
+        # The factory and callbacks run on the lifecycle's thread: Tk is only touched via root.after
+        self._preload_settings = self._ai_settings()
+        self._lifecycle = ModelLifecycle(lambda: self._make_ai(self._preload_settings, use_cache=False),
+                                         idle_unload_s=max(0, self.idle_unload_var.get()) * 60,
+                                         on_change=lambda state, message: self.root.after(0, self._set_status, message))
+        self.root.after(500, self._preload_model)
+        # Check the model file against its chunk manifest once it is in the page cache
+        try:
+            model_path = ModelDownloader().get_model_path(self.model_key.get() or "mistral-7b-q4")
+            if model_path:
+                # Report only: the lifecycle preload may already have the file mapped
+                ModelIntegrity.start_health_check(
+                    model_path, repair=False,
+                    on_done=lambda result: self.root.after(0, self._set_status, ModelIntegrity.describe(result)))
+        except Exception:
+            pass
         # Maybe show onboarding on first launch if no model
         try:
             if not ModelDownloader().get_model_path(self.model_key.get() or "mistral-7b-q4") and not self.prefs.get("onboarded", False):
@@ -440,6 +486,7 @@ class VerdantGUI:
         self.input_text.bind("<Control-Return>", self._on_ctrl_enter)
         self.input_text.bind("<Shift-Return>", lambda e: self._insert_newline())
         self.input_text.bind("<KeyRelease>", self._update_char_count)
+        self.input_text.bind("<KeyRelease>", self._on_input_activity, add="+")
         self.input_text.bind("<Up>", self._recall_last_prompt)
         
         # Enhanced send button with better visual hierarchy
@@ -713,6 +760,7 @@ class VerdantGUI:
         # Show context suggestions based on input
         self._show_context_suggestions(prompt)
         
+        raw_prompt = prompt
         # Apply preset if any
         try:
             if self._active_preset:
@@ -727,6 +775,7 @@ class VerdantGUI:
         self._update_char_count()
         self._add_bubble(prompt, sender="user")
         self._last_user_prompt = prompt
+        self._last_raw_prompt = raw_prompt
         self.chat_history.append({"role": "user", "content": prompt})
         self._start_generation(prompt)
 
@@ -797,7 +846,7 @@ class VerdantGUI:
             self.input_text.focus_set()
             
             # Update status with eco savings
-            if self._eco_tokens_est > 0:
+            if self._eco_tokens > 0:
                 self._set_status(f"Response complete! 🌿 Eco-friendly local processing")
             else:
                 self._set_status("Response complete!")
@@ -881,9 +930,18 @@ class VerdantGUI:
             except Exception:
                 pass
         self.chat_bubbles.clear()
+        self.chat_history.clear()
+        self.session_id = uuid.uuid4().hex
+        self._reset_memory()
         self.current_assistant_label = None
         self._add_system_note("New chat started.")
 
+    def _reset_memory(self, memory=None):
+        self._summarizer.preempt()
+        self._packer = ContextPacker()
+        self._packer.memory = memory
+        self._summarizer = RollingSummarizer(self._packer)
+
     def _open_settings(self):
         dlg = tk.Toplevel(self.root)
         dlg.title("Settings - Verdant")
@@ -976,6 +1034,19 @@ class VerdantGUI:
         inst = tb.Checkbutton(opt, text="Enable instant demo (no download)", 
                              variable=self.instant_demo_var, bootstyle=SECONDARY)
         inst.pack(anchor="w")
+        spec = tb.Checkbutton(opt, text="Speculative decoding (uses draft model if downloaded)",
+                             variable=self.speculative_var, bootstyle=SECONDARY)
+        spec.pack(anchor="w", pady=(6, 0))
+        rcache = tb.Checkbutton(opt, text="Reuse cached replies for repeated prompts",
+                               variable=self.response_cache_var, bootstyle=SECONDARY)
+        rcache.pack(anchor="w", pady=(6, 0))
+        scache = tb.Checkbutton(opt, text="Also reuse replies to similar questions (needs embedding model)",
+                               variable=self.semantic_cache_var, bootstyle=SECONDARY)
+        scache.pack(anchor="w", pady=(6, 0))
+        idle_frame = tb.Frame(opt)
+        idle_frame.pack(anchor="w", pady=(6, 0))
+        tb.Label(idle_frame, text="Unload model after idle minutes (0 = never):").pack(side="left")
+        tb.Spinbox(idle_frame, from_=0, to=240, width=5, textvariable=self.idle_unload_var).pack(side="left", padx=(8, 0))
         
         # System Status Tab
         status_frame = tb.Frame(notebook, padding=16)
@@ -986,16 +1057,18 @@ class VerdantGUI:
             info = HardwareDetector.get_system_info()
             tier = HardwareDetector.get_performance_tier()
             caps = get_capabilities()
-            rec_ctx = 4096 if tier == "high" else 2048 if tier == "medium" else 1024
+            rec = HardwareDetector.recommended_settings(ModelDownloader().get_model_path(self.model_key.get() or "mistral-7b-q4"))
+            rec_ctx = rec["n_ctx"]
             if isinstance(caps, dict) and isinstance(caps.get("max_context"), int):
                 rec_ctx = min(rec_ctx, caps["max_context"])
             
             status_text = (
                 f"💻 System Information:\n"
-                f"   • RAM: {int(info['memory_gb'])}GB\n"
-                f"   • CPU Cores: {info['cpu_count']}\n"
+                f"   • RAM: {int(info['memory_gb'])}GB ({info['available_gb']:.1f}GB free)\n"
+                f"   • CPU Cores: {info['physical_cores']} physical / {info['cpu_count']} logical\n"
+                f"   • SIMD: {', '.join(info['simd']) or 'none detected'}\n"
                 f"   • Performance Tier: {tier.title()}\n"
-                f"   • Recommended Context: {rec_ctx}\n\n"
+                f"   • Recommended: context {rec_ctx}, {rec['n_threads']} threads\n\n"
                 f"🔧 Capabilities:\n"
                 f"   • Max Context: {caps.get('max_context', 'Unknown')}\n"
                 f"   • GPU Support: {'Yes' if caps.get('allow_gpu') else 'No'}\n"
@@ -1053,9 +1126,16 @@ class VerdantGUI:
             "top_p": float(self.top_p_var.get()),
             "context": int(self.ctx_var.get()),
             "instant_demo": bool(self.instant_demo_var.get()),
+            "speculative": bool(self.speculative_var.get()),
+            "response_cache": bool(self.response_cache_var.get()),
+            "semantic_cache": bool(self.semantic_cache_var.get()),
+            "idle_unload_minutes": self._as_int(self.idle_unload_var.get(), 10),
+            "use_mmap": self.prefs.get("use_mmap"),
+            "use_mlock": self.prefs.get("use_mlock"),
             "onboarded": True,
         }
         UserPreferences.save(prefs, self.prefs_path)
+        self._lifecycle.idle_unload_s = max(0, prefs["idle_unload_minutes"]) * 60
         self.status_var.set("Preferences saved")
 
     def on_load_prefs(self):
@@ -1070,6 +1150,11 @@ class VerdantGUI:
             cap_ctx = 2048
         self.ctx_var.set(self._as_int(self.prefs.get("context"), cap_ctx))
         self.instant_demo_var.set(bool(self.prefs.get("instant_demo", True)))
+        self.speculative_var.set(bool(self.prefs.get("speculative", False)))
+        self.response_cache_var.set(bool(self.prefs.get("response_cache", True)))
+        self.semantic_cache_var.set(bool(self.prefs.get("semantic_cache", False)))
+        self.idle_unload_var.set(self._as_int(self.prefs.get("idle_unload_minutes"), 10))
+        self._lifecycle.idle_unload_s = max(0, self.idle_unload_var.get()) * 60
         self.status_var.set("Preferences loaded")
 
     def on_setup(self):
@@ -1116,12 +1201,8 @@ class VerdantGUI:
                     response = self._generate_demo_response(prompt)
                     self.root.after(0, lambda: self._on_generation_complete(response))
                 else:
-                    # Use local model
-                    ai = AIInference(mp, n_ctx=int(self.ctx_var.get()))
-                    response = ai.generate(prompt, 
-                                        temperature=float(self.temp_var.get()),
-                                        top_p=float(self.top_p_var.get()))
-                    self.root.after(0, lambda: self._on_generation_complete(response))
+                    # Use local model (streams through the shared model pool); it reads Tk state, so start it there
+                    self.root.after(0, self._run_generate_async, prompt)
                     
             except Exception as e:
                 error_msg = str(e)
@@ -1179,17 +1260,27 @@ class VerdantGUI:
             pass
 
     def _run_generate_async(self, prompt: str):
+        cancel = self._cancel_token = CancellationToken()
+        self._summarizer.preempt()  # the user's reply goes first
+        settings = self._ai_settings()
+        use_cache, use_semantic = bool(self.response_cache_var.get()), bool(self.semantic_cache_var.get())
         def task():
             try:
-                ctx_model = self.model_key.get() or "mistral-7b-q4"
+                ctx_model = settings["model_key"]
                 dl = ModelDownloader()
                 model_path = dl.get_model_path(ctx_model)
                 if not model_path:
                     self._set_status("Model not found — run Setup or enable instant demo")
                     return
-                ai = AIInference(model_path, n_ctx=int(self.ctx_var.get()), n_threads=None, temperature=float(self.temp_var.get()), top_p=float(self.top_p_var.get()))
+                semantic = get_semantic_cache() if use_semantic else None
+                if self._is_regen and self._last_semantic_hit and semantic:
+                    # Regenerating a semantically matched reply means the match was wrong
+                    semantic.report_false_hit(self._last_semantic_hit["id"])
+                ai = self._make_ai(settings, model_path, use_cache=use_cache and not self._is_regen,
+                                   semantic_cache=semantic)
+                self._lifecycle.touch(ai)
                 # Build multi-turn prompt with system instruction and short history
-                full_prompt = self._build_multiturn_prompt()
+                full_prompt = self._build_multiturn_prompt(ai)
                 accum = []
                 def append_chunk(txt: str):
                     if self.current_assistant_label:
@@ -1198,18 +1289,26 @@ class VerdantGUI:
                         self.current_assistant_label.configure(text=current + txt)
                         self._update_bubble_layout_for_label(self.current_assistant_label)
                         self._scroll_to_bottom()
-                for chunk in ai.generate_response_stream(full_prompt):
-                    if self._stop_requested:
-                        break
-                    self.root.after(0, append_chunk, chunk)
+                first_turn = sum(1 for m in self.chat_history if m["role"] == "user") == 1
+                stream = ai.generate_chat_stream(full_prompt, session_id=self.session_id,
+                                                 semantic_prompt=self._last_raw_prompt if first_turn else None,
+                                                 cancel=cancel)
+                try:
+                    for chunk in stream:
+                        if self._stop_requested:
+                            break
+                        self.root.after(0, append_chunk, chunk)
+                finally:
+                    # Releases the model lock right away when stopped early
+                    stream.close()
+                self._last_semantic_hit = ai.last_semantic_hit
                 # On finish, update history (replace last assistant on regen)
                 final_text = "".join(accum)
-                # Update eco meter (very rough estimate: 1 word ~ 1 token, 1e-4 Wh/token saved)
+                # Update eco meter (exact token count from the model's tokenizer, 1e-4 Wh/token saved)
                 try:
-                    tokens_est = max(1, len(final_text.split()))
-                    self._eco_tokens_est += tokens_est
-                    saved_wh = self._eco_tokens_est * 1e-4 * 0.95
-                    self.eco_savings_var.set(f"🌿 {saved_wh:.2f} Wh")
+                    self._eco_tokens += ai.last_usage.get("completion_tokens") or count_tokens(final_text, ai)
+                    saved_wh = self._eco_tokens * 1e-4 * 0.95
+                    self.eco_savings_var.set(f"🌿 {saved_wh:.2f} Wh{self._cache_meter_text()}")
                 except Exception:
                     pass
                 if not self._stop_requested:
@@ -1221,7 +1320,12 @@ class VerdantGUI:
                                 break
                     else:
                         self.chat_history.append({"role": "assistant", "content": final_text})
-                self._set_status("Done")
+                    self._summarizer.schedule(ai, self.chat_history)
+                self._lifecycle.touch(ai)
+                if ai.last_prefix_hit:
+                    self._set_status(f"Done • ♻️ {ai.last_prefix_hit} prompt tokens reused")
+                else:
+                    self._set_status("Done")
             except Exception as e:
                 self._add_system_note(f"❌ Error: {e}")
                 self._set_status("Error")
@@ -1236,6 +1340,26 @@ class VerdantGUI:
                     pass
         threading.Thread(target=task, daemon=True).start()
 
+    def _ai_settings(self) -> dict:
+        """Model settings from the Tk variables; call on the Tk thread and hand the result to workers."""
+        return {"model_key": self.model_key.get() or "mistral-7b-q4", "n_ctx": int(self.ctx_var.get()),
+                "temperature": float(self.temp_var.get()), "top_p": float(self.top_p_var.get()),
+                "speculative": bool(self.speculative_var.get())}
+
+    def _make_ai(self, settings: dict, model_path=None, use_cache: bool = True, semantic_cache=None):
+        # Same settings (and so the same pooled model) for preloading and for Send
+        model_path = model_path or ModelDownloader().get_model_path(settings["model_key"])
+        if not model_path:
+            return None
+        return AIInference(model_path, n_ctx=settings["n_ctx"], n_threads=None, temperature=settings["temperature"], top_p=settings["top_p"],
+                           speculative=settings["speculative"], use_cache=use_cache, semantic_cache=semantic_cache,
+                           use_mmap=self.prefs.get("use_mmap"), use_mlock=self.prefs.get("use_mlock"))
+
+    def _preload_model(self):
+        # Snapshot the settings here, on the Tk thread, for the lifecycle's background load
+        self._preload_settings = self._ai_settings()
+        self._lifecycle.preload()
+
     def _run_demo_generate_async(self, prompt: str):
         def task():
             try:
@@ -1257,9 +1381,9 @@ class VerdantGUI:
                         self._update_bubble_layout_for_label(self.current_assistant_label)
                         self._scroll_to_bottom()
                         import time as _t; _t.sleep(0.2)
-                # Update eco meter modestly
-                self._eco_tokens_est += 80
-                saved_wh = self._eco_tokens_est * 1e-4 * 0.95
+                # Update eco meter (no model loaded, so tokens are estimated)
+                self._eco_tokens += count_tokens("".join(chunks))
+                saved_wh = self._eco_tokens * 1e-4 * 0.95
                 self.eco_savings_var.set(f"🌿 {saved_wh:.2f} Wh")
                 self._set_status("Done (demo)")
             except Exception as e:
@@ -1339,6 +1463,13 @@ class VerdantGUI:
         except Exception:
             return None
 
+    def _cache_meter_text(self) -> str:
+        """Response cache hits/misses for the eco meter (empty until the cache is used)."""
+        stats = cache_meter_stats()
+        if not stats["cached"] and not stats["generated"]:
+            return ""
+        return f" • ♻️ {stats['cached']} cached / {stats['generated']} new"
+
     def _set_status(self, message: str):
         self.status_var.set(message)
         
@@ -1346,6 +1477,13 @@ class VerdantGUI:
         if message not in ["Generating…", "Setting up…", "Ready"]:
             self.root.after(3000, lambda: self.status_var.set("Ready"))
 
+    def _on_input_activity(self, _e=None):
+        # Typing counts as activity and reloads the model if it was unloaded while idle
+        try:
+            self._preload_model()
+        except Exception:
+            pass
+
     def _update_char_count(self, _e=None):
         try:
             text = self.input_text.get("1.0", "end")
@@ -1434,8 +1572,18 @@ class VerdantGUI:
 
     def _on_stop(self):
         self._stop_requested = True
+        if self._cancel_token:
+            self._cancel_token.cancel()
         self._set_status("Stopped")
 
+    def _on_close(self):
+        # Stop decoding before the window goes away so the CPU is released at once
+        self._stop_requested = True
+        if self._cancel_token:
+            self._cancel_token.cancel()
+        self._lifecycle.close()
+        self.root.destroy()
+
     def _on_regenerate(self):
         if not self._last_user_prompt or not self.chat_bubbles:
             return
@@ -1489,29 +1637,16 @@ class VerdantGUI:
         except Exception as e:
             self._set_status("Failed to copy messages")
 
-    def _build_multiturn_prompt(self) -> str:
-        # Construct Mistral Instruct-style multi-turn prompt with minimal history
-        sys_prompt = "You are Verdant, an eco-conscious local AI assistant. Be helpful, concise, and friendly."
-        turns = []
-        # Include up to last 3 user/assistant pairs
-        pair_count = 0
-        for msg in self.chat_history:
-            if msg["role"] == "user":
-                # Start a new pair
-                content = msg["content"]
-                if pair_count == 0:
-                    # First pair includes system prompt
-                    turns.append(f"<s>[INST] <<SYS>>{sys_prompt}<</SYS>> {content} [/INST]")
-                else:
-                    turns.append(f"<s>[INST] {content} [/INST]")
-                pair_count += 1
-            elif msg["role"] == "assistant":
-                turns.append(msg["content"])
-        # If last message is user without assistant yet, ensure the last INST is the live query
-        if self.chat_history and self.chat_history[-1]["role"] == "user":
-            # already captured in turns with [INST], no assistant following yet
+    def _build_multiturn_prompt(self, ai: AIInference) -> str:
+        # Mistral Instruct transcript packed into n_ctx minus the reply budget; the packer
+        # drops the oldest turns in steps so the KV prefix is still reused between messages
+        pinned = None
+        try:
+            if self._active_preset:
+                pinned = PresetsManager.load_presets().get(self._active_preset)
+        except Exception:
             pass
-        return "".join(turns)
+        return ai.pack_chat(self.chat_history, self._packer, pinned=pinned)
 
     def _select_preset(self, preset_name: str):
         """Select a preset and show visual feedback"""
@@ -1670,7 +1805,7 @@ class VerdantGUI:
                 if not mp:
                     self._set_status("Model not found — run Setup")
                     return
-                ai = AIInference(mp, n_ctx=int(self.ctx_var.get()))
+                ai = AIInference(mp, n_ctx=int(self.ctx_var.get()), speculative=bool(self.speculative_var.get()))
                 run_benchmark(ai, runs=1)
                 self._set_status("Benchmark complete")
             except Exception as e:
@@ -1691,7 +1826,7 @@ class VerdantGUI:
             path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json"), ("All Files", "*.*")], title="Save chat as JSON")
             if not path:
                 return
-            data = {"history": self.chat_history, "saved_at": __import__("time").time(), "version": "1.0"}
+            data = {"history": self.chat_history, "session_id": self.session_id, "memory": self._packer.memory, "saved_at": __import__("time").time(), "version": "1.0"}
             Path(path).write_text(json.dumps(data, indent=2), encoding="utf-8")
             self._set_status("Chat saved")
         except Exception as e:
@@ -1705,6 +1840,8 @@ class VerdantGUI:
                 return
             data = json.loads(Path(path).read_text(encoding="utf-8"))
             self.chat_history = data.get("history", [])
+            self.session_id = data.get("session_id") or Path(path).stem
+            self._reset_memory(data.get("memory"))
             # Repaint bubbles from history
             for row, _, _ in list(self.chat_bubbles):
                 try: row.destroy()
@@ -1873,6 +2010,8 @@ class _Tooltip:
                     pass
             self.chat_bubbles.clear()
             self.chat_history.clear()
+            self.session_id = uuid.uuid4().hex
+            self._reset_memory()
             
             # Add system note
             self._add_system_note("Chat history cleared.")
@@ -4,6 +4,7 @@ from __future__ import annotations
 import sys
 import os
 import threading
+import uuid
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
@@ -15,10 +16,24 @@ from verdant import (
 	ModelDownloader,
 	HardwareDetector,
 	AIInference,
+	CancellationToken,
+	cache_meter_stats,
+	count_tokens,
+	get_semantic_cache,
 	PresetsManager,
+	ContextPacker,
+	ModelLifecycle,
+	PREFETCHER,
+	ModelIntegrity,
+	RollingSummarizer,
 	get_capabilities,
 )
 
+try:
+	import markdown as _md
+except Exception:
+	_md = None
+
 APP_TITLE = "Verdant"
 
 BRAND = "#1DB954"
@@ -39,13 +54,18 @@ class StreamWorker(QtCore.QObject):
 	finished = QtCore.Signal()
 	error = QtCore.Signal(str)
 
-	def __init__(self, ai: Optional[AIInference], prompt: str, is_demo: bool, parent=None):
+	def __init__(self, ai: Optional[AIInference], prompt: str, is_demo: bool, parent=None, transcript: Optional[str] = None,
+				 session_id: Optional[str] = None, semantic_prompt: Optional[str] = None):
 		super().__init__(parent)
 		self.ai = ai
 		self.prompt = prompt
+		self.transcript = transcript
+		self.session_id = session_id
+		self.semantic_prompt = semantic_prompt
 		self.is_demo = is_demo
 		self._stop = False
-		self._token_est = 0
+		self.cancel = CancellationToken()  # stops llama within one decode step
+		self.tokens = 0  # exact with a loaded model, estimated in demo mode
 		self._max_tokens = 256
 
 	@QtCore.Slot()
@@ -53,26 +73,38 @@ class StreamWorker(QtCore.QObject):
 		try:
 			if self.is_demo or self.ai is None:
 				text = self._demo_response(self.prompt)
+				sent = []
 				for part in self._chunkify(text):
 					if self._stop: break
-					self._incr_tokens(part)
+					sent.append(part)
 					self.chunk.emit(part)
 					QtCore.QThread.msleep(60)
+				self.tokens = count_tokens("".join(sent))
 			else:
-				for ch in self.ai.generate_response_stream(self.prompt):
-					if self._stop: break
-					self._incr_tokens(ch)
-					self.chunk.emit(ch)
-					if self._token_est >= self._max_tokens: break
+				if self.transcript:
+					stream = self.ai.generate_chat_stream(self.transcript, max_tokens=self._max_tokens, session_id=self.session_id,
+														  semantic_prompt=self.semantic_prompt, cancel=self.cancel)
+				else:
+					stream = self.ai.generate_response_stream(self.prompt, max_tokens=self._max_tokens,
+															  semantic_prompt=self.semantic_prompt, cancel=self.cancel)
+				# llama enforces max_tokens exactly; last_usage holds the tokenizer's count
+				sent = []
+				try:
+					for ch in stream:
+						if self._stop: break
+						sent.append(ch)
+						self.chunk.emit(ch)
+				finally:
+					# Releases the model lock right away when stopped early
+					stream.close()
+				self.tokens = self.ai.last_usage.get("completion_tokens") or count_tokens("".join(sent), self.ai)
 			self.finished.emit()
 		except Exception as e:
 			self.error.emit(str(e))
 
 	def stop(self):
 		self._stop = True
-
-	def _incr_tokens(self, s: str):
-		self._token_est += max(0, len(s.split()))
+		self.cancel.cancel()
 
 	def _chunkify(self, s: str, n: int = 64):
 		for i in range(0, len(s), n):
@@ -193,10 +225,25 @@ class SettingsDialog(QtWidgets.QDialog):
 		self.gpu_layers.setValue(int(self.prefs.get("gpu_layers") or 0))
 		self.instant_demo = QtWidgets.QCheckBox("Enable instant demo (no download)")
 		self.instant_demo.setChecked(bool(self.prefs.get("instant_demo", True)))
-		for lbl, w in (("Temperature", self.temp), ("Top-p", self.top_p), ("Context", self.ctx), ("GPU layers", self.gpu_layers)):
+		self.speculative = QtWidgets.QCheckBox("Speculative decoding (uses draft model if downloaded)")
+		self.speculative.setChecked(bool(self.prefs.get("speculative", False)))
+		self.response_cache = QtWidgets.QCheckBox("Reuse cached replies for repeated prompts")
+		self.response_cache.setChecked(bool(self.prefs.get("response_cache", True)))
+		self.semantic_cache = QtWidgets.QCheckBox("Also reuse replies to similar questions (needs embedding model)")
+		self.semantic_cache.setChecked(bool(self.prefs.get("semantic_cache", False)))
+		self.idle_unload = QtWidgets.QSpinBox()
+		self.idle_unload.setRange(0, 240)
+		self.idle_unload.setSuffix(" min")
+		self.idle_unload.setSpecialValueText("Never")
+		self.idle_unload.setValue(int(self.prefs.get("idle_unload_minutes", 10) or 0))
+		for lbl, w in (("Temperature", self.temp), ("Top-p", self.top_p), ("Context", self.ctx), ("GPU layers", self.gpu_layers),
+					   ("Unload model when idle", self.idle_unload)):
 			form.addRow(lbl, w)
 		v.addLayout(form)
 		v.addWidget(self.instant_demo)
+		v.addWidget(self.speculative)
+		v.addWidget(self.response_cache)
+		v.addWidget(self.semantic_cache)
 		btns = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Save | QtWidgets.QDialogButtonBox.Cancel)
 		btns.accepted.connect(self.accept)
 		btns.rejected.connect(self.reject)
@@ -209,6 +256,10 @@ class SettingsDialog(QtWidgets.QDialog):
 			"context": int(self.ctx.value()),
 			"gpu_layers": int(self.gpu_layers.value()),
 			"instant_demo": bool(self.instant_demo.isChecked()),
+			"speculative": bool(self.speculative.isChecked()),
+			"response_cache": bool(self.response_cache.isChecked()),
+			"semantic_cache": bool(self.semantic_cache.isChecked()),
+			"idle_unload_minutes": int(self.idle_unload.value()),
 		}
 
 class TemplatesDialog(QtWidgets.QDialog):
@@ -333,6 +384,8 @@ class ModelManagerDialog(QtWidgets.QDialog):
 		QtGui.QDesktopServices.openUrl(QtCore.QUrl.fromLocalFile(str(self.downloader.model_dir)))
 
 class MainWindow(QtWidgets.QMainWindow):
+	lifecycle_changed = QtCore.Signal(str)  # status text from the model lifecycle thread
+
 	def __init__(self):
 		super().__init__()
 		self.setWindowTitle(APP_TITLE)
@@ -345,13 +398,40 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.status = self.statusBar()
 		self.status.setStyleSheet(f"color: {FG};")
 		self.eco_saved_tokens = 0
+		self.chat_history = []  # list of {role: 'user'|'assistant', content: str}
+		self.session_id = uuid.uuid4().hex  # keys this chat's cached KV state
+		self._last_raw_prompt = ""  # as typed, without preset text (semantic cache query)
+		self._packer = ContextPacker()  # fits history into the context window
+		self._summarizer = RollingSummarizer(self._packer)  # folds dropped turns into packer.memory
 		self._worker_thread = None
 		self._worker = None
 		self._toast = None
+		# Start reading the model into the page cache while the window is built
+		try:
+			mp = ModelDownloader().get_model_path(self.model_key)
+			if mp and not self.prefs.get("instant_demo", True):
+				PREFETCHER.start(mp)
+		except Exception:
+			pass
 		# Initialize sessions dir before UI to avoid early access
 		self._init_recent_sessions()
 		self._build_ui()
 		self._maybe_show_onboarding()
+		# Load and warm the model before the first Send; unload it again after a quiet spell
+		self.lifecycle_changed.connect(self.status_label.setText)
+		self._lifecycle = ModelLifecycle(self._make_preload_ai,
+										idle_unload_s=max(0, int(self.prefs.get("idle_unload_minutes", 10) or 0)) * 60,
+										on_change=lambda state, message: self.lifecycle_changed.emit(message))
+		QtCore.QTimer.singleShot(500, self._lifecycle.preload)
+		# Check the model file against its chunk manifest once it is in the page cache
+		try:
+			mp = ModelDownloader().get_model_path(self.model_key)
+			if mp and not self.prefs.get("instant_demo", True):
+				# Report only: the lifecycle preload may already have the file mapped
+				ModelIntegrity.start_health_check(
+					mp, repair=False, on_done=lambda result: self.lifecycle_changed.emit(ModelIntegrity.describe(result)))
+		except Exception:
+			pass
 
 	def _build_ui(self):
 		central = QtWidgets.QWidget(); self.setCentralWidget(central)
@@ -423,6 +503,8 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.input = SendTextEdit(self); self.input.setPlaceholderText("Message Verdant…")
 		self.input.setStyleSheet(f"background: {BG}; color: {FG}; border: 1px solid #1a2228; border-radius: 8px;")
 		self.input.setFixedHeight(80)
+		# Typing counts as activity and reloads the model if it was unloaded while idle
+		self.input.textChanged.connect(lambda: self._lifecycle.preload())
 		row.addWidget(self.input, 1)
 		self.btn_send = QtWidgets.QPushButton("Send"); self.btn_send.clicked.connect(self._on_send)
 		self.btn_send.setStyleSheet(f"QPushButton {{ background: {BRAND}; color: #0b100d; border-radius: 8px; padding: 10px 16px; }} QPushButton:hover {{ filter: brightness(1.05); }}")
@@ -474,6 +556,7 @@ class MainWindow(QtWidgets.QMainWindow):
 			vals = d.values()
 			self.prefs.update(vals)
 			UserPreferences.save(self.prefs, self.prefs_path)
+			self._lifecycle.idle_unload_s = max(0, vals["idle_unload_minutes"]) * 60
 			self.status_label.setText("Preferences saved")
 
 	def _on_bench(self):
@@ -486,7 +569,10 @@ class MainWindow(QtWidgets.QMainWindow):
 				ai = AIInference(mp, n_ctx=int(self.prefs.get("context") or self.caps.get("max_context", 2048)),
 								temperature=float(self.prefs.get("temperature", 0.7) or 0.7),
 								top_p=float(self.prefs.get("top_p", 0.9) or 0.9),
-								n_gpu_layers_override=int(self.prefs.get("gpu_layers") or 0))
+								n_gpu_layers_override=int(self.prefs.get("gpu_layers") or 0),
+								speculative=bool(self.prefs.get("speculative", False)),
+								use_cache=bool(self.prefs.get("response_cache", True)),
+								semantic_cache=get_semantic_cache() if self.prefs.get("semantic_cache") else None)
 				from verdant import run_benchmark
 				run_benchmark(ai, runs=1)
 				self.status_label.setText("Benchmark complete")
@@ -497,6 +583,7 @@ class MainWindow(QtWidgets.QMainWindow):
 	def _on_send(self):
 		if not self.input.toPlainText().strip(): return
 		prompt = self.input.toPlainText().strip()
+		self._last_raw_prompt = prompt
 		self.input.clear()
 		self.chat.add_bubble(prompt, sender="user")
 		try:
@@ -506,6 +593,7 @@ class MainWindow(QtWidgets.QMainWindow):
 				prompt = f"{presets[preset_name]}\n\n{prompt}"
 		except Exception:
 			pass
+		self.chat_history.append({"role": "user", "content": prompt})
 		self._start_generation(prompt)
 
 	def _on_stop(self):
@@ -513,6 +601,15 @@ class MainWindow(QtWidgets.QMainWindow):
 			self._worker.stop()
 			self.status_label.setText("Stopped")
 
+	def closeEvent(self, event):
+		# Cancel decoding first so closing the window frees the CPU immediately
+		if self._worker:
+			self._worker.stop()
+		if self._worker_thread and self._worker_thread.isRunning():
+			self._worker_thread.quit(); self._worker_thread.wait(2000)
+		self._lifecycle.close()
+		super().closeEvent(event)
+
 	def _start_generation(self, prompt: str):
 		self.status_label.setText("Generating…")
 		self.btn_stop.setEnabled(True)
@@ -522,28 +619,60 @@ class MainWindow(QtWidgets.QMainWindow):
 		try:
 			dl = ModelDownloader(); mp = dl.get_model_path(self.model_key)
 			if mp and not is_demo:
-				ai = AIInference(mp,
-								n_ctx=int(self.prefs.get("context") or self.caps.get("max_context", 2048)),
-								temperature=float(self.prefs.get("temperature", 0.7) or 0.7),
-								top_p=float(self.prefs.get("top_p", 0.9) or 0.9),
-								n_gpu_layers_override=int(self.prefs.get("gpu_layers") or 0))
+				ai = self._make_ai(mp, use_cache=bool(self.prefs.get("response_cache", True)),
+								semantic_cache=get_semantic_cache() if self.prefs.get("semantic_cache") else None)
+				self._lifecycle.touch(ai)
 		except Exception:
 			ai = None
 		self._run_stream(ai, prompt, is_demo or ai is None)
 
+	def _make_ai(self, mp: Path, use_cache: bool = True, semantic_cache=None) -> AIInference:
+		# Same settings (and so the same pooled model) for preloading and for Send
+		return AIInference(mp,
+						n_ctx=int(self.prefs.get("context") or self.caps.get("max_context", 2048)),
+						temperature=float(self.prefs.get("temperature", 0.7) or 0.7),
+						top_p=float(self.prefs.get("top_p", 0.9) or 0.9),
+						n_gpu_layers_override=int(self.prefs.get("gpu_layers") or 0),
+						speculative=bool(self.prefs.get("speculative", False)),
+						use_cache=use_cache,
+						semantic_cache=semantic_cache,
+						use_mmap=self.prefs.get("use_mmap"),
+						use_mlock=self.prefs.get("use_mlock"))
+
+	def _make_preload_ai(self) -> Optional[AIInference]:
+		if self.prefs.get("instant_demo", True):
+			return None  # demo replies never touch the model
+		mp = ModelDownloader().get_model_path(self.model_key)
+		return self._make_ai(mp, use_cache=False) if mp else None
+
+	def _transcript(self, ai: AIInference, max_tokens: int = 256) -> str:
+		pinned = None
+		try:
+			preset_name = self.prefs.get("active_preset")
+			if preset_name:
+				pinned = PresetsManager.load_presets().get(preset_name)
+		except Exception:
+			pass
+		return ai.pack_chat(self.chat_history, self._packer, max_tokens=max_tokens, pinned=pinned)
+
 	def _append_assistant_holder(self):
 		self.assist_row = QtWidgets.QHBoxLayout()
 		self.assist_row.setContentsMargins(0, 0, 0, 0)
 		self.assist_row.setSpacing(6)
 		b = Bubble("", sender="assistant")
-		self.assist_label = b.findChild(QtWidgets.QLabel)
+		self.assist_bubble = b
+		self._assist_text = ""
 		self.assist_row.addWidget(b, 0)
 		self.assist_row.addStretch(1)
 		self.chat.v.insertLayout(self.chat.v.count() - 1, self.assist_row)
 
 	def _run_stream(self, ai: Optional[AIInference], prompt: str, is_demo: bool):
+		self._summarizer.preempt()  # the user's reply goes first
 		self._worker_thread = QtCore.QThread(self)
-		self._worker = StreamWorker(ai, prompt, is_demo)
+		first_turn = sum(1 for m in self.chat_history if m["role"] == "user") == 1
+		self._worker = StreamWorker(ai, prompt, is_demo, transcript=None if is_demo else self._transcript(ai),
+									session_id=self.session_id,
+									semantic_prompt=self._last_raw_prompt if first_turn else None)
 		self._worker.moveToThread(self._worker_thread)
 		self._worker_thread.started.connect(self._worker.run)
 		self._worker.chunk.connect(self._on_chunk)
@@ -553,12 +682,21 @@ class MainWindow(QtWidgets.QMainWindow):
 
 	@QtCore.Slot(str)
 	def _on_chunk(self, ch: str):
-		old = self.assist_label.text(); self.assist_label.setText(old + ch); self.chat._scroll_to_bottom()
+		self._assist_text += ch
+		self.assist_bubble.view.setPlainText(self._assist_text); self.chat._scroll_to_bottom()
 
 	@QtCore.Slot()
 	def _on_finish(self):
 		self.status_label.setText("Done"); self.btn_stop.setEnabled(False)
-		self._update_eco(estimate_tokens=len(self.assist_label.text().split()))
+		self.chat_history.append({"role": "assistant", "content": self._assist_text})
+		self.assist_bubble.view.setHtml(self.assist_bubble._to_html(self._assist_text))
+		ai = self._worker.ai if self._worker else None
+		if ai is not None and ai.last_prefix_hit:
+			self.status_label.setText(f"Done • ♻️ {ai.last_prefix_hit} prompt tokens reused")
+		if ai is not None and not self._worker.is_demo:
+			self._lifecycle.touch(ai)
+			self._summarizer.schedule(ai, self.chat_history)
+		self._update_eco(tokens=self._worker.tokens if self._worker else count_tokens(self._assist_text))
 		if self._worker_thread:
 			self._worker_thread.quit(); self._worker_thread.wait()
 
@@ -568,11 +706,15 @@ class MainWindow(QtWidgets.QMainWindow):
 		if self._worker_thread:
 			self._worker_thread.quit(); self._worker_thread.wait()
 
-	def _update_eco(self, estimate_tokens: int):
+	def _update_eco(self, tokens: int):
 		try:
-			self.eco_saved_tokens += max(1, int(estimate_tokens))
+			self.eco_saved_tokens += max(0, int(tokens))
 			saved_wh = self.eco_saved_tokens * 1e-4 * 0.95
-			self.eco_label.setText(f"🌿 {saved_wh:.2f} Wh")
+			text = f"🌿 {saved_wh:.2f} Wh"
+			cache = cache_meter_stats()
+			if cache["cached"] or cache["generated"]:
+				text += f" • ♻️ {cache['cached']} cached / {cache['generated']} new"
+			self.eco_label.setText(text)
 		except Exception:
 			pass
 
@@ -611,13 +753,22 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.chat.v.setContentsMargins(12,12,12,12)
 		self.chat.v.setSpacing(8)
 		self.chat.v.addStretch(1)
+		self.chat_history = []
+		self.session_id = uuid.uuid4().hex
+		self._reset_memory()
 		self.status_label.setText("New chat started")
 		self._rebuild_chat_list()
 
+	def _reset_memory(self, memory=None):
+		self._summarizer.preempt()
+		self._packer = ContextPacker()
+		self._packer.memory = memory
+		self._summarizer = RollingSummarizer(self._packer)
+
 	def _save_chat(self):
 		path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save chat", str(self.sessions_dir / "chat.json"), "JSON (*.json)")
 		if not path: return
-		data = {"history": self._history(), "saved_at": QtCore.QDateTime.currentDateTime().toSecsSinceEpoch(), "version": "1.0"}
+		data = {"history": self._history(), "session_id": self.session_id, "memory": self._packer.memory, "saved_at": QtCore.QDateTime.currentDateTime().toSecsSinceEpoch(), "version": "1.0"}
 		Path(path).write_text(__import__("json").dumps(data, indent=2), encoding="utf-8")
 		self._rebuild_chat_list(); self.status_label.setText("Chat saved"); self._toast_msg("Saved")
 
@@ -628,29 +779,23 @@ class MainWindow(QtWidgets.QMainWindow):
 		try:
 			data = __import__("json").loads(path.read_text(encoding="utf-8"))
 			self._load_history(data.get("history", []))
+			# Reuse the chat's cached KV state on the next send instead of re-prefilling
+			self.session_id = data.get("session_id") or path.stem
+			self._packer.memory = data.get("memory")
 			self.status_label.setText(f"Loaded {path.name}")
 			self._toast_msg(f"Loaded {path.stem}")
 		except Exception as e:
 			self.status_label.setText(f"Load failed: {e}")
 
 	def _history(self):
-		# Extract chat bubbles to a list of role/content dicts
-		hist = []
-		for i in range(self.chat.v.count()-1):
-			item = self.chat.v.itemAt(i)
-			row = item.layout()
-			if not row: continue
-			w = row.itemAt(0).widget()
-			if not isinstance(w, Bubble): continue
-			label = w.findChild(QtWidgets.QLabel)
-			role = "assistant" if w.styleSheet().find(BUBBLE_ASSIST) != -1 else "user"
-			hist.append({"role": role, "content": label.text()})
-		return hist
+		# Role/content dicts, exactly as sent to the model
+		return list(self.chat_history)
 	def _load_history(self, hist):
 		# Clear and rebuild
 		self._new_chat()
 		for msg in hist:
 			self.chat.add_bubble(msg.get("content",""), sender=(msg.get("role") or "assistant"))
+		self.chat_history = [m for m in hist if m.get("role") in ("user", "assistant")]
 
 	def _export_markdown(self):
 		path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Markdown", str(self.sessions_dir / "chat.md"), "Markdown (*.md)")